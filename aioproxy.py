@@ -0,0 +1,284 @@
+"""asyncio counterpart of authproxy.AuthServiceProxy.
+
+AsyncAuthServiceProxy keeps the `proxy.method(*args)` calling convention, with
+each call returning a coroutine:
+
+- keeps a pool of keep-alive HTTP/1.1 connections shared by derived proxies
+- parses all JSON numbers that look like floats as Decimal
+- raises JSONRPCException exactly as AuthServiceProxy does
+- supports JSON-RPC batches
+"""
+
+import asyncio
+import base64
+import decimal
+import itertools
+import json
+import logging
+import urllib.parse
+from http import HTTPStatus
+
+import metrics
+from authproxy import HTTP_TIMEOUT, USER_AGENT, EncodeDecimal, JSONRPCException
+
+DEFAULT_POOL_SIZE = 4
+
+log = logging.getLogger("BitcoinRPC")
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # Whether it has been idle in the pool, and whether any of the response to
+        # the current request has arrived
+        self.reused = False
+        self.received = False
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool:
+    """
+    Up to `size` keep-alive connections, opened on demand. Callers wait for a free
+    connection once all of them are in use.
+    """
+
+    def __init__(self, url, size=DEFAULT_POOL_SIZE):
+        self.url = url
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(size)
+
+    async def checkout(self, fresh=False):
+        await self._semaphore.acquire()
+        if self._idle and not fresh:
+            conn = self._idle.pop()
+            conn.received = False
+            return conn
+        try:
+            port = self.url.port or (443 if self.url.scheme == "https" else 80)
+            reader, writer = await asyncio.open_connection(
+                self.url.hostname, port, ssl=self.url.scheme == "https" or None
+            )
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return _Connection(reader, writer)
+
+    def checkin(self, conn, reusable=True):
+        if reusable:
+            conn.reused = True
+            self._idle.append(conn)
+        else:
+            conn.close()
+        self._semaphore.release()
+
+    async def close(self):
+        while self._idle:
+            conn = self._idle.pop()
+            conn.close()
+            await conn.writer.wait_closed()
+
+
+async def _read_response(conn):
+    """
+    Read one HTTP/1.1 response. Returns (status, reason, headers, body, keep_alive).
+    """
+    reader = conn.reader
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("connection closed by server")
+    conn.received = True
+    # The reason phrase may be empty, or missing along with its separator
+    _, _, status_reason = status_line.decode("latin-1").rstrip("\r\n").partition(" ")
+    status, _, reason = status_reason.partition(" ")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, value = line.decode("latin-1").split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = headers.get("connection", "").lower() != "close"
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Skip any trailers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return int(status), reason, headers, bytes(body), keep_alive
+
+
+class AsyncAuthServiceProxy:
+    __id_count = itertools.count(1)
+
+    # ensure_ascii: escape unicode as \uXXXX, passed to json.dumps
+    def __init__(
+        self,
+        service_url,
+        service_name=None,
+        timeout=HTTP_TIMEOUT,
+        pool=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        ensure_ascii=True,
+    ):
+        self.__service_url = service_url
+        self._service_name = service_name
+        self.ensure_ascii = ensure_ascii
+        self.__url = urllib.parse.urlparse(service_url)
+        authpair = "%s:%s" % (self.__url.username, self.__url.password)
+        self.__auth_header = "Basic " + base64.b64encode(authpair.encode("utf8")).decode("ascii")
+        self.timeout = timeout
+        self._pool = pool or AsyncConnectionPool(self.__url, pool_size)
+
+    def __getattr__(self, name):
+        if name.startswith("__") and name.endswith("__"):
+            # Python internal stuff
+            raise AttributeError
+        if self._service_name is not None:
+            name = "%s.%s" % (self._service_name, name)
+        return AsyncAuthServiceProxy(
+            self.__service_url, name, timeout=self.timeout, pool=self._pool,
+            ensure_ascii=self.ensure_ascii,
+        )
+
+    async def _exchange(self, conn, request):
+        conn.writer.write(request)
+        await conn.writer.drain()
+        return await _read_response(conn)
+
+    async def _request(self, postdata):
+        """
+        POST `postdata` on a pooled connection. If a connection reused from the
+        pool turns out to have been closed by the server while idle, i.e. it fails
+        before any of the response arrives, the request is retried once on a fresh
+        one. A response cut short is never retried.
+        """
+        path = self.__url.path or "/"
+        request = (
+            "POST %s HTTP/1.1\r\n"
+            "Host: %s\r\n"
+            "User-Agent: %s\r\n"
+            "Authorization: %s\r\n"
+            "Content-type: application/json\r\n"
+            "Content-Length: %i\r\n"
+            "\r\n" % (path, self.__url.hostname, USER_AGENT, self.__auth_header, len(postdata))
+        ).encode("latin-1") + postdata
+
+        for fresh in (False, True):
+            conn = await self._pool.checkout(fresh)
+            try:
+                status, reason, headers, body, keep_alive = await asyncio.wait_for(
+                    self._exchange(conn, request), self.timeout
+                )
+            except asyncio.TimeoutError:
+                self._pool.checkin(conn, reusable=False)
+                raise JSONRPCException(
+                    {
+                        "code": -344,
+                        "message": "%r RPC took longer than %f seconds. Consider "
+                        "using larger timeout for calls that take "
+                        "longer to return." % (self._service_name, self.timeout),
+                    }
+                )
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self._pool.checkin(conn, reusable=False)
+                if not conn.reused or conn.received:
+                    raise
+                continue
+            except BaseException:
+                self._pool.checkin(conn, reusable=False)
+                raise
+            self._pool.checkin(conn, reusable=keep_alive)
+            break
+
+        if headers.get("content-type") != "application/json":
+            raise JSONRPCException(
+                {
+                    "code": -342,
+                    "message": "non-JSON HTTP response with '%i %s' from server"
+                    % (status, reason),
+                },
+                status,
+            )
+        method = self._service_name or "batch"
+        metrics.inc("rpc_received_bytes", len(body), method=method)
+        with metrics.timer("json_decode", method=method):
+            return json.loads(body.decode("utf8"), parse_float=decimal.Decimal), status
+
+    def get_request(self, *args, **argsn):
+        request_id = next(AsyncAuthServiceProxy.__id_count)
+        log.debug(
+            "-{}-> {} {}".format(
+                request_id,
+                self._service_name,
+                json.dumps(
+                    args or argsn, default=EncodeDecimal, ensure_ascii=self.ensure_ascii
+                ),
+            )
+        )
+        if args and argsn:
+            raise ValueError("Cannot handle both named and positional arguments")
+        return {
+            "version": "1.1",
+            "method": self._service_name,
+            "params": args or argsn,
+            "id": request_id,
+        }
+
+    async def __call__(self, *args, **argsn):
+        postdata = json.dumps(
+            self.get_request(*args, **argsn),
+            default=EncodeDecimal,
+            ensure_ascii=self.ensure_ascii,
+        )
+        with metrics.timer("rpc", method=self._service_name):
+            response, status = await self._request(postdata.encode("utf-8"))
+        if response["error"] is not None:
+            raise JSONRPCException(response["error"], status)
+        elif "result" not in response:
+            raise JSONRPCException(
+                {"code": -343, "message": "missing JSON-RPC result"}, status
+            )
+        elif status != HTTPStatus.OK:
+            raise JSONRPCException(
+                {
+                    "code": -342,
+                    "message": "non-200 HTTP status code but no JSON-RPC error",
+                },
+                status,
+            )
+        else:
+            return response["result"]
+
+    async def batch(self, rpc_call_list):
+        postdata = json.dumps(
+            list(rpc_call_list), default=EncodeDecimal, ensure_ascii=self.ensure_ascii
+        )
+        log.debug("--> " + postdata)
+        with metrics.timer("rpc", method="batch"):
+            response, status = await self._request(postdata.encode("utf-8"))
+        if status != HTTPStatus.OK:
+            raise JSONRPCException(
+                {
+                    "code": -342,
+                    "message": "non-200 HTTP status code but no JSON-RPC error",
+                },
+                status,
+            )
+        return response
+
+    async def close(self):
+        await self._pool.close()
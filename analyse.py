@@ -1,10 +1,27 @@
 import math
+
+import attr
+import numpy as np
 from tabulate import tabulate
 
+import metrics
+from consensus import WITNESS_SCALE_FACTOR
+
+# Hash power in percent for the reorg grid
+HASH_POWERS = np.arange(1, 60.5, 0.5)
+
+# Hash power in percent of the reorg rows in the printed table
+REPORTED_HASH_POWERS = [5, 10, 25, 50]
+
+# Abramowitz and Stegun 7.1.26 coefficients, max absolute error 1.5e-7
+_ERF_P = 0.3275911
+_ERF_A = (0.254829592, -0.284496736, 1.421413741, -1.453152027, 1.061405429)
+
 
 def estimate_reorg(val, hash_pow):
     """
-    Estimate how likely someone is to perhaps try a re-org.
+    Estimate how likely someone is to perhaps try a re-org. Scalar reference for
+    `reorg_chances`.
     """
     # Error function: https://en.wikipedia.org/wiki/Error_function
 
@@ -19,7 +36,142 @@ def estimate_reorg(val, hash_pow):
     return math.erf(val - scale)
 
 
-def print_blocks(blocks: list):
+def erf(x):
+    """
+    Vectorized error function, see `_ERF_A`
+    """
+    x = np.asarray(x, dtype=np.float64)
+    t = 1.0 / (1.0 + _ERF_P * np.abs(x))
+    a1, a2, a3, a4, a5 = _ERF_A
+    y = 1.0 - ((((a5 * t + a4) * t + a3) * t + a2) * t + a1) * t * np.exp(-x * x)
+    return np.sign(x) * y
+
+
+def reorg_chances(reward_ratios, hash_powers=HASH_POWERS):
+    """
+    `estimate_reorg` for every combination, with `erf` in place of `math.erf`.
+    Returns an array of shape (len(reward_ratios), len(hash_powers))
+    """
+    reward_ratios = np.asarray(reward_ratios, dtype=np.float64)
+    scales = 75 / np.asarray(hash_powers, dtype=np.float64)
+    return erf(reward_ratios[:, np.newaxis] - scales[np.newaxis, :])
+
+
+@attr.s
+class ReorgGrid(object):
+    """
+    Reorg chances for every pair of blocks (earlier, later) at every hash power:
+    the chance a miner re-mines `earlier` rather than building on to `later`.
+    `pairs` holds indices into `heights`, `chance` has one row per pair.
+    """
+    heights = attr.ib()
+    hash_powers = attr.ib()
+    pairs = attr.ib()
+    ratios = attr.ib()
+    chance = attr.ib()
+
+    @classmethod
+    def from_blocks(cls, blocks: list, hash_powers=HASH_POWERS):
+        blocks = sorted(blocks, key=lambda block: block.height)
+        rewards = np.array([block.reward for block in blocks], dtype=np.float64)
+        earlier, later = np.triu_indices(len(blocks), k=1)
+        ratios = rewards[earlier] / rewards[later]
+        return cls(
+            heights=np.array([block.height for block in blocks]),
+            hash_powers=np.asarray(hash_powers, dtype=np.float64),
+            pairs=np.stack([earlier, later], axis=1),
+            ratios=ratios,
+            chance=reorg_chances(ratios, hash_powers),
+        )
+
+    def consecutive(self) -> np.ndarray:
+        """
+        Rows of `chance` for each block against the block after it
+        """
+        return self.chance[self.pairs[:, 1] - self.pairs[:, 0] == 1]
+
+    def against(self, index: int) -> np.ndarray:
+        """
+        Rows of `chance` for block `index` against each later block
+        """
+        return self.chance[self.pairs[:, 0] == index]
+
+    def save(self, path):
+        np.savez_compressed(
+            path, heights=self.heights, hash_powers=self.hash_powers,
+            pairs=self.pairs, ratios=self.ratios, chance=self.chance,
+        )
+
+
+@attr.s
+class SnipingResult(object):
+    """
+    Outcome of each simulated fee-sniping race. `gain` is the sniper's reward
+    less what mining honestly would have been expected to earn over the same blocks.
+    """
+    hash_power = attr.ib(type=float)
+    won = attr.ib()
+    blocks = attr.ib()
+    gain = attr.ib()
+
+    @property
+    def success_rate(self) -> float:
+        return float(self.won.mean())
+
+    @property
+    def mean_gain(self) -> float:
+        return float(self.gain.mean())
+
+
+def simulate_fee_sniping(
+    blocks: list, hash_power: float, runs: int = 10_000, horizon: int = 6,
+    max_deficit: int = 2, fee_noise: float = 0.2, seed=None,
+) -> SnipingResult:
+    """
+    Monte-Carlo simulation of a miner with `hash_power` percent of the hash rate
+    re-mining `blocks[0]`, the tip, to take its fees, racing the honest chain
+    built on it. `blocks[1:]` are the projected blocks which follow; each run
+    draws its own chain by scaling projected fees by lognormal noise, repeating
+    the last block if the race outlasts the projection.
+
+    The sniper starts one block behind and wins once one block ahead. It gives up
+    when `max_deficit` blocks behind or after `horizon` blocks in total.
+    """
+    rng = np.random.default_rng(seed)
+    alpha = hash_power / 100
+    blocks = sorted(blocks, key=lambda block: block.height)
+
+    subsidies = np.array([block.subsidy for block in blocks], dtype=np.float64)
+    fees = np.array([block.fee for block in blocks], dtype=np.float64)
+    # Rewards of the tip and up to `horizon` blocks after it, for every run
+    index = np.minimum(np.arange(horizon + 1), len(blocks) - 1)
+    noise = rng.lognormal(0.0, fee_noise, size=(runs, horizon + 1))
+    rewards = subsidies[index] + fees[index] * noise
+
+    # +1 for each block the sniper finds, -1 for each honest block
+    found = rng.random((runs, horizon)) < alpha
+    lead = np.cumsum(np.where(found, 1, -1), axis=1) - 1
+    ahead = lead >= 1
+    behind = lead < -max_deficit
+    first_ahead = np.where(ahead.any(axis=1), ahead.argmax(axis=1), horizon)
+    first_behind = np.where(behind.any(axis=1), behind.argmax(axis=1), horizon)
+    won = first_ahead < first_behind
+    steps = np.minimum(np.minimum(first_ahead, first_behind) + 1, horizon)
+
+    # The sniper's k-th block earns the reward of height tip + k
+    sniper_blocks = np.cumsum(found, axis=1)[np.arange(runs), steps - 1]
+    cumulative = np.concatenate([np.zeros((runs, 1)), np.cumsum(rewards, axis=1)], axis=1)
+    sniped = np.where(won, cumulative[np.arange(runs), sniper_blocks], 0.0)
+    honest = alpha * (cumulative[np.arange(runs), steps + 1] - rewards[:, 0])
+
+    return SnipingResult(hash_power=hash_power, won=won, blocks=steps, gain=sniped - honest)
+
+
+def annotate_blocks(blocks: list) -> list:
+    """
+    Sort blocks by height and set each one's reward ratio to, and reorg chances
+    against, the block before it
+    """
     blocks = sorted(blocks, key=lambda block: block.height)
 
     for i in range(len(blocks)):
@@ -28,19 +180,43 @@ def print_blocks(blocks: list):
         else:
             blocks[i].ratio = blocks[i].reward / blocks[i-1].reward
 
-    # Estimated reorg probability for 10, 25 and 50% hashpower miners
-    for i in range(len(blocks)):
-        if i == 0:
-            blocks[i].reorg5 = 0
-            blocks[i].reorg10 = 0
-            blocks[i].reorg25 = 0
-            blocks[i].reorg50 = 0
-        else:
-            reward_diff = blocks[i-1].reward / blocks[i].reward
-            blocks[i].reorg5 = estimate_reorg(reward_diff, 5)
-            blocks[i].reorg10 = estimate_reorg(reward_diff, 10)
-            blocks[i].reorg25 = estimate_reorg(reward_diff, 25)
-            blocks[i].reorg50 = estimate_reorg(reward_diff, 50)
+    # Estimated reorg probability for 5, 10, 25 and 50% hashpower miners
+    rewards = np.array([block.reward for block in blocks], dtype=np.float64)
+    chances = np.zeros((len(blocks), len(REPORTED_HASH_POWERS)))
+    if len(blocks) > 1:
+        chances[1:] = reorg_chances(rewards[:-1] / rewards[1:], REPORTED_HASH_POWERS)
+    for block, (reorg5, reorg10, reorg25, reorg50) in zip(blocks, chances.tolist()):
+        block.reorg5, block.reorg10, block.reorg25, block.reorg50 = reorg5, reorg10, reorg25, reorg50
+
+    return blocks
+
+
+def block_record(block) -> dict:
+    """
+    Summary of an annotated block for time-series output
+    """
+    return {
+        "height": block.height,
+        "tip_offset": block.tip_offset,
+        "reward": block.reward,
+        "fee": block.fee,
+        "weight": block.weight,
+        "ratio": block.ratio,
+        "reorg5": block.reorg5,
+        "reorg10": block.reorg10,
+        "reorg25": block.reorg25,
+        "reorg50": block.reorg50,
+    }
+
+
+@metrics.timed("render")
+def print_blocks(blocks: list, histogram=None):
+    """
+    Print a table comparing any number of confirmed, template and projected blocks.
+    With a mempool `histogram`, also show how much of the mempool pays at least
+    each block's average fee rate.
+    """
+    blocks = annotate_blocks(blocks)
 
     table = [
         ["tip offset"],             # 0
@@ -50,7 +226,7 @@ def print_blocks(blocks: list):
         ["fee / block reward"],     # 4
         ["reward / prev block"],    # 5
         ["weight"],                 # 6
-        ["sigops", "N/A", "N/A"],   # 7
+        ["sigops"],                 # 7
         ["reorg chance 5% hash"],       # 8
         ["reorg chance 10% hash"],       # 9
         ["reorg chance 25% hash"],       # 10
@@ -64,12 +240,18 @@ def print_blocks(blocks: list):
     table[4].extend([f"{100*(block.fee / block.reward):.3}" for block in blocks])
     table[5].extend([f"{100*block.ratio:.3f}" for block in blocks])
     table[6].extend([f"{block.weight:,}" for block in blocks])
-    table[7].extend([f"{block.sigopscost:,}" for block in blocks[2:]])
+    table[7].extend([f"{block.sigopscost:,}" if block.template else "N/A" for block in blocks])
     table[8].extend([f"{block.reorg5:.5f}" for block in blocks])
     table[9].extend([f"{block.reorg10:.5f}" for block in blocks])
     table[10].extend([f"{block.reorg25:.5f}" for block in blocks])
     table[11].extend([f"{block.reorg50:.5f}" for block in blocks])
 
+    if histogram is not None:
+        # vsize from weight, as confirmed blocks report size in bytes
+        fee_rates = [block.fee / (block.weight / WITNESS_SCALE_FACTOR) for block in blocks]
+        table.append(["fee rate sat/vB"] + [f"{fee_rate:.2f}" for fee_rate in fee_rates])
+        table.append(["mempool vB >= fee rate"] + [f"{histogram.vsize_above(fee_rate):,}" for fee_rate in fee_rates])
+
     table_headers = ["block:"]
     table_headers.extend([block.height for block in blocks])
 
@@ -80,3 +262,20 @@ def print_blocks(blocks: list):
         f"\n{tabulate(table, headers=table_headers, tablefmt='github', colalign=align)}\n"
     )
 
+
+def print_fee_sniping(blocks: list, runs: int, hash_powers=REPORTED_HASH_POWERS, seed=None):
+    """
+    Print a summary of `simulate_fee_sniping` against the first of `blocks` for
+    each of `hash_powers`
+    """
+    rows = []
+    for hash_power in hash_powers:
+        result = simulate_fee_sniping(blocks, hash_power, runs=runs, seed=seed)
+        rows.append([
+            f"{hash_power}%",
+            f"{100 * result.success_rate:.2f}%",
+            f"{result.mean_gain:,.0f}",
+            f"{result.blocks.mean():.2f}",
+        ])
+    headers = ["hash power", "sniping wins", "mean gain vs honest", "mean race blocks"]
+    print(f"\n{tabulate(rows, headers=headers, tablefmt='github')}\n")
@@ -40,10 +40,14 @@ import http.client
 import json
 import logging
 import os
+import queue
 import socket
+import threading
 import time
 import urllib.parse
 
+import metrics
+
 HTTP_TIMEOUT = 30
 USER_AGENT = "AuthServiceProxy/0.1"
 
@@ -67,10 +71,91 @@ def EncodeDecimal(o):
     raise TypeError(repr(o) + " is not JSON serializable")
 
 
+def _new_connection(url, timeout):
+    port = 80 if url.port is None else url.port
+    if url.scheme == "https":
+        return http.client.HTTPSConnection(url.hostname, port, timeout=timeout)
+    return http.client.HTTPConnection(url.hostname, port, timeout=timeout)
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of keep-alive HTTP connections, opened lazily.
+    A connection is checked out by one thread for the duration of a request, so
+    proxies sharing a pool can make calls from several threads at once. Waiting
+    longer than `checkout_timeout` for a free connection raises.
+    """
+
+    def __init__(self, url, size, timeout=HTTP_TIMEOUT, checkout_timeout=None):
+        self.url = url
+        self.timeout = timeout
+        self.checkout_timeout = timeout if checkout_timeout is None else checkout_timeout
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(None)
+
+    def checkout(self):
+        try:
+            conn = self._idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise JSONRPCException(
+                {
+                    "code": -345,
+                    "message": "no pooled connection free after %f seconds, "
+                    "are streamed responses being closed?" % self.checkout_timeout,
+                }
+            )
+        if conn is None:
+            conn = _new_connection(self.url, self.timeout)
+        return conn
+
+    def checkin(self, conn):
+        self._idle.put(conn)
+
+
+class _PooledResponse:
+    """
+    A streamed HTTP response which returns its connection to the pool once it has
+    been read to the end. If it is closed or collected before then, the socket
+    still has unread data on it, so it is dropped and the pool gets a fresh
+    connection in its place.
+    """
+
+    def __init__(self, http_response, pool, conn):
+        self._response = http_response
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if amt is None or not data or self._response.isclosed():
+            self._release(self._conn)
+        return data
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._release(None)
+        self._response.close()
+
+    def __del__(self):
+        self.close()
+
+    def _release(self, conn):
+        if self._conn is not None:
+            self._conn = None
+            self._pool.checkin(conn)
+
+
 class AuthServiceProxy:
     __id_count = 0
+    __id_lock = threading.Lock()
 
     # ensure_ascii: escape unicode as \uXXXX, passed to json.dumps
+    # pool_size: share N keep-alive connections between threads instead of one
     def __init__(
         self,
         service_url,
@@ -78,6 +163,8 @@ class AuthServiceProxy:
         timeout=HTTP_TIMEOUT,
         connection=None,
         ensure_ascii=True,
+        pool_size=None,
+        pool=None,
     ):
         self.__service_url = service_url
         self._service_name = service_name
@@ -92,7 +179,14 @@ class AuthServiceProxy:
         authpair = user + b":" + passwd
         self.__auth_header = b"Basic " + base64.b64encode(authpair)
         self.timeout = timeout
-        self._set_conn(connection)
+        if pool is None and pool_size:
+            pool = ConnectionPool(self.__url, pool_size, timeout)
+        self._pool = pool
+        if pool is None:
+            self._set_conn(connection)
+        else:
+            self.__conn = None
+            self.timeout = pool.timeout
 
     def __getattr__(self, name):
         if name.startswith("__") and name.endswith("__"):
@@ -100,12 +194,15 @@ class AuthServiceProxy:
             raise AttributeError
         if self._service_name is not None:
             name = "%s.%s" % (self._service_name, name)
-        return AuthServiceProxy(self.__service_url, name, connection=self.__conn)
+        return AuthServiceProxy(
+            self.__service_url, name, connection=self.__conn, pool=self._pool
+        )
 
-    def _request(self, method, path, postdata):
+    def _request(self, method, path, postdata, stream=False):
         """
         Do a HTTP request, with retry if we get disconnected (e.g. due to a timeout).
         This is a workaround for https://bugs.python.org/issue3566 which is fixed in Python 3.5.
+        If `stream` is set, the unread HTTP response is returned instead of the decoded body.
         """
         headers = {
             "Host": self.__url.hostname,
@@ -113,20 +210,37 @@ class AuthServiceProxy:
             "Authorization": self.__auth_header,
             "Content-type": "application/json",
         }
-        if os.name == "nt":
-            # Windows somehow does not like to re-use connections
-            # TODO: Find out why the connection would disconnect occasionally and make it reusable on Windows
-            # Avoid "ConnectionAbortedError: [WinError 10053] An established connection was aborted by the software in your host machine"
-            self._set_conn()
+        if self._pool is None:
+            if os.name == "nt":
+                # Windows somehow does not like to re-use connections
+                # TODO: Find out why the connection would disconnect occasionally and make it reusable on Windows
+                # Avoid "ConnectionAbortedError: [WinError 10053] An established connection was aborted by the software in your host machine"
+                self._set_conn()
+            return self._send(self.__conn, method, path, postdata, headers, stream)
+
+        conn = self._pool.checkout()
+        try:
+            response, status = self._send(conn, method, path, postdata, headers, stream)
+        except BaseException:
+            # Drop the socket so the next user of this connection reconnects
+            conn.close()
+            self._pool.checkin(conn)
+            raise
+        if stream:
+            return _PooledResponse(response, self._pool, conn), status
+        self._pool.checkin(conn)
+        return response, status
+
+    def _send(self, conn, method, path, postdata, headers, stream):
         try:
-            self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
+            conn.request(method, path, postdata, headers)
+            return self._get_response(conn, stream)
         except (BrokenPipeError, ConnectionResetError):
             # Python 3.5+ raises BrokenPipeError when the connection was reset
             # ConnectionResetError happens on FreeBSD
-            self.__conn.close()
-            self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
+            conn.close()
+            conn.request(method, path, postdata, headers)
+            return self._get_response(conn, stream)
         except OSError as e:
             retry = (
                 "[WinError 10053] An established connection was aborted by the software in your host machine"
@@ -135,18 +249,20 @@ class AuthServiceProxy:
             # Workaround for a bug on macOS. See https://bugs.python.org/issue33450
             retry = retry or ("[Errno 41] Protocol wrong type for socket" in str(e))
             if retry:
-                self.__conn.close()
-                self.__conn.request(method, path, postdata, headers)
-                return self._get_response()
+                conn.close()
+                conn.request(method, path, postdata, headers)
+                return self._get_response(conn, stream)
             else:
                 raise
 
     def get_request(self, *args, **argsn):
-        AuthServiceProxy.__id_count += 1
+        with AuthServiceProxy.__id_lock:
+            AuthServiceProxy.__id_count += 1
+            request_id = AuthServiceProxy.__id_count
 
         log.debug(
             "-{}-> {} {}".format(
-                AuthServiceProxy.__id_count,
+                request_id,
                 self._service_name,
                 json.dumps(
                     args or argsn, default=EncodeDecimal, ensure_ascii=self.ensure_ascii
@@ -159,7 +275,7 @@ class AuthServiceProxy:
             "version": "1.1",
             "method": self._service_name,
             "params": args or argsn,
-            "id": AuthServiceProxy.__id_count,
+            "id": request_id,
         }
 
     def __call__(self, *args, **argsn):
@@ -168,9 +284,10 @@ class AuthServiceProxy:
             default=EncodeDecimal,
             ensure_ascii=self.ensure_ascii,
         )
-        response, status = self._request(
-            "POST", self.__url.path, postdata.encode("utf-8")
-        )
+        with metrics.timer("rpc", method=self._service_name):
+            response, status = self._request(
+                "POST", self.__url.path, postdata.encode("utf-8")
+            )
         if response["error"] is not None:
             raise JSONRPCException(response["error"], status)
         elif "result" not in response:
@@ -188,14 +305,33 @@ class AuthServiceProxy:
         else:
             return response["result"]
 
+    def stream(self, *args, **argsn):
+        """
+        Send the call and return the unread `http.client.HTTPResponse`, for callers
+        that parse the body incrementally. It must be read to the end before the
+        connection is used again.
+        """
+        postdata = json.dumps(
+            self.get_request(*args, **argsn),
+            default=EncodeDecimal,
+            ensure_ascii=self.ensure_ascii,
+        )
+        # Times the wait for the response headers only, the body is read by the caller
+        with metrics.timer("rpc", method=self._service_name):
+            http_response, status = self._request(
+                "POST", self.__url.path, postdata.encode("utf-8"), stream=True
+            )
+        return http_response
+
     def batch(self, rpc_call_list):
         postdata = json.dumps(
             list(rpc_call_list), default=EncodeDecimal, ensure_ascii=self.ensure_ascii
         )
         log.debug("--> " + postdata)
-        response, status = self._request(
-            "POST", self.__url.path, postdata.encode("utf-8")
-        )
+        with metrics.timer("rpc", method="batch"):
+            response, status = self._request(
+                "POST", self.__url.path, postdata.encode("utf-8")
+            )
         if status != HTTPStatus.OK:
             raise JSONRPCException(
                 {
@@ -206,17 +342,17 @@ class AuthServiceProxy:
             )
         return response
 
-    def _get_response(self):
+    def _get_response(self, conn, stream=False):
         req_start_time = time.time()
         try:
-            http_response = self.__conn.getresponse()
+            http_response = conn.getresponse()
         except socket.timeout:
             raise JSONRPCException(
                 {
                     "code": -344,
                     "message": "%r RPC took longer than %f seconds. Consider "
                     "using larger timeout for calls that take "
-                    "longer to return." % (self._service_name, self.__conn.timeout),
+                    "longer to return." % (self._service_name, conn.timeout),
                 }
             )
         if http_response is None:
@@ -235,8 +371,18 @@ class AuthServiceProxy:
                 http_response.status,
             )
 
-        responsedata = http_response.read().decode("utf8")
-        response = json.loads(responsedata, parse_float=decimal.Decimal)
+        method = self._service_name or "batch"
+        if stream:
+            content_length = http_response.getheader("Content-Length")
+            if content_length is not None:
+                metrics.inc("rpc_received_bytes", int(content_length), method=method)
+            return http_response, http_response.status
+
+        body = http_response.read()
+        metrics.inc("rpc_received_bytes", len(body), method=method)
+        responsedata = body.decode("utf8")
+        with metrics.timer("json_decode", method=method):
+            response = json.loads(responsedata, parse_float=decimal.Decimal)
         elapsed = time.time() - req_start_time
         if "error" in response and response["error"] is None:
             log.debug(
@@ -260,18 +406,12 @@ class AuthServiceProxy:
             "{}/{}".format(self.__service_url, relative_uri),
             self._service_name,
             connection=self.__conn,
+            pool=self._pool,
         )
 
     def _set_conn(self, connection=None):
-        port = 80 if self.__url.port is None else self.__url.port
         if connection:
             self.__conn = connection
             self.timeout = connection.timeout
-        elif self.__url.scheme == "https":
-            self.__conn = http.client.HTTPSConnection(
-                self.__url.hostname, port, timeout=self.timeout
-            )
         else:
-            self.__conn = http.client.HTTPConnection(
-                self.__url.hostname, port, timeout=self.timeout
-            )
+            self.__conn = _new_connection(self.__url, self.timeout)
@@ -0,0 +1,206 @@
+"""
+Backtest block projection over archived mempool snapshots.
+
+An archive is a directory holding, for each chain tip height H at which a snapshot
+was taken:
+
+- `mempool-H.bin` (see `Mempool.save`) or `mempool-H.json` (`getrawmempool True`)
+- `template-H.json`, the `getblocktemplate` result for H + 1
+- optionally `stats-(H+2).json`, the `getblockstats` result for the block actually
+  mined at H + 2. Without it the fee is fetched over RPC if `--rpc` is given.
+
+For each height the template is removed from the mempool, as in `mempool-tool`,
+and the tip + 2 block we project is compared with the real one.
+"""
+import argparse
+import csv
+import decimal
+import glob
+import json
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
+
+import miner
+from block import Block
+from mempool import Mempool
+
+
+logger = logging.getLogger(__name__)
+
+FIELDS = [
+    "height",
+    "mempool_size",
+    "template_fee",
+    "projected_fee",
+    "projected_weight",
+    "projected_tx",
+    "actual_fee",
+    "fee_delta",
+    "fee_ratio",
+    "seconds",
+]
+
+
+def _path(archive, kind: str, height: int, extension: str = "json"):
+    return os.path.join(archive, f"{kind}-{height}.{extension}")
+
+
+def archive_heights(archive) -> list:
+    """
+    Tip heights with a template in `archive`, ascending
+    """
+    heights = []
+    for path in glob.glob(os.path.join(archive, "template-*.json")):
+        match = re.fullmatch(r"template-(\d+)\.json", os.path.basename(path))
+        if match:
+            heights.append(int(match.group(1)))
+    return sorted(heights)
+
+
+def archive_snapshot(archive, height: int, mempool: Mempool, template: Block):
+    """
+    Add the mempool and template at tip `height` to `archive`, before the template
+    is removed from the mempool
+    """
+    os.makedirs(archive, exist_ok=True)
+    mempool.save(_path(archive, "mempool", height, "bin"))
+    with open(_path(archive, "template", height), "w") as f:
+        json.dump({
+            "height": height + 1,
+            "version": template.version,
+            "previousblockhash": template.previousblockhash,
+            "transactions": template.tx,
+            "coinbasevalue": template.reward,
+        }, f)
+
+
+def load_mempool(archive, height: int) -> Mempool:
+    path = _path(archive, "mempool", height, "bin")
+    if os.path.exists(path):
+        return Mempool.load(path)
+    with open(_path(archive, "mempool", height)) as f:
+        return Mempool.from_json(json.load(f, parse_float=decimal.Decimal))
+
+
+def actual_fee(archive, height: int, use_rpc: bool = False):
+    """
+    Total fee of the block mined at `height`, recorded or over RPC. None if unknown.
+    """
+    path = _path(archive, "stats", height)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)["totalfee"]
+    if use_rpc:
+        # Only workers that need it open a connection
+        import rpc
+        return rpc.rpc.getblockstats(height, ["totalfee"])["totalfee"]
+    return None
+
+
+def backtest_height(archive, height: int, use_rpc: bool = False) -> dict:
+    """
+    Project the tip + 2 block from the snapshot at tip `height` and compare it
+    with the block actually mined
+    """
+    tic = perf_counter()
+    mempool = load_mempool(archive, height)
+    with open(_path(archive, "template", height)) as f:
+        template = Block.from_blocktemplate(json.load(f, parse_float=decimal.Decimal))
+    mempool_size = len(mempool)
+
+    mempool.remove_block(template)
+    block = miner.create_block(mempool, height + 2, template.version, 64 * "0")
+
+    actual = actual_fee(archive, height + 2, use_rpc)
+    return {
+        "height": height,
+        "mempool_size": mempool_size,
+        "template_fee": template.fee,
+        "projected_fee": block.fee,
+        "projected_weight": block.weight,
+        "projected_tx": len(block.tx),
+        "actual_fee": actual,
+        "fee_delta": None if actual is None else block.fee - actual,
+        "fee_ratio": None if not actual else block.fee / actual,
+        "seconds": perf_counter() - tic,
+    }
+
+
+class ReportWriter(object):
+    """
+    Writes result rows as CSV or, for a `.jsonl` path, JSON lines, flushing each
+    so partial reports are usable
+    """
+
+    def __init__(self, f, jsonl: bool):
+        self.f = f
+        self.jsonl = jsonl
+        if not jsonl:
+            self.writer = csv.DictWriter(f, fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def write(self, row: dict):
+        if self.jsonl:
+            self.f.write(json.dumps(row) + "\n")
+        else:
+            self.writer.writerow(row)
+        self.f.flush()
+
+
+def run(archive, heights, writer: ReportWriter, workers=None, use_rpc: bool = False) -> list:
+    """
+    Backtest `heights` across a process pool, writing each result as it is ready,
+    in height order. Returns the fee ratios of heights with a known actual fee.
+    """
+    ratios = []
+    chunksize = max(1, len(heights) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for row in executor.map(partial(backtest_height, archive, use_rpc=use_rpc), heights, chunksize=chunksize):
+            writer.write(row)
+            if row["fee_ratio"] is not None:
+                ratios.append(row["fee_ratio"])
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest projected tip + 2 blocks against archived snapshots")
+    parser.add_argument("archive", help="directory of mempool-H / template-H / stats-H snapshots")
+    parser.add_argument("-o", "--output", help="report path, .csv or .jsonl (default: CSV on stdout)")
+    parser.add_argument("--from-height", type=int, help="first tip height to backtest")
+    parser.add_argument("--to-height", type=int, help="last tip height to backtest")
+    parser.add_argument("-j", "--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--rpc", action="store_true", help="fetch fees missing from the archive with getblockstats")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    heights = [
+        height for height in archive_heights(args.archive)
+        if (args.from_height is None or height >= args.from_height)
+        and (args.to_height is None or height <= args.to_height)
+    ]
+    if not heights:
+        logger.error(f"no snapshots found in {args.archive}")
+        return 1
+
+    tic = perf_counter()
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            ratios = run(args.archive, heights, ReportWriter(f, args.output.endswith(".jsonl")), args.workers, args.rpc)
+    else:
+        ratios = run(args.archive, heights, ReportWriter(sys.stdout, False), args.workers, args.rpc)
+
+    summary = f"backtested {len(heights):,} heights in {perf_counter() - tic:.1f} seconds"
+    if ratios:
+        ratios.sort()
+        summary += f", median projected / actual fee {ratios[len(ratios) // 2]:.3f} over {len(ratios):,} known blocks"
+    print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
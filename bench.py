@@ -0,0 +1,180 @@
+import argparse
+import decimal
+import gc
+import json
+import logging
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+
+from tabulate import tabulate
+
+import eviction
+import generate
+import miner
+from block import Block
+from mempool import Mempool
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+SIZES = [10_000, 100_000, 300_000]
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture_paths(fixture_dir, size):
+    """
+    A fixture is a `getrawmempool True` result and a matching `getblocktemplate` result
+    """
+    return (
+        os.path.join(fixture_dir, f"mempool-{size}.json"),
+        os.path.join(fixture_dir, f"template-{size}.json"),
+    )
+
+
+class Fixture(object):
+    def __init__(self, mempool_path, template_path):
+        with open(mempool_path, "rb") as f:
+            self.mempool_json = f.read()
+        with open(template_path, "rb") as f:
+            self.template_json = f.read()
+
+    def raw_mempool(self) -> dict:
+        return json.loads(self.mempool_json, parse_float=decimal.Decimal)
+
+    def mempool(self) -> Mempool:
+        return Mempool.from_json(self.raw_mempool())
+
+    def template(self) -> Block:
+        return Block.from_blocktemplate(json.loads(self.template_json, parse_float=decimal.Decimal))
+
+    def intersected(self) -> Mempool:
+        mempool = self.mempool()
+        mempool.remove_block(self.template())
+        return mempool
+
+
+def benchmarks(fixture: Fixture):
+    """
+    Returns (name, setup, run) triples. `setup` builds fresh inputs outside the
+    timed region and `run` is what gets measured.
+    """
+    def assembled():
+        mempool = fixture.intersected()
+        return miner.create_block(mempool, 0, 0, 64 * "0")
+
+    return [
+        ("Mempool.from_json", fixture.raw_mempool, Mempool.from_json),
+        ("Mempool.remove_block", lambda: (fixture.mempool(), fixture.template()), lambda args: args[0].remove_block(args[1])),
+        ("miner.check_mempool", fixture.intersected, miner.check_mempool),
+        ("miner.sorted_mempool_list", fixture.intersected, miner.sorted_mempool_list),
+        ("miner.create_block", fixture.intersected, lambda mempool: miner.create_block(mempool, 0, 0, 64 * "0")),
+        ("Mempool.clusters.linearize", fixture.intersected, lambda mempool: mempool.clusters.linearize(mempool)),
+        ("miner.ClusterAssembler", fixture.intersected, lambda mempool: miner.ClusterAssembler(mempool).create_block(0, 0, 64 * "0")),
+        ("miner.check_block", assembled, miner.check_block),
+        ("eviction.trim_to_sizes", fixture.mempool, lambda mempool: eviction.trim_to_sizes(
+            mempool, [int(mempool.total_vsize * fraction) for fraction in (0.99, 0.95, 0.9, 0.8)],
+        )),
+    ]
+
+
+def measure(setup, run, repeat: int) -> dict:
+    """
+    Best wall time over `repeat` runs, then one more run under tracemalloc for the
+    peak memory allocated by `run`
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        tic = perf_counter()
+        run(args)
+        times.append(perf_counter() - tic)
+
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    run(args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(times), "peak_bytes": peak}
+
+
+def run_suite(fixture_dir, sizes, repeat: int, seed=None) -> dict:
+    """
+    Runs every benchmark for each size. With `seed`, missing fixtures are
+    generated synthetically first.
+    """
+    results = {}
+    for size in sizes:
+        mempool_path, template_path = fixture_paths(fixture_dir, size)
+        if seed is not None and not os.path.exists(mempool_path):
+            os.makedirs(fixture_dir, exist_ok=True)
+            generate.generate_fixture(size, mempool_path, template_path, seed)
+        if not (os.path.exists(mempool_path) and os.path.exists(template_path)):
+            logger.warning(f"no fixture for {size:,} transactions in {fixture_dir}, skipping")
+            continue
+        fixture = Fixture(mempool_path, template_path)
+        results[str(size)] = {}
+        for name, setup, run in benchmarks(fixture):
+            results[str(size)][name] = measure(setup, run, repeat)
+            logger.info(f"{size:,} {name}: {results[str(size)][name]}")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Returns table rows for every benchmark, flagging those slower or larger than
+    the baseline by more than `threshold`
+    """
+    rows = []
+    for size, benches in results.items():
+        for name, result in benches.items():
+            base = baseline.get(size, {}).get(name)
+            row = [size, name, f"{result['seconds']:.5f}", f"{result['peak_bytes'] / 1e6:,.1f}"]
+            if base is None:
+                row.extend(["", "", ""])
+            else:
+                time_ratio = result["seconds"] / base["seconds"]
+                mem_ratio = result["peak_bytes"] / base["peak_bytes"] if base["peak_bytes"] else 1.0
+                regressed = time_ratio > 1 + threshold or mem_ratio > 1 + threshold
+                row.extend([f"{time_ratio:.2f}x", f"{mem_ratio:.2f}x", "REGRESSION" if regressed else "ok"])
+            rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mempool and miner hot paths on stored fixtures")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR, help="directory of mempool-N.json / template-N.json fixtures")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="mempool sizes to run")
+    parser.add_argument("--generate", type=int, metavar="SEED", help="generate missing fixtures with this seed")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark, best is kept")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown counted as a regression")
+    parser.add_argument("--save", help="write results as JSON, e.g. to use as a baseline")
+    args = parser.parse_args()
+
+    results = run_suite(args.fixtures, args.sizes, args.repeat, args.generate)
+    if not results:
+        logger.error("no fixtures found, nothing to benchmark")
+        return 1
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    rows = compare(results, baseline, args.threshold)
+    headers = ["size", "benchmark", "seconds", "peak MB", "time vs base", "mem vs base", ""]
+    print(f"\n{tabulate(rows, headers=headers, tablefmt='github')}\n")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if any(row[-1] == "REGRESSION" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
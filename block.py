@@ -2,11 +2,15 @@ import logging
 from collections import OrderedDict
 
 import attr
+import graph
 from consensus import COIN, HALVING_INTERVAL
 
 COINBASE_WEIGHT = 4000
 COINBASE_SIGOPS = 400
 
+# `getblockstats` fields needed by `Block.from_header_stats`
+BLOCK_STATS = ["totalfee", "total_size", "total_weight"]
+
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +45,27 @@ class Block(object):
         df = {k: v for k, v in d.items() if k in Block.pick_fields}
         return cls(tip_offset=tip_offset, template=False, **df)
 
+    @classmethod
+    def from_header_stats(cls, header, stats, tip_offset=""):
+        """
+        Build from `getblockheader` and `getblockstats` with `BLOCK_STATS`, which
+        unlike `getblock` don't list every txid. Size and weight are of the
+        non-coinbase transactions, with weight counting the coinbase as
+        `COINBASE_WEIGHT` like templates do.
+        """
+        return cls(
+            height=header["height"],
+            version=header["version"],
+            tx=[],
+            previousblockhash=header.get("previousblockhash"),
+            hash=header["hash"],
+            size=stats["total_size"],
+            weight=COINBASE_WEIGHT + stats["total_weight"],
+            fee=stats["totalfee"],
+            template=False,
+            tip_offset=tip_offset,
+        )
+
     @classmethod
     def from_blocktemplate(cls, d):
         d["tx"] = d["transactions"]
@@ -74,6 +99,30 @@ class Block(object):
             self.sigopscost += tx["sigops"]
             self.weight += tx["weight"]
 
+    def txids(self) -> frozenset:
+        """
+        Transaction ids of a template, assembled or confirmed block
+        """
+        if isinstance(self.tx, dict):
+            return frozenset(self.tx)
+        return frozenset(tx if isinstance(tx, str) else tx["txid"] for tx in self.tx)
+
+    def entries(self) -> dict:
+        """
+        txid -> (fee, weight, parent txids) for template and assembled blocks alike.
+        Parents of assembled transactions may be outside the block.
+        """
+        if isinstance(self.tx, dict):
+            return {txid: (tx.fee, tx.weight, tx.depends) for txid, tx in self.tx.items()}
+        if self.tx and isinstance(self.tx[0], str):
+            raise ValueError(f"block {self.height} has no transaction details")
+        # Template `depends` are 1-based indices into the transaction list
+        txids = [tx["txid"] for tx in self.tx]
+        return {
+            tx["txid"]: (tx["fee"], tx["weight"], tuple(txids[i - 1] for i in tx["depends"]))
+            for tx in self.tx
+        }
+
     def get_fee(self, rpc):
         if self.template:
             logger.error("can't fetch fee for blocktemplate from RPC")
@@ -88,7 +137,7 @@ class Block(object):
             logger.warning(f"{txid} already in block, skipping")
             return
         self.tx[txid] = mempool[txid]
-        self.fee += int(self.tx[txid].fees["base"] * COIN)
+        self.fee += self.tx[txid].fee
         self.size += self.tx[txid].vsize
         self.weight += self.tx[txid].weight
         self.sigopscost += mempool[txid].sigopscost
@@ -101,11 +150,11 @@ class Block(object):
         if txid in self.tx:
             return
 
-        for ancestor_txid in mempool[txid].depends:
-            self.add_transaction(ancestor_txid, mempool)
-
-        # Add it to the block
-        self._add_by_txid(txid, mempool)
+        # Add it and its ancestors not yet in the block, parents first
+        chain = graph.ancestors(mempool, txid, exclude=self.tx)
+        chain.add(txid)
+        for _txid in graph.parents_first(mempool, chain):
+            self._add_by_txid(_txid, mempool)
 
         # Remove it from the mempool
         # mempool.remove_transaction(txid)
@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import metrics
+from block import Block
+
+
+logger = logging.getLogger(__name__)
+
+# Fields of a confirmed `Block` which are cached, see `Block.from_header_stats`
+FIELDS = ["hash", "height", "version", "previousblockhash", "size", "weight", "fee"]
+
+
+class BlockCache(object):
+    """
+    LRU cache of confirmed block metadata keyed by block hash. A hash commits to
+    the block's contents, so entries never go stale, even across reorgs.
+
+    With `path`, entries are loaded from and written back to a JSON file so
+    repeated runs don't refetch historical blocks.
+    """
+
+    def __init__(self, size: int = 128, path=None):
+        self.size = size
+        self.path = path
+        self.records = OrderedDict()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for record in json.load(f):
+                    self.records[record["hash"]] = record
+            self._evict()
+            logger.debug(f"loaded {len(self.records)} cached blocks from {path}")
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.records
+
+    def _evict(self):
+        while len(self.records) > self.size:
+            self.records.popitem(last=False)
+
+    def get(self, block_hash: str, tip_offset: str = ""):
+        """
+        A fresh `Block` for `block_hash`, or None if not cached
+        """
+        record = self.records.get(block_hash)
+        if record is None:
+            metrics.inc("block_cache", result="miss")
+            return None
+        self.records.move_to_end(block_hash)
+        metrics.inc("block_cache", result="hit")
+        return Block(tx=[], template=False, tip_offset=tip_offset, **record)
+
+    def put(self, block: Block):
+        self.records[block.hash] = {field: getattr(block, field) for field in FIELDS}
+        self.records.move_to_end(block.hash)
+        self._evict()
+        if self.path is not None:
+            self.save()
+
+    def save(self):
+        """
+        Write the cache to `path` atomically
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self.records.values()), f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,144 @@
+import logging
+
+import attr
+from tabulate import tabulate
+
+from block import Block
+from consensus import WITNESS_SCALE_FACTOR
+
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s
+class Package(object):
+    """
+    Connected transactions which only one side of a diff included
+    """
+    txids = attr.ib(type=frozenset)
+    fee = attr.ib(type=int)
+    weight = attr.ib(type=int)
+
+    @property
+    def fee_rate(self) -> float:
+        """
+        sat/vB
+        """
+        return self.fee / (self.weight / WITNESS_SCALE_FACTOR)
+
+
+@attr.s
+class BlockDiff(object):
+    """
+    Comparison of two blocks, e.g. Core's template (`a`) and our assembled block (`b`).
+    Transactions in both blocks contribute equally to each side, so the fee
+    difference is exactly the packages `b` picked less the packages `a` picked.
+    """
+    a = attr.ib(type=Block)
+    b = attr.ib(type=Block)
+    common = attr.ib(type=frozenset)
+    only_a = attr.ib(type=list)
+    only_b = attr.ib(type=list)
+
+    @property
+    def overlap(self) -> float:
+        """
+        Shared transactions as a fraction of all transactions in either block
+        """
+        total = len(self.common) + sum(len(p.txids) for p in self.only_a) + sum(len(p.txids) for p in self.only_b)
+        return len(self.common) / total if total else 1.0
+
+    @property
+    def fee_delta(self) -> int:
+        return sum(p.fee for p in self.only_b) - sum(p.fee for p in self.only_a)
+
+    @property
+    def weight_delta(self) -> int:
+        return sum(p.weight for p in self.only_b) - sum(p.weight for p in self.only_a)
+
+
+def _packages(txids: set, entries: dict) -> list:
+    """
+    Group `txids` into packages connected by parent links within `txids`, with a
+    union-find over the links. Largest fee first.
+    """
+    parent_of = {txid: txid for txid in txids}
+
+    def find(txid):
+        root = txid
+        while parent_of[root] != root:
+            root = parent_of[root]
+        while parent_of[txid] != root:
+            parent_of[txid], txid = root, parent_of[txid]
+        return root
+
+    for txid in txids:
+        for depend in entries[txid][2]:
+            if depend in parent_of:
+                parent_of[find(txid)] = find(depend)
+
+    groups = {}
+    for txid in txids:
+        groups.setdefault(find(txid), []).append(txid)
+    packages = [
+        Package(
+            txids=frozenset(members),
+            fee=sum(entries[txid][0] for txid in members),
+            weight=sum(entries[txid][1] for txid in members),
+        )
+        for members in groups.values()
+    ]
+    packages.sort(key=lambda package: package.fee, reverse=True)
+    return packages
+
+
+def diff_blocks(a: Block, b: Block) -> BlockDiff:
+    """
+    Diff two template or assembled blocks by txid set operations, attributing
+    the transactions only one side included to packages
+    """
+    entries_a = a.entries()
+    entries_b = b.entries()
+    ids_a = entries_a.keys()
+    ids_b = entries_b.keys()
+    common = frozenset(ids_a & ids_b)
+    diff = BlockDiff(
+        a=a,
+        b=b,
+        common=common,
+        only_a=_packages(ids_a - common, entries_a),
+        only_b=_packages(ids_b - common, entries_b),
+    )
+    logger.debug(f"diffed blocks: {len(common)} common, {len(diff.only_a)} and {len(diff.only_b)} packages only in either")
+    return diff
+
+
+def print_diff(diff: BlockDiff, labels=("template", "assembled"), top: int = 5):
+    """
+    Print a summary of `diff` and the `top` packages by fee each side picked
+    which the other skipped
+    """
+    label_a, label_b = labels
+    rows = [
+        ["transactions", f"{len(diff.a.tx):,}", f"{len(diff.b.tx):,}"],
+        ["only in", f"{sum(len(p.txids) for p in diff.only_a):,}", f"{sum(len(p.txids) for p in diff.only_b):,}"],
+        ["packages only in", f"{len(diff.only_a):,}", f"{len(diff.only_b):,}"],
+        ["fee", f"{diff.a.fee:,}", f"{diff.b.fee:,}"],
+        ["weight", f"{diff.a.weight:,}", f"{diff.b.weight:,}"],
+    ]
+    print(f"\n{tabulate(rows, headers=['', label_a, label_b], tablefmt='github')}\n")
+    print(f"overlap {100 * diff.overlap:.2f}%, fee delta {diff.fee_delta:+,} sats, weight delta {diff.weight_delta:+,}\n")
+
+    rows = []
+    for label, packages in ((label_a, diff.only_a), (label_b, diff.only_b)):
+        for package in packages[:top]:
+            rows.append([
+                label,
+                min(package.txids),
+                len(package.txids),
+                f"{package.fee:,}",
+                f"{package.fee_rate:.2f}",
+            ])
+    if rows:
+        headers = ["picked by", "txid (lowest)", "txs", "fee", "sat/vB"]
+        print(f"{tabulate(rows, headers=headers, tablefmt='github')}\n")
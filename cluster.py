@@ -0,0 +1,341 @@
+"""
+Cluster partitioning and chunk linearization of a mempool.
+
+A cluster is a connected component of the `depends`/`spentby` graph. Clusters are
+independent: nothing one cluster's transactions do changes the scores of another's.
+So each cluster is linearized once, into chunks of non-increasing fee rate, and
+stays linearized until a transaction joins or leaves it.
+
+Linearization repeatedly picks the remaining transaction with the best ancestor
+fee rate, with its remaining ancestors, as Bitcoin Core's ancestor-set
+linearization does. It then merges consecutive picks whenever a later one pays a
+higher fee rate than the one before, so a low fee parent and the child paying for
+it form one chunk.
+"""
+import heapq
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import attr
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(slots=True)
+class Chunk(object):
+    """
+    Transactions of one cluster which are included together, parents first
+    """
+    txids = attr.ib(type=tuple)
+    fee = attr.ib(type=int)
+    size = attr.ib(type=int)
+    weight = attr.ib(type=int)
+    sigops = attr.ib(type=int)
+
+    @property
+    def fee_rate(self) -> float:
+        """
+        sat/vB
+        """
+        return self.fee / self.size
+
+
+def _parents_first(entries: dict) -> list:
+    """
+    Kahn's algorithm over the parent links of `entries`
+    """
+    children = {txid: [] for txid in entries}
+    waiting = {}
+    for txid, (_, _, parents) in entries.items():
+        waiting[txid] = len(parents)
+        for parent_txid in parents:
+            children[parent_txid].append(txid)
+    ordered = [txid for txid, count in waiting.items() if count == 0]
+    for txid in ordered:
+        for child_txid in children[txid]:
+            waiting[child_txid] -= 1
+            if waiting[child_txid] == 0:
+                ordered.append(child_txid)
+    return ordered
+
+
+def linearize(entries: dict) -> list:
+    """
+    Linearize one cluster given as txid -> (fee, size, parents in the cluster).
+    Returns chunks as (txids, fee, size), highest fee rate first, each chunk's
+    txids parents first and every chunk after its ancestors' chunks.
+    """
+    if len(entries) == 1:
+        (txid, (fee, size, _)), = entries.items()
+        return [((txid,), fee, size)]
+
+    ordered = _parents_first(entries)
+    position = {txid: i for i, txid in enumerate(ordered)}
+    ancestors = {}
+    descendants = {txid: [] for txid in entries}
+    for txid in ordered:
+        found = set()
+        for parent_txid in entries[txid][2]:
+            found |= ancestors[parent_txid]
+            found.add(parent_txid)
+        ancestors[txid] = found
+        for ancestor_txid in found:
+            descendants[ancestor_txid].append(txid)
+
+    # txid -> [fee, size] of txid and its ancestors not yet picked
+    scores = {}
+    for txid in ordered:
+        fee, size, _ = entries[txid]
+        for ancestor_txid in ancestors[txid]:
+            fee += entries[ancestor_txid][0]
+            size += entries[ancestor_txid][1]
+        scores[txid] = [fee, size]
+    heap = [(-fee / size, txid) for txid, (fee, size) in scores.items()]
+    heapq.heapify(heap)
+
+    # Each pick is appended, then merged into the chunk before it while it pays more
+    chunks = []
+    done = set()
+    while heap:
+        neg_score, txid = heapq.heappop(heap)
+        if txid in done:
+            continue
+        fee, size = scores[txid]
+        if -neg_score != fee / size:
+            # Superseded by a re-scored entry
+            continue
+
+        picked = sorted((ancestors[txid] - done) | {txid}, key=position.__getitem__)
+        done.update(picked)
+        chunk = [picked, fee, size]
+        while chunks and chunk[1] * chunks[-1][2] > chunks[-1][1] * chunk[2]:
+            previous = chunks.pop()
+            chunk = [previous[0] + chunk[0], previous[1] + chunk[1], previous[2] + chunk[2]]
+        chunks.append(chunk)
+
+        updated = set()
+        for _txid in picked:
+            _fee, _size, _ = entries[_txid]
+            for descendant_txid in descendants[_txid]:
+                if descendant_txid not in done:
+                    scores[descendant_txid][0] -= _fee
+                    scores[descendant_txid][1] -= _size
+                    updated.add(descendant_txid)
+        for _txid in updated:
+            _fee, _size = scores[_txid]
+            heapq.heappush(heap, (-_fee / _size, _txid))
+
+    return [(tuple(txids), fee, size) for txids, fee, size in chunks]
+
+
+def _linearize_batch(batch: list) -> list:
+    return [linearize(entries) for entries in batch]
+
+
+def components(mempool, txids) -> list:
+    """
+    Partition `txids` into the sets connected by links between them
+    """
+    txids = set(txids)
+    found = []
+    seen = set()
+    for root in txids:
+        if root in seen:
+            continue
+        seen.add(root)
+        component = {root}
+        stack = [root]
+        while stack:
+            tx = mempool[stack.pop()]
+            for _txid in itertools.chain(tx.depends, tx.spentby):
+                if _txid in txids and _txid not in seen:
+                    seen.add(_txid)
+                    component.add(_txid)
+                    stack.append(_txid)
+        found.append(component)
+    return found
+
+
+def cluster_entries(mempool, txids) -> dict:
+    """
+    The input to `linearize` for `txids`, ignoring links to other transactions
+    """
+    return {
+        txid: (
+            mempool[txid].modifiedfee,
+            mempool[txid].vsize,
+            tuple(_txid for _txid in mempool[txid].depends if _txid in txids),
+        )
+        for txid in txids
+    }
+
+
+def to_chunks(mempool, linearization: list) -> list:
+    return [
+        Chunk(
+            txids=txids,
+            fee=fee,
+            size=size,
+            weight=sum(mempool[txid].weight for txid in txids),
+            sigops=sum(mempool[txid].sigopscost for txid in txids),
+        )
+        for txids, fee, size in linearization
+    ]
+
+
+class ClusterIndex(object):
+    """
+    The clusters of a mempool and their chunks, kept current as transactions are
+    added and removed.
+
+    Joining clusters on insertion is cheap: the smaller cluster is merged into the
+    larger. A removal may split its cluster, so the cluster is only marked and is
+    re-partitioned on the next `split`. Either way only the clusters touched are
+    linearized again.
+    """
+
+    def __init__(self):
+        # txid -> cluster id
+        self.cluster_of = {}
+        # cluster id -> txids
+        self.members = {}
+        # cluster id -> chunks, for clusters linearized since they last changed
+        self.chunks = {}
+        # Clusters which may have split since a removal
+        self.dirty = set()
+        self._ids = itertools.count()
+
+    @classmethod
+    def from_mempool(cls, mempool):
+        """
+        Partition `mempool` with a union-find over its parent links
+        """
+        index = cls()
+        parent_of = {txid: txid for txid in mempool}
+
+        def find(txid):
+            root = txid
+            while parent_of[root] != root:
+                root = parent_of[root]
+            while parent_of[txid] != root:
+                parent_of[txid], txid = root, parent_of[txid]
+            return root
+
+        for txid, tx in mempool.items():
+            for parent_txid in tx.depends:
+                parent_of[find(txid)] = find(parent_txid)
+
+        roots = {}
+        for txid in mempool:
+            root = find(txid)
+            cluster_id = roots.get(root)
+            if cluster_id is None:
+                cluster_id = roots[root] = next(index._ids)
+                index.members[cluster_id] = set()
+            index.members[cluster_id].add(txid)
+            index.cluster_of[txid] = cluster_id
+        logger.debug(f"partitioned {len(mempool)} transactions into {len(index.members)} clusters")
+        return index
+
+    def __len__(self):
+        return len(self.members)
+
+    def _new_cluster(self, txids: set) -> int:
+        cluster_id = next(self._ids)
+        self.members[cluster_id] = txids
+        for txid in txids:
+            self.cluster_of[txid] = cluster_id
+        return cluster_id
+
+    def add(self, txid: str, tx):
+        """
+        Index `txid`, merging the clusters of its indexed parents and children
+        """
+        if txid in self.cluster_of:
+            self.remove(txid)
+        joined = {
+            self.cluster_of[_txid]
+            for _txid in itertools.chain(tx.depends, tx.spentby)
+            if _txid in self.cluster_of
+        }
+        if not joined:
+            self._new_cluster({txid})
+            return
+
+        cluster_id = max(joined, key=lambda _id: len(self.members[_id]))
+        members = self.members[cluster_id]
+        for other_id in joined - {cluster_id}:
+            for _txid in self.members.pop(other_id):
+                self.cluster_of[_txid] = cluster_id
+                members.add(_txid)
+            self.chunks.pop(other_id, None)
+            if other_id in self.dirty:
+                self.dirty.discard(other_id)
+                self.dirty.add(cluster_id)
+        members.add(txid)
+        self.cluster_of[txid] = cluster_id
+        self.chunks.pop(cluster_id, None)
+
+    def remove(self, txid: str):
+        cluster_id = self.cluster_of.pop(txid, None)
+        if cluster_id is None:
+            return
+        members = self.members[cluster_id]
+        members.discard(txid)
+        self.chunks.pop(cluster_id, None)
+        if members:
+            self.dirty.add(cluster_id)
+        else:
+            del self.members[cluster_id]
+            self.dirty.discard(cluster_id)
+
+    def split(self, mempool):
+        """
+        Re-partition the clusters transactions have left
+        """
+        for cluster_id in self.dirty:
+            parts = components(mempool, self.members[cluster_id])
+            if len(parts) == 1:
+                continue
+            del self.members[cluster_id]
+            for part in parts:
+                self._new_cluster(part)
+        self.dirty.clear()
+
+    @metrics.timed("linearize")
+    def linearize(self, mempool, workers=None) -> dict:
+        """
+        Chunks of every cluster, linearizing those which changed. With more than
+        one worker, clusters of more than one transaction are linearized across a
+        process pool.
+        """
+        self.split(mempool)
+        stale = [cluster_id for cluster_id in self.members if cluster_id not in self.chunks]
+        singles = [cluster_id for cluster_id in stale if len(self.members[cluster_id]) == 1]
+        multiple = [cluster_id for cluster_id in stale if len(self.members[cluster_id]) > 1]
+
+        for cluster_id in singles:
+            txid, = self.members[cluster_id]
+            tx = mempool[txid]
+            self.chunks[cluster_id] = [Chunk((txid,), tx.modifiedfee, tx.vsize, tx.weight, tx.sigopscost)]
+
+        batch = [cluster_entries(mempool, self.members[cluster_id]) for cluster_id in multiple]
+        workers = workers or 1
+        if workers > 1 and len(batch) > 1:
+            # Few large batches; pickling a task costs more than most clusters do
+            size = -(-len(batch) // (4 * workers))
+            batches = [batch[i:i + size] for i in range(0, len(batch), size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                linearizations = list(itertools.chain.from_iterable(executor.map(_linearize_batch, batches)))
+        else:
+            linearizations = _linearize_batch(batch)
+        for cluster_id, linearization in zip(multiple, linearizations):
+            self.chunks[cluster_id] = to_chunks(mempool, linearization)
+
+        metrics.inc("clusters_linearized", len(stale))
+        logger.debug(f"linearized {len(stale)} of {len(self.members)} clusters, {len(multiple)} with more than one transaction")
+        return self.chunks
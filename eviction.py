@@ -0,0 +1,202 @@
+"""
+Simulation of Bitcoin Core's `CTxMemPool::TrimToSize`.
+
+When a node's mempool outgrows `-maxmempool`, Core evicts the entry with the lowest
+descendant score together with all of its descendants, repeatedly, and raises its
+minimum fee to the highest descendant fee rate evicted plus the incremental relay
+fee. The eviction order doesn't depend on the limit, so one pass answers a whole
+list of limits.
+
+Core limits memory usage rather than vsize. `usage_per_vbyte`, the node's
+`getmempoolinfo` usage / bytes, converts between the two. The decay of Core's
+rolling minimum fee after the trim is not simulated.
+"""
+import heapq
+import logging
+
+import attr
+from tabulate import tabulate
+
+import graph
+
+
+logger = logging.getLogger(__name__)
+
+# sat/vB, Core's long-standing defaults. Nodes report theirs in `getmempoolinfo`.
+MIN_RELAY_FEE = 1.0
+INCREMENTAL_RELAY_FEE = 1.0
+
+
+def descendant_score(fee: int, size: int, descendantfees: int, descendantsize: int) -> float:
+    """
+    Core's `CompareTxMemPoolEntryByDescendantScore`: the higher of the fee rate of
+    the transaction alone and with its descendants, in sat/vB
+    """
+    return max(fee / size, descendantfees / descendantsize)
+
+
+class DescendantScoreIndex(object):
+    """
+    Min-heap of mempool entries by descendant score, lowest first. Updates push a
+    new heap entry; stale ones are skipped when they reach the top and dropped
+    when the heap is compacted.
+    """
+
+    def __init__(self):
+        self.scores = {}
+        self.heap = []
+
+    @classmethod
+    def from_mempool(cls, mempool):
+        index = cls()
+        for txid, tx in mempool.items():
+            index.scores[txid] = descendant_score(tx.modifiedfee, tx.vsize, tx.descendantfees, tx.descendantsize)
+        index.heap = [(score, txid) for txid, score in index.scores.items()]
+        heapq.heapify(index.heap)
+        return index
+
+    def __len__(self):
+        return len(self.scores)
+
+    def add(self, txid: str, tx):
+        score = descendant_score(tx.modifiedfee, tx.vsize, tx.descendantfees, tx.descendantsize)
+        self.scores[txid] = score
+        heapq.heappush(self.heap, (score, txid))
+        if len(self.heap) > 2 * len(self.scores) + 1000:
+            self.compact()
+
+    update = add
+
+    def remove(self, txid: str):
+        self.scores.pop(txid, None)
+
+    def compact(self):
+        self.heap = [(score, txid) for txid, score in self.scores.items()]
+        heapq.heapify(self.heap)
+
+    def lowest(self):
+        """
+        (score, txid) of the next entry Core would evict, or None if empty
+        """
+        while self.heap:
+            score, txid = self.heap[0]
+            if self.scores.get(txid) == score:
+                return score, txid
+            heapq.heappop(self.heap)
+        return None
+
+
+@attr.s
+class TrimResult(object):
+    """
+    State of the mempool after trimming it to `size_limit`
+    """
+    size_limit = attr.ib(type=int)
+    evicted = attr.ib(type=int)
+    evicted_vsize = attr.ib(type=int)
+    evicted_fee = attr.ib(type=int)
+    packages = attr.ib(type=int)
+    # Highest descendant fee rate evicted plus the incremental relay fee, sat/vB
+    max_fee_rate_removed = attr.ib(type=float)
+    # What the node would then accept, sat/vB
+    min_fee_rate = attr.ib(type=float)
+
+
+def trim_to_sizes(
+    mempool, size_limits,
+    usage_per_vbyte: float = 1.0,
+    min_relay_fee: float = MIN_RELAY_FEE,
+    incremental_relay_fee: float = INCREMENTAL_RELAY_FEE,
+) -> list:
+    """
+    Simulate trimming `mempool` to each of `size_limits`, in memory usage bytes,
+    in one eviction pass. The mempool is not modified. Returns one `TrimResult`
+    per limit, in the order given.
+    """
+    index = mempool.descendant_scores
+    # Copies, so the mempool's index isn't disturbed
+    heap = list(index.heap)
+    scores = dict(index.scores)
+    # txid -> [descendantsize, descendantfees] of ancestors of evicted packages
+    remaining = {}
+    evicted = set()
+    usage = mempool.total_vsize * usage_per_vbyte
+    evicted_vsize = evicted_fee = packages = 0
+    max_fee_rate_removed = 0.0
+
+    results = {}
+    for size_limit in sorted(set(size_limits), reverse=True):
+        while usage > size_limit and heap:
+            score, txid = heapq.heappop(heap)
+            if scores.get(txid) != score:
+                continue
+            tx = mempool[txid]
+            size, fees = remaining.get(txid, (tx.descendantsize, tx.descendantfees))
+            max_fee_rate_removed = max(max_fee_rate_removed, fees / size + incremental_relay_fee)
+
+            package = graph.descendants(mempool, txid, exclude=evicted) if tx.spentby else set()
+            package.add(txid)
+            evicted |= package
+            packages += 1
+            linked = False
+            for _txid in package:
+                del scores[_txid]
+                member = mempool[_txid]
+                evicted_vsize += member.vsize
+                evicted_fee += member.fee
+                usage -= member.vsize * usage_per_vbyte
+                if not member.depends:
+                    continue
+                linked = True
+                # Surviving ancestors no longer count it as a descendant. Walks
+                # through the package, as survivors may only be reached that way.
+                for ancestor_txid in graph.ancestors(mempool, _txid) - evicted:
+                    ancestor = mempool[ancestor_txid]
+                    stats = remaining.get(ancestor_txid)
+                    if stats is None:
+                        stats = remaining[ancestor_txid] = [ancestor.descendantsize, ancestor.descendantfees]
+                    stats[0] -= member.vsize
+                    stats[1] -= member.modifiedfee
+
+            for ancestor_txid in graph.ancestors_of_set(mempool, package, exclude=evicted) if linked else ():
+                ancestor = mempool[ancestor_txid]
+                size, fees = remaining[ancestor_txid]
+                scores[ancestor_txid] = descendant_score(ancestor.modifiedfee, ancestor.vsize, fees, size)
+                heapq.heappush(heap, (scores[ancestor_txid], ancestor_txid))
+
+        results[size_limit] = TrimResult(
+            size_limit=size_limit,
+            evicted=len(evicted),
+            evicted_vsize=evicted_vsize,
+            evicted_fee=evicted_fee,
+            packages=packages,
+            max_fee_rate_removed=max_fee_rate_removed,
+            min_fee_rate=max(min_relay_fee, max_fee_rate_removed),
+        )
+        logger.debug(f"trimmed to {size_limit:,}: evicted {len(evicted)} transactions in {packages} packages")
+
+    return [results[size_limit] for size_limit in size_limits]
+
+
+def trim_to_size(mempool, size_limit: int, **kwargs) -> TrimResult:
+    """
+    Simulate trimming `mempool` to `size_limit`, see `trim_to_sizes`
+    """
+    return trim_to_sizes(mempool, [size_limit], **kwargs)[0]
+
+
+def print_trim(results: list):
+    table = [
+        [
+            f"{result.size_limit / 1e6:,.1f}",
+            f"{result.evicted:,}",
+            f"{result.packages:,}",
+            f"{result.evicted_vsize:,}",
+            f"{result.evicted_fee:,}",
+            f"{result.min_fee_rate:.2f}",
+        ]
+        for result in results
+    ]
+    headers = ["maxmempool MB", "evicted tx", "packages", "evicted vsize", "evicted fee", "min fee sat/vB"]
+    # Keep the formatting above, e.g. a 300 MB limit as 300.0 rather than 300
+    print(f"\n{tabulate(table, headers=headers, tablefmt='github', colalign=('right',) * len(headers), disable_numparse=True)}\n")
@@ -0,0 +1,238 @@
+import argparse
+import hashlib
+import json
+import logging
+import math
+import random
+
+from block import COINBASE_WEIGHT
+from columnar import ColumnarAssembler, ColumnarMempool
+from consensus import COIN
+
+
+logger = logging.getLogger(__name__)
+
+# Core's default limit on in-mempool ancestors
+MAX_CHAIN_DEPTH = 25
+
+# Relative frequency of each package topology
+TOPOLOGIES = {
+    "single": 60,
+    "chain": 10,
+    "fan_in": 10,
+    "fan_out": 5,
+    "diamond": 10,
+    "multisig": 5,
+}
+
+
+class Generator(object):
+    """
+    Seeded generator of synthetic mempools in the `getrawmempool True` schema,
+    including the `sigopscost`/`ancestorsigops` fields from `core.patch`.
+
+    Transactions come in independent packages (singles, deep chains, CPFP fan-ins,
+    fan-outs, diamonds and sigop-heavy multisig spends), so ancestor and descendant
+    aggregates are computed per package and entries can be streamed out.
+    """
+
+    def __init__(self, seed: int = 0, height: int = 650_000, time: int = 1_600_000_000):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.height = height
+        self.time = time
+        self.count = 0
+        self.kinds = list(TOPOLOGIES)
+        self.kind_weights = list(TOPOLOGIES.values())
+
+    def _txid(self) -> str:
+        self.count += 1
+        return hashlib.sha256(f"{self.seed}:{self.count}".encode()).hexdigest()
+
+    def _fee_rate(self) -> float:
+        """
+        Skewed sat/vB distribution: most transactions pay little, a long tail pays a lot
+        """
+        return max(1.0, self.rng.lognormvariate(math.log(5), 1.2))
+
+    def _tx(self, fee_rate=None, sigops=None, weight=None) -> dict:
+        weight = weight or int(self.rng.lognormvariate(math.log(600), 0.6)) + 400
+        vsize = (weight + 3) // 4
+        fee_rate = self._fee_rate() if fee_rate is None else fee_rate
+        return {
+            "txid": self._txid(),
+            "weight": weight,
+            "vsize": vsize,
+            "fee": max(1, int(fee_rate * vsize)),
+            "sigops": self.rng.choice([0, 1, 1, 2, 4, 4, 8]) if sigops is None else sigops,
+            "depends": [],
+        }
+
+    def _package(self, kind: str, limit: int) -> list:
+        """
+        Returns up to `limit` transactions, parents first, with `depends` indices
+        into the package
+        """
+        rng = self.rng
+        if kind == "chain" and limit >= 2:
+            txs = [self._tx() for _ in range(min(limit, rng.randint(2, MAX_CHAIN_DEPTH)))]
+            for i in range(1, len(txs)):
+                txs[i]["depends"] = [i - 1]
+        elif kind == "fan_in" and limit >= 3:
+            parents = [self._tx(fee_rate=1.0) for _ in range(min(limit - 1, rng.randint(2, 20)))]
+            child = self._tx(fee_rate=self._fee_rate() * 10)
+            child["depends"] = list(range(len(parents)))
+            txs = parents + [child]
+        elif kind == "fan_out" and limit >= 3:
+            txs = [self._tx()] + [self._tx() for _ in range(min(limit - 1, rng.randint(2, 20)))]
+            for child in txs[1:]:
+                child["depends"] = [0]
+        elif kind == "diamond" and limit >= 4:
+            txs = [self._tx() for _ in range(4)]
+            txs[1]["depends"] = [0]
+            txs[2]["depends"] = [0]
+            txs[3]["depends"] = [1, 2]
+        elif kind == "multisig":
+            # Bare/P2SH multisig spends: 20 sigops per CHECKMULTISIG, scaled by 4
+            inputs = rng.randint(1, 10)
+            txs = [self._tx(sigops=80 * inputs, weight=4 * (150 + 300 * inputs))]
+        else:
+            txs = [self._tx()]
+        return txs
+
+    def _entries(self, txs: list):
+        """
+        Yields (txid, entry) for a package, computing in-package aggregates
+        """
+        n = len(txs)
+        children = [[] for _ in range(n)]
+        for i, tx in enumerate(txs):
+            for parent in tx["depends"]:
+                children[parent].append(i)
+
+        # Parents precede children, so ancestor sets build forwards and
+        # descendant sets backwards
+        ancestors = []
+        for i, tx in enumerate(txs):
+            found = {i}
+            for parent in tx["depends"]:
+                found |= ancestors[parent]
+            ancestors.append(found)
+        descendants = [None] * n
+        for i in reversed(range(n)):
+            found = {i}
+            for child in children[i]:
+                found |= descendants[child]
+            descendants[i] = found
+
+        for i, tx in enumerate(txs):
+            ancestorfees = sum(txs[j]["fee"] for j in ancestors[i])
+            descendantfees = sum(txs[j]["fee"] for j in descendants[i])
+            fee = tx["fee"] / COIN
+            yield tx["txid"], {
+                "fees": {
+                    "base": fee,
+                    "modified": fee,
+                    "ancestor": ancestorfees / COIN,
+                    "descendant": descendantfees / COIN,
+                },
+                "vsize": tx["vsize"],
+                "weight": tx["weight"],
+                "sigopscost": tx["sigops"],
+                "time": self.time + self.count,
+                "height": self.height,
+                "descendantcount": len(descendants[i]),
+                "descendantsize": sum(txs[j]["vsize"] for j in descendants[i]),
+                "ancestorcount": len(ancestors[i]),
+                "ancestorsize": sum(txs[j]["vsize"] for j in ancestors[i]),
+                "ancestorsigops": sum(txs[j]["sigops"] for j in ancestors[i]),
+                "wtxid": tx["txid"],
+                "depends": [txs[j]["txid"] for j in tx["depends"]],
+                "spentby": [txs[j]["txid"] for j in children[i]],
+                "bip125-replaceable": False,
+                "unbroadcast": False,
+            }
+
+    def generate(self, size: int):
+        """
+        Yields `size` (txid, entry) pairs. Fees are floats holding exact 8-decimal
+        BTC amounts, so they serialize as plain JSON numbers.
+        """
+        remaining = size
+        while remaining > 0:
+            kind = self.rng.choices(self.kinds, self.kind_weights)[0]
+            txs = self._package(kind, remaining)
+            remaining -= len(txs)
+            yield from self._entries(txs)
+
+
+def write_mempool(path, entries):
+    """
+    Stream (txid, entry) pairs to `path` as a `getrawmempool True` result. Returns
+    a `ColumnarMempool` of the same transactions for building a matching template.
+    """
+    with open(path, "w") as f:
+        def written():
+            for i, (txid, entry) in enumerate(entries):
+                f.write(("," if i else "") + json.dumps(txid) + ":" + json.dumps(entry))
+                yield txid, entry
+
+        f.write("{")
+        mempool = ColumnarMempool.from_items(written())
+        f.write("}")
+    return mempool
+
+
+def blocktemplate(mempool: ColumnarMempool, height: int, version: int = 0x20000000, previousblockhash: str = 64 * "0") -> dict:
+    """
+    A `getblocktemplate` response with the transactions our assembler picks
+    """
+    block = ColumnarAssembler(mempool).create_block(height, version, previousblockhash)
+    position = {txid: i + 1 for i, txid in enumerate(block.tx)}
+    transactions = [
+        {
+            "data": "",
+            "txid": txid,
+            "hash": txid,
+            "depends": [position[parent_txid] for parent_txid in tx.depends],
+            "fee": tx.fee,
+            "sigops": tx.sigopscost,
+            "weight": tx.weight,
+        }
+        for txid, tx in block.tx.items()
+    ]
+    return {
+        "version": version,
+        "previousblockhash": previousblockhash,
+        "transactions": transactions,
+        "coinbasevalue": block.subsidy + block.fee,
+        "height": height,
+        "sigoplimit": 80000,
+        "weightlimit": 4000000,
+        "reservedweight": COINBASE_WEIGHT,
+    }
+
+
+def generate_fixture(size: int, mempool_path, template_path, seed: int = 0, height: int = 650_000):
+    generator = Generator(seed, height)
+    mempool = write_mempool(mempool_path, generator.generate(size))
+    with open(template_path, "w") as f:
+        json.dump(blocktemplate(mempool, height + 1), f)
+    logger.info(f"wrote {size:,} transactions to {mempool_path} and template to {template_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic mempool and matching blocktemplate")
+    parser.add_argument("size", type=int, help="number of transactions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--height", type=int, default=650_000, help="chain tip height")
+    parser.add_argument("--mempool", default="mempool.json", help="getrawmempool True output path")
+    parser.add_argument("--template", default="template.json", help="getblocktemplate output path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    generate_fixture(args.size, args.mempool, args.template, args.seed, args.height)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Iterative traversals of the `depends`/`spentby` graph of a mempool.
+
+Each traversal uses an explicit stack and a visited set, so every transaction is
+touched at most once per call even when it is reachable along several paths, as
+in diamond-shaped packages.
+
+`csr`, `gather` and `reachable_pairs` build and walk graphs held as NumPy CSR
+arrays instead, for `columnar` and `validation`.
+"""
+import numpy as np
+
+
+def _closure(mempool, txids, edges: str, exclude=frozenset()) -> set:
+    found = set()
+    stack = list(txids)
+    while stack:
+        for _txid in getattr(mempool[stack.pop()], edges):
+            if _txid not in found and _txid not in exclude:
+                found.add(_txid)
+                stack.append(_txid)
+    return found
+
+
+def ancestors(mempool, txid: str, exclude=frozenset()) -> set:
+    """
+    Returns the in-mempool ancestors of `txid`, not including itself. The walk
+    does not continue past transactions in `exclude`.
+    """
+    return _closure(mempool, [txid], "depends", exclude)
+
+
+def descendants(mempool, txid: str, exclude=frozenset()) -> set:
+    """
+    Returns the in-mempool descendants of `txid`, not including itself. The walk
+    does not continue past transactions in `exclude`.
+    """
+    return _closure(mempool, [txid], "spentby", exclude)
+
+
+def ancestors_of_set(mempool, txids, exclude=frozenset()) -> set:
+    """
+    Returns the union of the ancestors of all `txids`
+    """
+    return _closure(mempool, txids, "depends", exclude)
+
+
+def descendants_of_set(mempool, txids, exclude=frozenset()) -> set:
+    """
+    Returns the union of the descendants of all `txids`
+    """
+    return _closure(mempool, txids, "spentby", exclude)
+
+
+def parents_first(mempool, txids) -> list:
+    """
+    Orders `txids` so that every transaction comes after those of its ancestors
+    which are also in `txids`
+    """
+    txids = set(txids)
+    ordered = []
+    done = set()
+    for root in txids:
+        if root in done:
+            continue
+        # Post-order DFS over `depends`, restricted to `txids`
+        stack = [(root, False)]
+        while stack:
+            txid, expanded = stack.pop()
+            if expanded:
+                ordered.append(txid)
+                continue
+            if txid in done:
+                continue
+            done.add(txid)
+            stack.append((txid, True))
+            for parent_txid in mempool[txid].depends:
+                if parent_txid in txids and parent_txid not in done:
+                    stack.append((parent_txid, False))
+    return ordered
+
+
+def csr(n, edges):
+    """
+    Build (indptr, indices) from an int array of (row, column) pairs
+    """
+    order = np.argsort(edges[:, 0], kind="stable")
+    indices = edges[order, 1].astype(np.int32)
+    counts = np.bincount(edges[:, 0], minlength=n)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return indptr, indices
+
+
+def gather(indptr, indices, rows):
+    """
+    Concatenate the CSR rows `rows` of (`indptr`, `indices`) without a Python loop.
+    Returns (position in `rows` each entry came from, entries).
+    """
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # Position of each gathered entry within `indices`
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+    return np.repeat(np.arange(len(rows)), lengths), indices[offsets].astype(np.int64)
+
+
+def sorted_unique(keys):
+    """
+    Sorted unique values of an int array. A plain sort, as `np.unique` hashes
+    large int64 arrays much more slowly.
+    """
+    keys = np.sort(keys)
+    if keys.size:
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    return keys
+
+
+def reachable_pairs(n, indptr, indices, sources) -> tuple:
+    """
+    (source, reached) index arrays pairing each of `sources` with every index it
+    reaches along the CSR graph of `n` nodes, each pair once and sorted. Walks
+    one generation at a time for all sources together.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    position, reached = gather(indptr, indices, sources)
+    seen = frontier = sorted_unique(sources[position] * n + reached)
+    while frontier.size:
+        position, reached = gather(indptr, indices, frontier % n)
+        keys = sorted_unique((frontier // n)[position] * n + reached)
+        # Also stops a walk round a cycle
+        at = np.minimum(np.searchsorted(seen, keys), seen.size - 1)
+        frontier = keys[seen[at] != keys]
+        seen = np.sort(np.concatenate((seen, frontier)))
+    return seen // n, seen % n
@@ -0,0 +1,134 @@
+import logging
+from bisect import bisect_right
+
+import graph
+from consensus import MAX_BLOCK_WEIGHT, WITNESS_SCALE_FACTOR
+
+
+logger = logging.getLogger(__name__)
+
+# Lower bound in sat/vB of each bucket, as in Core's proposed mempool fee histogram
+FEE_RATE_BUCKETS = [
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 12, 14, 17, 20, 25, 30, 40, 50, 60, 70, 80, 100,
+    120, 140, 170, 200, 250, 300, 400, 500, 600, 700, 800, 1000, 1200, 1400, 1700,
+    2000, 2500, 3000, 4000, 5000, 6000, 7000, 8000, 10000,
+]
+
+MAX_BLOCK_VSIZE = MAX_BLOCK_WEIGHT // WITNESS_SCALE_FACTOR
+
+
+class FeeHistogram(object):
+    """
+    Bucketed index of mempool transactions by ancestor fee rate.
+
+    Each transaction's own vsize and fee are counted in the bucket of its ancestor
+    fee rate. Inserting, removing or re-rating a transaction is a bisect over the
+    fixed bucket bounds, and cumulative queries walk the buckets, never the mempool.
+    """
+
+    def __init__(self, bounds=FEE_RATE_BUCKETS):
+        self.bounds = list(bounds)
+        self.count = [0] * len(self.bounds)
+        self.vsize = [0] * len(self.bounds)
+        self.fees = [0] * len(self.bounds)
+        # txid -> (bucket, vsize, fee)
+        self.entries = {}
+
+    @classmethod
+    def from_mempool(cls, mempool):
+        histogram = cls()
+        for txid, tx in mempool.items():
+            histogram.add(txid, tx)
+        return histogram
+
+    def bucket(self, fee_rate: float) -> int:
+        return max(0, bisect_right(self.bounds, fee_rate) - 1)
+
+    def add(self, txid: str, tx, fee_rate: float = None):
+        if fee_rate is None:
+            fee_rate = tx.ancestorfees / tx.ancestorsize
+        bucket = self.bucket(fee_rate)
+        fee = tx.modifiedfee
+        self.entries[txid] = (bucket, tx.vsize, fee)
+        self.count[bucket] += 1
+        self.vsize[bucket] += tx.vsize
+        self.fees[bucket] += fee
+
+    def remove(self, txid: str):
+        bucket, vsize, fee = self.entries.pop(txid)
+        self.count[bucket] -= 1
+        self.vsize[bucket] -= vsize
+        self.fees[bucket] -= fee
+
+    def update(self, txid: str, tx):
+        """
+        Move `txid` to the bucket of its current ancestor fee rate
+        """
+        if self.entries[txid][0] != self.bucket(tx.ancestorfees / tx.ancestorsize):
+            self.remove(txid)
+            self.add(txid, tx)
+
+    def without(self, mempool, txids):
+        """
+        Copy of the histogram as `mempool.remove_transactions(txids)` would leave
+        it, e.g. without a blocktemplate's transactions: they are dropped and their
+        descendants re-rated without them. The mempool is not modified.
+        """
+        histogram = FeeHistogram(self.bounds)
+        histogram.count = list(self.count)
+        histogram.vsize = list(self.vsize)
+        histogram.fees = list(self.fees)
+        histogram.entries = dict(self.entries)
+
+        removed = {txid for txid in txids if txid in self.entries}
+        for txid in removed:
+            histogram.remove(txid)
+        for txid in graph.descendants_of_set(mempool, removed, exclude=removed):
+            tx = mempool[txid]
+            ancestors = graph.ancestors(mempool, txid) & removed
+            size = tx.ancestorsize - sum(mempool[_txid].vsize for _txid in ancestors)
+            fees = tx.ancestorfees - sum(mempool[_txid].modifiedfee for _txid in ancestors)
+            histogram.remove(txid)
+            histogram.add(txid, tx, fees / size)
+        return histogram
+
+    def vsize_above(self, fee_rate: float) -> int:
+        """
+        Total vsize of transactions in buckets at or above the bucket of `fee_rate`
+        """
+        return sum(self.vsize[self.bucket(fee_rate):])
+
+    def count_above(self, fee_rate: float) -> int:
+        return sum(self.count[self.bucket(fee_rate):])
+
+    def fee_rate_for_vsize(self, vsize: int) -> float:
+        """
+        Lower bound of the bucket in which the cumulative vsize, counted from the
+        highest fee rates down, reaches `vsize`. 0 if the whole mempool fits.
+        """
+        total = 0
+        for bucket in reversed(range(len(self.bounds))):
+            total += self.vsize[bucket]
+            if total >= vsize:
+                return self.bounds[bucket]
+        return 0
+
+    def fee_rate_for_blocks(self, blocks: int) -> float:
+        """
+        Approximate fee rate needed to be mined within the next `blocks` blocks
+        """
+        return self.fee_rate_for_vsize(blocks * MAX_BLOCK_VSIZE)
+
+    def rows(self) -> list:
+        """
+        (lower bound, count, vsize, cumulative vsize) for each non-empty bucket,
+        highest fee rate first
+        """
+        rows = []
+        cumulative = 0
+        for bucket in reversed(range(len(self.bounds))):
+            if not self.count[bucket]:
+                continue
+            cumulative += self.vsize[bucket]
+            rows.append((self.bounds[bucket], self.count[bucket], self.vsize[bucket], cumulative))
+        return rows
@@ -0,0 +1,136 @@
+import codecs
+import decimal
+import json
+import logging
+
+from authproxy import JSONRPCException
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = " \t\n\r"
+# Characters which may continue a number
+NUMBER_CHARS = "0123456789+-.eE"
+
+
+class _Reader(object):
+    """
+    Incrementally decoded text buffer over a binary file-like object
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def fill(self) -> bool:
+        """
+        Append another chunk to the buffer, dropping what has been consumed.
+        Returns False at EOF.
+        """
+        if self.eof:
+            return False
+        data = self.fp.read(self.chunk_size)
+        self.bytes_read += len(data)
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + self.decoder.decode(data, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def skip_whitespace(self) -> str:
+        """
+        Advance past whitespace and return the next character, or "" at EOF
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.skip_whitespace() != char:
+            raise ValueError(f"expected {char!r} at offset {self.bytes_read} of JSON stream")
+        self.pos += 1
+
+    def decode(self, decoder: json.JSONDecoder):
+        """
+        Decode the next complete JSON value, reading more data until it is buffered.
+        A value ending where the buffer does, or followed by what may continue a
+        number, may be a number cut short by the chunk boundary, e.g. `0.` of
+        `0.0001`, so it is decoded again with more data.
+        """
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            if (end == len(self.buf) or self.buf[end] in NUMBER_CHARS) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def rest(self) -> str:
+        while self.fill():
+            pass
+        return self.buf[self.pos:]
+
+
+def iter_result_items(fp, chunk_size=CHUNK_SIZE):
+    """
+    Yields (key, value) pairs of the `result` object of a JSON-RPC response read
+    from the binary file-like `fp`, one entry at a time, so that a
+    `getrawmempool True` dump is never held in memory as a whole.
+    Floats are parsed as Decimal, like `AuthServiceProxy`.
+    """
+    decoder = json.JSONDecoder(parse_float=decimal.Decimal)
+    reader = _Reader(fp, chunk_size)
+
+    reader.expect("{")
+    key = None
+    if reader.skip_whitespace() == '"':
+        key = reader.decode(decoder)
+        reader.expect(":")
+    if key != "result" or reader.skip_whitespace() != "{":
+        # Not the layout bitcoind sends for a successful call, parse it whole
+        prefix = "{" if key is None else "{" + json.dumps(key) + ":"
+        response = json.loads(prefix + reader.rest(), parse_float=decimal.Decimal)
+        if response.get("error") is not None:
+            raise JSONRPCException(response["error"])
+        yield from (response.get("result") or {}).items()
+        return
+
+    reader.expect("{")
+    count = 0
+    if reader.skip_whitespace() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.decode(decoder)
+            reader.expect(":")
+            yield key, reader.decode(decoder)
+            count += 1
+            char = reader.skip_whitespace()
+            reader.pos += 1
+            if char == "}":
+                break
+            if char != ",":
+                raise ValueError(f"expected ',' or '}}' at offset {reader.bytes_read} of JSON stream")
+
+    # Remainder of the envelope, e.g. `,"error":null,"id":1}`
+    tail = reader.rest().strip()
+    if tail.startswith(","):
+        response = json.loads("{" + tail[1:], parse_float=decimal.Decimal)
+        if response.get("error") is not None:
+            raise JSONRPCException(response["error"])
+    logger.debug(f"streamed {count} entries from {reader.bytes_read:,} bytes")
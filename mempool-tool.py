@@ -1,26 +1,269 @@
+import argparse
+import json
 import logging
+import logging.handlers
+import time
+from time import perf_counter
 
 import analyse
+import backtest
+import blockdiff
+import eviction
+import metrics
+from blockcache import BlockCache
 import rpc
 import miner
+import validation
+from mempool import Mempool, to_sats
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def series_logger(path, max_bytes, backup_count):
+    """
+    A logger which appends one JSON record per line to a rolling file at `path`
+    """
+    series = logging.getLogger("series")
+    series.propagate = False
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    series.addHandler(handler)
+    series.setLevel(logging.INFO)
+    return series
+
+
+def record_metrics(args, mempool):
+    """
+    Record mempool gauges and write the metrics file, if one was asked for
+    """
+    metrics.gauge("transactions", len(mempool))
+    metrics.gauge("vsize", mempool.total_vsize)
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+
+
+def validate(args, mempool):
+    """
+    Log any inconsistencies in the synced mempool, if asked for
+    """
+    if args.validate:
+        validation.log_findings(validation.validate_mempool(mempool), "mempool")
+
+
+def project_trim(args, mempool):
+    """
+    Print what trimming the mempool to each `--maxmempool` limit would evict and
+    the resulting min fee, with the node's memory usage per vbyte and relay fees
+    """
+    if not args.maxmempool:
+        return
+    info = rpc.rpc.getmempoolinfo()
+    results = eviction.trim_to_sizes(
+        mempool, [int(limit * 1_000_000) for limit in args.maxmempool],
+        usage_per_vbyte=info["usage"] / info["bytes"] if info["bytes"] else 1.0,
+        # BTC/kvB to sat/vB
+        min_relay_fee=to_sats(info["minrelaytxfee"]) / 1000,
+        incremental_relay_fee=to_sats(info["incrementalrelayfee"]) / 1000,
+    )
+    eviction.print_trim(results)
+    for limit, result in zip(args.maxmempool, results):
+        metrics.gauge("trim_min_fee_rate", result.min_fee_rate, maxmempool=f"{limit:g}")
+
+
+def build_assembler(args, mempool):
+    """
+    The assembler chosen with `--assembler`, linearizing clusters with `--workers`
+    """
+    if args.assembler == "cluster":
+        mempool.clusters.linearize(mempool, args.workers)
+    return miner.ASSEMBLERS[args.assembler](mempool)
+
+
+def compare_template(mempool, template):
+    """
+    Assemble our own block for the template's height from the same mempool and
+    print how the two differ
+    """
+    assembled = miner.create_block(mempool, template.height, template.version, template.previousblockhash)
+    diff = blockdiff.diff_blocks(template, assembled)
+    blockdiff.print_diff(diff)
+    metrics.gauge("template_overlap", diff.overlap)
+    metrics.gauge("template_fee_delta", diff.fee_delta)
+
+
+def export_analysis(args, blocks):
+    """
+    Save the reorg grid and print the fee-sniping simulation, if asked for.
+    `blocks` starts with the tip's parent.
+    """
+    if args.reorg_grid:
+        analyse.ReorgGrid.from_blocks(blocks).save(args.reorg_grid)
+    if args.snipe_runs:
+        analyse.print_fee_sniping(blocks[1:], args.snipe_runs)
+
+
+def wait_for_refresh(interval, tip_hash):
+    """
+    Sleep until `interval` seconds have passed or the chain tip moves
+    """
+    deadline = time.monotonic() + interval
+    while time.monotonic() < deadline:
+        time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+        try:
+            best_hash = rpc.rpc.getbestblockhash()
+        except Exception as e:
+            logger.debug(f"tip check failed: {e}")
+            continue
+        if best_hash != tip_hash:
+            logger.info("chain tip changed")
+            return
+
+
+def watch(args):
+    """
+    Keep the mempool resident and refresh the projection every `args.watch` seconds
+    or on a new tip. The mempool is synced incrementally; instead of
+    `remove_block` mutating it, the assembler treats the template's transactions
+    as already mined. A refresh which fails is logged and retried at the next
+    interval.
+    """
+    series = series_logger(args.series, args.series_max_bytes, args.series_backups) if args.series else None
+    mempool = Mempool()
+    tip_hash, previous, tip = None, None, None
+    sequence = None
+
+    while True:
+        try:
+            tic = perf_counter()
+            best_hash = rpc.rpc.getbestblockhash()
+            new_tip = best_hash != tip_hash
+            if new_tip:
+                previous, tip = rpc.fetch_tip_blocks(best_hash)
+            rpc.sync_mempool(mempool)
+            validate(args, mempool)
+
+            if best_hash == tip_hash and mempool.sequence is not None and mempool.sequence == sequence:
+                logger.info("no change since last refresh")
+            else:
+                tip_hash, sequence = best_hash, mempool.sequence
+                template = rpc.fetch_blocktemplate()
+                if template.previousblockhash != best_hash:
+                    # A block arrived since `getbestblockhash`, so the mempool and
+                    # tip blocks are stale too. Refresh again straight away.
+                    logger.warning("block found between getbestblockhash and getblocktemplate")
+                    sequence = None
+                    continue
+                template.height = tip.height + 1
+                template.tip_offset = "+ 1"
+                if new_tip and args.archive:
+                    backtest.archive_snapshot(args.archive, tip.height, mempool, template)
+                if args.diff:
+                    compare_template(mempool, template)
+                project_trim(args, mempool)
+
+                skipped = [transaction["txid"] for transaction in template.tx]
+                assembler = build_assembler(args, mempool)
+                assembler.skip(skipped)
+                # The first builds on the template, which has no hash until it is mined
+                projected = list(assembler.project_blocks(tip.height + 2, tip.version, None, args.blocks))
+
+                blocks = [previous, tip, template]
+                blocks.extend(projected)
+                # As one-shot mode shows it, after `remove_block`
+                analyse.print_blocks(blocks, mempool.histogram.without(mempool, skipped))
+                export_analysis(args, blocks)
+                elapsed = perf_counter() - tic
+                logger.info(f"refresh took {elapsed:.3f} seconds")
+                metrics.observe("refresh", elapsed)
+                record_metrics(args, mempool)
+
+                if series:
+                    series.info(json.dumps({
+                        "time": int(time.time()),
+                        "tip": tip.height,
+                        "mempool_size": len(mempool),
+                        "refresh_seconds": elapsed,
+                        "blocks": [analyse.block_record(block) for block in analyse.annotate_blocks(blocks)],
+                        "metrics": metrics.as_dict(),
+                    }))
+        except Exception:
+            # e.g. the node restarting. The next refresh projects again, even
+            # if the mempool sequence hasn't moved.
+            logger.exception("refresh failed, retrying at the next interval")
+            sequence = None
+
+        wait_for_refresh(args.watch, tip_hash)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Project blocks from the mempool")
+    parser.add_argument(
+        "-n", "--blocks", type=int, default=1,
+        help="number of blocks to project after the blocktemplate (default: 1)",
+    )
+    parser.add_argument(
+        "--watch", type=float, metavar="SECONDS",
+        help="keep running, refreshing every SECONDS or when the tip changes",
+    )
+    parser.add_argument("--series", help="in watch mode, append a JSON record per refresh to this file")
+    parser.add_argument("--series-max-bytes", type=int, default=10_000_000, help="roll the series file at this size")
+    parser.add_argument("--series-backups", type=int, default=5, help="rolled series files to keep")
+    parser.add_argument(
+        "--metrics", metavar="PATH",
+        help="write timings and counters in Prometheus text format to PATH, after each refresh in watch mode",
+    )
+    parser.add_argument("--diff", action="store_true", help="compare Core's blocktemplate with our own for the same height")
+    parser.add_argument("--reorg-grid", metavar="PATH", help="save reorg chances for every block pair and hash power to PATH (.npz)")
+    parser.add_argument(
+        "--snipe-runs", type=int, metavar="RUNS",
+        help="simulate RUNS fee-sniping races against the tip per hash power",
+    )
+    parser.add_argument("--archive", metavar="DIR", help="save the mempool and template at each new tip to DIR for backtest.py")
+    parser.add_argument("--block-cache", metavar="PATH", help="keep confirmed block metadata in PATH between runs")
+    parser.add_argument(
+        "--assembler", choices=sorted(miner.ASSEMBLERS), default="ancestor",
+        help="select packages by ancestor score, or merge linearized cluster chunks (default: ancestor)",
+    )
+    parser.add_argument("--validate", action="store_true", help="check mempool links and ancestor aggregates after each sync")
+    parser.add_argument(
+        "--maxmempool", type=float, nargs="+", metavar="MB",
+        help="simulate the node trimming its mempool to each limit and print the resulting min fee",
+    )
+    parser.add_argument("-j", "--workers", type=int, help="processes linearizing clusters with --assembler cluster")
+    args = parser.parse_args()
+
+    if args.block_cache:
+        rpc.block_cache = BlockCache(path=args.block_cache)
+
+    if args.watch:
+        watch(args)
+        return
+
     previous, tip, template, mempool = rpc.fetch_synced()
+    validate(args, mempool)
+    if args.diff:
+        compare_template(mempool, template)
+    if args.archive:
+        backtest.archive_snapshot(args.archive, tip.height, mempool, template)
+    project_trim(args, mempool)
 
     # Subtract blocktemplate entries from mempool
     mempool.remove_block(template)
 
-    # Build a template for block tip + 2
-    tip_two = miner.get_blocktemplate(mempool, tip.height + 2, tip.version, tip.hash)
+    # Build templates for blocks tip + 2 onwards, on top of the template, which has
+    # no hash until it is mined
+    if args.assembler == "cluster":
+        mempool.clusters.linearize(mempool, args.workers)
+    projected = miner.get_blocktemplates(mempool, tip.height + 2, tip.version, None, args.blocks, args.assembler)
 
     # Make a list
-    blocks = [previous, tip, template, tip_two]
+    blocks = [previous, tip, template]
+    blocks.extend(projected)
 
-    analyse.print_blocks(blocks)
+    analyse.print_blocks(blocks, mempool.histogram)
+    export_analysis(args, blocks)
+    record_metrics(args, mempool)
 
 
 if __name__ == "__main__":
@@ -1,51 +1,94 @@
 import logging
+import sys
+from time import perf_counter
+
 import attr
 
+import graph
+import metrics
+import snapshot
+from cluster import ClusterIndex
 from consensus import COIN
+from eviction import DescendantScoreIndex
+from histogram import FeeHistogram
 
 
 logger = logging.getLogger(__name__)
 
 
-@attr.s
+def to_sats(btc) -> int:
+    """
+    Convert a BTC amount, Decimal or float, to integer sats
+    """
+    return int(round(btc * COIN))
+
+
+@attr.s(slots=True)
 class MempoolTransaction(object):
     """
     Represents a transaction in the mempool.
+    Fees are integer sats, converted once on load, and `depends`/`spentby` are
+    tuples of interned txids.
     """
     # TODO: add ancestorweight
 
-    ignore_fields = ["bip125-replaceable", "wtxid", "unbroadcast", "fee"]
-
-    fees = attr.ib()
-    vsize = attr.ib()
-    weight = attr.ib()
-    modifiedfee = attr.ib()
-    sigopscost = attr.ib()
-    time = attr.ib()
-    height = attr.ib()
-    descendantcount = attr.ib()
-    descendantsize = attr.ib()
-    descendantfees = attr.ib()
-    ancestorcount = attr.ib()
-    ancestorsize = attr.ib()
-    ancestorsigops = attr.ib()
-    ancestorfees = attr.ib()
-    depends = attr.ib()
-    spentby = attr.ib()
+    fee = attr.ib(type=int)
+    modifiedfee = attr.ib(type=int)
+    vsize = attr.ib(type=int)
+    weight = attr.ib(type=int)
+    sigopscost = attr.ib(type=int)
+    time = attr.ib(type=int)
+    height = attr.ib(type=int)
+    descendantcount = attr.ib(type=int)
+    descendantsize = attr.ib(type=int)
+    descendantfees = attr.ib(type=int)
+    ancestorcount = attr.ib(type=int)
+    ancestorsize = attr.ib(type=int)
+    ancestorsigops = attr.ib(type=int)
+    ancestorfees = attr.ib(type=int)
+    depends = attr.ib(type=tuple)
+    spentby = attr.ib(type=tuple)
 
     @classmethod
     def from_json(cls, d: dict):
         """
         Load from a json (dict) representation.
         """
-        df = {k: v for k, v in d.items() if k not in MempoolTransaction.ignore_fields}
-        return cls(**df)
+        fees = d["fees"]
+        return cls(
+            fee=to_sats(fees["base"]),
+            modifiedfee=to_sats(fees["modified"]),
+            vsize=d["vsize"],
+            weight=d["weight"],
+            sigopscost=d["sigopscost"],
+            time=d["time"],
+            height=d["height"],
+            descendantcount=d["descendantcount"],
+            descendantsize=d["descendantsize"],
+            descendantfees=to_sats(fees["descendant"]),
+            ancestorcount=d["ancestorcount"],
+            ancestorsize=d["ancestorsize"],
+            ancestorsigops=d["ancestorsigops"],
+            ancestorfees=to_sats(fees["ancestor"]),
+            depends=tuple(sys.intern(txid) for txid in d["depends"]),
+            spentby=tuple(sys.intern(txid) for txid in d["spentby"]),
+        )
 
     @property
     def fee_rate(self):
         return self.ancestorfees / self.ancestorsize
 
 
+@attr.s
+class RemovalStats(object):
+    """
+    Summary of a bulk removal from the mempool.
+    """
+    removed = attr.ib(type=int)
+    touched = attr.ib(type=int)
+    elapsed = attr.ib(type=float)
+
+
 class Mempool(dict):
     """
     Represents a mempool.
@@ -53,18 +96,125 @@ class Mempool(dict):
 
     def __init__(self, *args, **kwargs):
         dict.__init__(self, *args, **kwargs)
+        # `mempool_sequence` from Core as of the last sync, if known
+        self.sequence = None
+        self._histogram = None
+        self._clusters = None
+        self._descendant_scores = None
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        # Bulk updates bypass index maintenance, rebuild on next use
+        self._histogram = None
+        self._clusters = None
+        self._descendant_scores = None
+
+    @property
+    def histogram(self) -> FeeHistogram:
+        """
+        Fee-rate histogram of the mempool, built on first use and then kept current
+        by the methods which add and remove transactions
+        """
+        if self._histogram is None:
+            self._histogram = FeeHistogram.from_mempool(self)
+        return self._histogram
+
+    @property
+    def clusters(self) -> ClusterIndex:
+        """
+        Cluster index of the mempool, built on first use and then kept current
+        by the methods which add and remove transactions
+        """
+        if self._clusters is None:
+            self._clusters = ClusterIndex.from_mempool(self)
+        return self._clusters
+
+    @property
+    def descendant_scores(self) -> DescendantScoreIndex:
+        """
+        Descendant score index of the mempool, as used by Core to pick what to evict,
+        built on first use and then kept current by the methods which add and
+        remove transactions
+        """
+        if self._descendant_scores is None:
+            self._descendant_scores = DescendantScoreIndex.from_mempool(self)
+        return self._descendant_scores
 
     @classmethod
+    @metrics.timed("load", source="json")
     def from_json(cls, d: dict):
         """
         Load from a json (dict) mempool dump from Core RPC `getrawmempool True`.
         """
-        df = {k: MempoolTransaction.from_json(v) for k, v in d.items()}
-        return cls(**df)
+        return cls((sys.intern(k), MempoolTransaction.from_json(v)) for k, v in d.items())
+
+    @classmethod
+    @metrics.timed("load", source="stream")
+    def from_stream(cls, items):
+        """
+        Load from an iterable of (txid, json entry) pairs, e.g. from
+        `jsonstream.iter_result_items`, building each entry as it arrives.
+        When streaming from RPC, the timing includes reading the response body.
+        """
+        return cls((sys.intern(txid), MempoolTransaction.from_json(v)) for txid, v in items)
+
+    def save(self, path):
+        """
+        Write the mempool as a binary snapshot, see `snapshot`.
+        """
+        index = {txid: i for i, txid in enumerate(self)}
+        records = (
+            (
+                tx.vsize,
+                tx.weight,
+                tx.fee,
+                tx.modifiedfee,
+                tx.sigopscost,
+                tx.time,
+                tx.height,
+                tx.descendantcount,
+                tx.descendantsize,
+                tx.descendantfees,
+                tx.ancestorcount,
+                tx.ancestorsize,
+                tx.ancestorfees,
+                tx.ancestorsigops,
+            )
+            for tx in self.values()
+        )
+        edges = (
+            (index[parent_txid], i)
+            for i, tx in enumerate(self.values())
+            for parent_txid in tx.depends
+        )
+        snapshot.write(path, list(self), records, edges, self.sequence)
+
+    @classmethod
+    @metrics.timed("load", source="snapshot")
+    def load(cls, path):
+        """
+        Load a mempool saved with `save`.
+        """
+        snap = snapshot.Snapshot.read(path)
+        txids = [sys.intern(txid) for txid in snap.txids()]
+        names = [name for name, _ in snapshot.FIELDS]
+        depends = [[] for _ in txids]
+        spentby = [[] for _ in txids]
+        for parent, child in snap.iter_edges():
+            depends[child].append(txids[parent])
+            spentby[parent].append(txids[child])
+        mempool = cls()
+        for i, (txid, record) in enumerate(zip(txids, snap.iter_records())):
+            mempool[txid] = MempoolTransaction(
+                depends=tuple(depends[i]), spentby=tuple(spentby[i]), **dict(zip(names, record))
+            )
+        mempool.sequence = snap.sequence
+        logger.debug(f"loaded {len(mempool)} transactions from {path}")
+        return mempool
 
     @property
     def total_fee(self):
-        return int(sum([tx.fees["base"] for tx in self.values()]) * COIN)
+        return sum([tx.fee for tx in self.values()])
 
     @property
     def total_weight(self) -> int:
@@ -79,69 +229,263 @@ class Mempool(dict):
         return sum([tx.sigopscost for tx in self.values()])
 
     def calculate_chain_weight(self, txid):
-        weight = 0
-        for ancestor_txid in self[txid].depends:
-            weight += self.calculate_chain_weight(ancestor_txid)
-        weight += self[txid].weight
-        return weight
+        """
+        Weight of `txid` plus all of its in-mempool ancestors, each counted once
+        """
+        chain = graph.ancestors(self, txid)
+        chain.add(txid)
+        return sum(self[_txid].weight for _txid in chain)
+
+    def _link(self, parent_txid: str, child_txid: str):
+        parent = self[parent_txid]
+        child = self[child_txid]
+        if child_txid not in parent.spentby:
+            parent.spentby += (child_txid,)
+        if parent_txid not in child.depends:
+            child.depends += (parent_txid,)
 
-    def update_descendants(self, txid: str, fee: int, size: int, sigopscost: int, first: bool = False):
+    def _unlink(self, parent_txid: str, child_txid: str):
+        parent = self[parent_txid]
+        child = self[child_txid]
+        parent.spentby = tuple(_txid for _txid in parent.spentby if _txid != child_txid)
+        child.depends = tuple(_txid for _txid in child.depends if _txid != parent_txid)
+
+    def update_ancestors(self, txid: str, fee: int, size: int):
+        """
+        Update ancestors' `descendant count/size/fees` for a transaction being removed
+        from the mempool, before it is unlinked
+        """
+        for ancestor_txid in graph.ancestors(self, txid):
+            ancestor = self[ancestor_txid]
+            ancestor.descendantcount -= 1
+            ancestor.descendantsize -= size
+            ancestor.descendantfees -= fee
+            if self._descendant_scores is not None:
+                self._descendant_scores.update(ancestor_txid, ancestor)
+
+    def update_descendants(self, txid: str, fee: int, size: int, sigopscost: int):
         """
         Update descendants' `ancestor fee/size/sigops` for a transaction being removed
-        from the mempool.
-        On the first recursion we also remove ourselves from `depends` of first
-        children.
+        from the mempool, and unlink it from its parents and children.
+        Each descendant is updated once, however many paths lead to it.
         """
+        for parent_txid in self[txid].depends:
+            self._unlink(parent_txid, txid)
+
         # If we have no descendants, just return
         if not self[txid].spentby:
             logger.debug(f"no descendants to update for {txid}")
             return
 
-        # Each tx in txid.spentby should have (this) `txid` removed from it's depends
-        if first:
-            for child_txid in self[txid].spentby:
-                self[child_txid].depends.remove(txid)
-                logger.debug(f"removed {txid} from depends of descendant tx {child_txid}")
+        # Find descendants while the children are still linked
+        descendants = graph.descendants(self, txid)
 
-        # Decrement count, size, fee and sigops recursively
+        # Each tx in txid.spentby should have (this) `txid` removed from it's depends
         for child_txid in self[txid].spentby:
-            self[child_txid].ancestorcount -= 1
-            self[child_txid].ancestorsize -= size
-            self[child_txid].ancestorfees -= fee
-            self[child_txid].ancestorsigops -= sigopscost
-            self.update_descendants(child_txid, fee, size, sigopscost, first=False)
-            logger.debug(f"updated tx {child_txid} descendant of tx {txid}")
+            self._unlink(txid, child_txid)
+            logger.debug(f"removed {txid} from depends of descendant tx {child_txid}")
+
+        # Decrement count, size, fee and sigops
+        for descendant_txid in descendants:
+            descendant = self[descendant_txid]
+            descendant.ancestorcount -= 1
+            descendant.ancestorsize -= size
+            descendant.ancestorfees -= fee
+            descendant.ancestorsigops -= sigopscost
+            if self._histogram is not None:
+                self._histogram.update(descendant_txid, descendant)
+            logger.debug(f"updated tx {descendant_txid} descendant of tx {txid}")
 
     def remove_transaction(self, txid: str):
         """
         Removes a transaction from the mempool.
         Unlike Bitcoin Core, we *are* modifying the mempool in place so that we can
         create a second blocktemplate after the first.
+        Only `txid` itself is subtracted from its ancestors and descendants, so remove
+        a block's transactions parents first and evicted packages children first, or
+        use `remove_transactions`.
         """
         if txid not in self:
             logger.error(f"not removed {txid} from mempool as not found")
             return
-        # Remove ancestor fee/size from descendants
+        # Remove descendant fee/size from ancestors and ancestor fee/size/sigops from descendants
+        self.update_ancestors(txid=txid, fee=self[txid].modifiedfee, size=self[txid].vsize)
         self.update_descendants(
             txid=txid,
-            fee=int(self[txid].fees["base"] * COIN),
+            fee=self[txid].modifiedfee,
             size=self[txid].vsize,
             sigopscost=self[txid].sigopscost,
-            first=True,
         )
 
         del self[txid]
+        if self._histogram is not None:
+            self._histogram.remove(txid)
+        if self._clusters is not None:
+            self._clusters.remove(txid)
+        if self._descendant_scores is not None:
+            self._descendant_scores.remove(txid)
         logger.debug(f"removed {txid} from mempool and updated descendants")
 
-    def remove_block(self, blocktemplate):
+    def add_transactions(self, txs: dict):
+        """
+        Adds new transactions, e.g. from `getmempoolentry`, linking them to the
+        entries already present. Pre-existing ancestors of the new transactions
+        have their descendant count, size and fees increased, and pre-existing
+        descendants their ancestor aggregates.
+
+        Links to transactions we don't have are dropped, so the new entries'
+        ancestor and descendant aggregates are recomputed from the links kept.
+        Core's would still count a child which entered its mempool after our
+        listing, and count it again when it is added on the next sync.
+        """
+        txs = {sys.intern(txid): tx for txid, tx in txs.items()}
+        for txid, tx in txs.items():
+            self[txid] = tx
+        for txid, tx in txs.items():
+            # Drop links to transactions we don't know about, e.g. evicted since
+            tx.depends = tuple(_txid for _txid in tx.depends if _txid in self)
+            tx.spentby = tuple(_txid for _txid in tx.spentby if _txid in self)
+            for parent_txid in tx.depends:
+                self._link(parent_txid, txid)
+            for child_txid in tx.spentby:
+                self._link(txid, child_txid)
+            if self._clusters is not None:
+                self._clusters.add(txid, tx)
+
+        for txid, tx in txs.items():
+            fee = tx.modifiedfee
+            ancestors = graph.ancestors(self, txid)
+            descendants = graph.descendants(self, txid) if tx.spentby else ()
+            tx.ancestorcount = 1 + len(ancestors)
+            tx.ancestorsize = tx.vsize + sum(self[_txid].vsize for _txid in ancestors)
+            tx.ancestorfees = fee + sum(self[_txid].modifiedfee for _txid in ancestors)
+            tx.ancestorsigops = tx.sigopscost + sum(self[_txid].sigopscost for _txid in ancestors)
+            tx.descendantcount = 1 + len(descendants)
+            tx.descendantsize = tx.vsize + sum(self[_txid].vsize for _txid in descendants)
+            tx.descendantfees = fee + sum(self[_txid].modifiedfee for _txid in descendants)
+            for ancestor_txid in ancestors:
+                # New entries' descendants were just counted from the links
+                if ancestor_txid not in txs:
+                    self[ancestor_txid].descendantcount += 1
+                    self[ancestor_txid].descendantsize += tx.vsize
+                    self[ancestor_txid].descendantfees += fee
+                    if self._descendant_scores is not None:
+                        self._descendant_scores.update(ancestor_txid, self[ancestor_txid])
+            for descendant_txid in descendants:
+                # An entry we had already, whose parent was unknown until now
+                if descendant_txid not in txs:
+                    descendant = self[descendant_txid]
+                    descendant.ancestorcount += 1
+                    descendant.ancestorsize += tx.vsize
+                    descendant.ancestorfees += fee
+                    descendant.ancestorsigops += tx.sigopscost
+                    if self._histogram is not None:
+                        self._histogram.update(descendant_txid, descendant)
+            if self._histogram is not None:
+                self._histogram.add(txid, tx)
+            if self._descendant_scores is not None:
+                self._descendant_scores.add(txid, tx)
+
+        # A new transaction may bridge entries we had already, e.g. a parent arriving
+        # after its child. Those ancestors and descendants now count each other too.
+        new = txs.keys()
+        bridges = [txid for txid, tx in txs.items() if any(_txid not in txs for _txid in tx.spentby)]
+        for descendant_txid in graph.descendants_of_set(self, bridges) - new:
+            descendant = self[descendant_txid]
+            bridged = graph.ancestors(self, descendant_txid) - graph.ancestors(self, descendant_txid, exclude=new) - new
+            for ancestor_txid in bridged:
+                ancestor = self[ancestor_txid]
+                ancestor.descendantcount += 1
+                ancestor.descendantsize += descendant.vsize
+                ancestor.descendantfees += descendant.modifiedfee
+                descendant.ancestorcount += 1
+                descendant.ancestorsize += ancestor.vsize
+                descendant.ancestorfees += ancestor.modifiedfee
+                descendant.ancestorsigops += ancestor.sigopscost
+                if self._descendant_scores is not None:
+                    self._descendant_scores.update(ancestor_txid, ancestor)
+            if bridged and self._histogram is not None:
+                self._histogram.update(descendant_txid, descendant)
+        logger.debug(f"added {len(txs)} transactions to mempool")
+
+    def remove_transactions(self, txids) -> RemovalStats:
+        """
+        Removes a set of transactions from the mempool in bulk.
+        The surviving descendants of all removed transactions are found once, then
+        their ancestor count, size, fees and sigops are recomputed in a single
+        parents-first sweep which carries each entry's set of removed ancestors.
+        """
+        tic = perf_counter()
+        removed = {txid for txid in txids if txid in self}
+        affected = graph.descendants_of_set(self, removed, exclude=removed)
+
+        # txid -> removed ancestors of txid, for removed and affected transactions
+        removed_ancestors = {}
+        for txid in graph.parents_first(self, removed | affected):
+            found = set()
+            for parent_txid in self[txid].depends:
+                if parent_txid in removed_ancestors:
+                    found |= removed_ancestors[parent_txid]
+                if parent_txid in removed:
+                    found.add(parent_txid)
+            removed_ancestors[txid] = found
+
+        for txid in affected:
+            tx = self[txid]
+            for ancestor_txid in removed_ancestors[txid]:
+                ancestor = self[ancestor_txid]
+                tx.ancestorcount -= 1
+                tx.ancestorsize -= ancestor.vsize
+                tx.ancestorfees -= ancestor.modifiedfee
+                tx.ancestorsigops -= ancestor.sigopscost
+            if self._histogram is not None:
+                self._histogram.update(txid, tx)
+
+        # Surviving ancestors, e.g. of evicted or replaced transactions, lose the
+        # removed transactions from their descendant count, size and fees. Blocks
+        # remove whole ancestor sets, leaving none.
+        survivors = graph.ancestors_of_set(self, removed) - removed
+        if survivors:
+            for txid in removed & graph.descendants_of_set(self, survivors):
+                tx = self[txid]
+                for ancestor_txid in graph.ancestors(self, txid) & survivors:
+                    ancestor = self[ancestor_txid]
+                    ancestor.descendantcount -= 1
+                    ancestor.descendantsize -= tx.vsize
+                    ancestor.descendantfees -= tx.modifiedfee
+            if self._descendant_scores is not None:
+                for ancestor_txid in survivors:
+                    self._descendant_scores.update(ancestor_txid, self[ancestor_txid])
+
+        # Unlink removed transactions from the survivors
+        for txid in removed:
+            for parent_txid in self[txid].depends:
+                if parent_txid not in removed:
+                    self._unlink(parent_txid, txid)
+            for child_txid in self[txid].spentby:
+                if child_txid not in removed:
+                    self._unlink(txid, child_txid)
+        for txid in removed:
+            del self[txid]
+            if self._histogram is not None:
+                self._histogram.remove(txid)
+            if self._clusters is not None:
+                self._clusters.remove(txid)
+            if self._descendant_scores is not None:
+                self._descendant_scores.remove(txid)
+
+        stats = RemovalStats(len(removed), len(affected), perf_counter() - tic)
+        logger.debug(f"removed {stats.removed} transactions and updated {stats.touched} descendants in {stats.elapsed:.5f} seconds")
+        return stats
+
+    @metrics.timed("remove_block")
+    def remove_block(self, blocktemplate) -> RemovalStats:
         """
         Intersects transactions in a `blocktemplate` and `mempool`
         """
         logger.debug(f"starting intersection of blocktemplate and mempool")
 
-        i = 0
-        for transaction in blocktemplate.tx:
-            self.remove_transaction(transaction["txid"])
-            i += 1
-        logger.info(f"deleted {i} transactions from mempool after intersection")
-        logger.info(f"mempool has {len(self)} transactions remaining")
\ No newline at end of file
+        stats = self.remove_transactions(transaction["txid"] for transaction in blocktemplate.tx)
+        logger.info(f"deleted {stats.removed} transactions from mempool after intersection, updating {stats.touched} descendants in {stats.elapsed:.5f} seconds")
+        logger.info(f"mempool has {len(self)} transactions remaining")
+        return stats
@@ -0,0 +1,175 @@
+"""
+Process-wide timers, counters and gauges.
+
+Timers record count, total, last and max seconds per name and label set, counters
+accumulate and gauges hold the latest value. Recording is a dict update under a
+lock, cheap enough for per-RPC and per-phase use but not for per-transaction use;
+hot loops should count locally and `inc` once.
+
+Results are available as a plain dict from `as_dict` or in the Prometheus text
+exposition format from `to_prometheus`/`write_prometheus`, e.g. for the node
+exporter's textfile collector.
+"""
+import functools
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+PREFIX = "mempool_"
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> [count, total, last, max]
+        self.timers = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = seconds
+                timer[3] = max(timer[3], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Time the body of a `with` block, including when it raises
+        """
+        tic = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - tic, **labels)
+
+    def timed(self, name: str, **labels):
+        """
+        Decorator timing every call of the function
+        """
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def inc(self, name: str, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, value, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    def as_dict(self) -> dict:
+        """
+        {"timers": {name: [{"labels", "count", "seconds", "last", "max"}]},
+        "counters": {name: [{"labels", "value"}]}, "gauges": likewise}
+        """
+        with self.lock:
+            timers = {key: list(timer) for key, timer in self.timers.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+
+        result = {"timers": {}, "counters": {}, "gauges": {}}
+        for (name, labels), (count, total, last, longest) in sorted(timers.items()):
+            result["timers"].setdefault(name, []).append(
+                {"labels": dict(labels), "count": count, "seconds": total, "last": last, "max": longest}
+            )
+        for kind, values in (("counters", counters), ("gauges", gauges)):
+            for (name, labels), value in sorted(values.items()):
+                result[kind].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return result
+
+    def to_prometheus(self, prefix: str = PREFIX) -> str:
+        """
+        Timers become summaries `<name>_seconds` with `_last` and `_max` gauges,
+        counters become `<name>_total`
+        """
+        with self.lock:
+            timers = {key: list(timer) for key, timer in self.timers.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+
+        lines = []
+
+        def family(metric, kind, samples):
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.extend(samples)
+
+        by_name = {}
+        for (name, labels), timer in sorted(timers.items()):
+            by_name.setdefault(name, []).append((labels, timer))
+        for name, series in by_name.items():
+            metric = f"{prefix}{name}_seconds"
+            family(metric, "summary", [
+                line
+                for labels, (count, total, _, _) in series
+                for line in (
+                    f"{metric}_sum{_format_labels(labels)} {total!r}",
+                    f"{metric}_count{_format_labels(labels)} {count}",
+                )
+            ])
+            family(f"{metric}_last", "gauge", [f"{metric}_last{_format_labels(labels)} {timer[2]!r}" for labels, timer in series])
+            family(f"{metric}_max", "gauge", [f"{metric}_max{_format_labels(labels)} {timer[3]!r}" for labels, timer in series])
+
+        for kind, values, suffix in (("counter", counters, "_total"), ("gauge", gauges, "")):
+            by_name = {}
+            for (name, labels), value in sorted(values.items()):
+                by_name.setdefault(name, []).append(f"{prefix}{name}{suffix}{_format_labels(labels)} {value!r}")
+            for name, samples in by_name.items():
+                family(f"{prefix}{name}{suffix}", kind, samples)
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix: str = PREFIX):
+        """
+        Write `to_prometheus` output to `path` atomically, so a scraper never
+        reads a partial file
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
+
+observe = METRICS.observe
+timer = METRICS.timer
+timed = METRICS.timed
+inc = METRICS.inc
+gauge = METRICS.gauge
+as_dict = METRICS.as_dict
+to_prometheus = METRICS.to_prometheus
+write_prometheus = METRICS.write_prometheus
@@ -1,9 +1,16 @@
+import heapq
+import itertools
 import logging
 from collections import OrderedDict
 from time import perf_counter
 
+import attr
 from tabulate import tabulate
 
+import cluster
+import graph
+import metrics
+import validation
 from block import Block, COINBASE_WEIGHT, COINBASE_SIGOPS
 from consensus import MAX_BLOCK_WEIGHT, MAX_BLOCK_SIGOPS_COST, WITNESS_SCALE_FACTOR
 from mempool import Mempool
@@ -12,21 +19,19 @@ from mempool import Mempool
 logger = logging.getLogger(__name__)
 MAX_BLOCK_SIZE = int(MAX_BLOCK_WEIGHT / WITNESS_SCALE_FACTOR)
 
+# Give up on a nearly-full block after this many packages in a row fail to fit
+MAX_CONSECUTIVE_FAILURES = 1000
+BLOCK_FULL_ENOUGH_WEIGHT_DELTA = 4000
+
 
 def check_mempool(mempool) -> bool:
     """
-    Checks mempool consistency. We must have all transactions listed as `depends`
-    but we also check `spentby` to make the program simpler later
-    """
-    for txid in mempool.keys():
-        for _txid in mempool[txid].depends:
-            if _txid not in mempool.keys():
-                logger.error(f"{_txid} missing from mempool listed as 'depends' for {txid}")
-                return False
-        for _txid in mempool[txid].spentby:
-            if _txid not in mempool.keys():
-                logger.error(f"{_txid} missing from mempool listed as 'spentby' for {txid}")
-                return False
+    Checks mempool consistency, logging any findings, see `validation.validate_mempool`
+    """
+    findings = validation.validate_mempool(mempool)
+    if findings:
+        validation.log_findings(findings, "mempool")
+        return False
     logger.debug(f"mempool check succeeded")
     return True
 
@@ -43,50 +48,357 @@ def sorted_mempool_list(mempool: Mempool) -> list:
     ]
 
 
-def create_block(mempool, height, version, previousblockhash) -> Block:
+@attr.s(frozen=True)
+class AssemblyPolicy(object):
     """
-    Create a new block based on a sorted transaction list
+    Limits used by `BlockAssembler.create_block`. The defaults reproduce Bitcoin
+    Core's consensus limits and its 4000 weight / 400 sigops coinbase reservation,
+    but without `-blockmintxfee` (`DEFAULT_BLOCK_MIN_TX_FEE`, 1 sat/vB).
     """
-    # Limit failed tries in case we have a large mempool
-    MAX_TRIES = 1000
-
-    block = Block(height, version, OrderedDict(), previousblockhash)
-
-    # Sort the mempool by `chain_fee_vsize`
-    sorted_list = sorted_mempool_list(mempool)
-
-    tries = 0
-    while sorted_list and tries < MAX_TRIES:
-        # Smallest tx size dictated by standard node policy
-        if block.weight > MAX_BLOCK_WEIGHT - 82:
-            logger.debug(f"cannot fit any more standard transactions into block")
-            break
-
-        txid = sorted_list.pop(0)
-        if txid in block.tx:
-            logger.debug(f"cannot add existing transaction {txid} to block {height}")
-            continue
+    max_weight = attr.ib(type=int, default=MAX_BLOCK_WEIGHT)
+    max_sigops = attr.ib(type=int, default=MAX_BLOCK_SIGOPS_COST)
+    coinbase_weight = attr.ib(type=int, default=COINBASE_WEIGHT)
+    coinbase_sigops = attr.ib(type=int, default=COINBASE_SIGOPS)
+    # sat/vB a package must pay to be included
+    min_fee_rate = attr.ib(type=float, default=0.0)
+    # Smallest tx weight dictated by standard node policy
+    min_tx_weight = attr.ib(type=int, default=82)
+    max_consecutive_failures = attr.ib(type=int, default=MAX_CONSECUTIVE_FAILURES)
+    full_enough_weight_delta = attr.ib(type=int, default=BLOCK_FULL_ENOUGH_WEIGHT_DELTA)
+
+
+class Assembler(object):
+    """
+    Fills blocks from a max-heap of candidates within an `AssemblyPolicy`.
+    Subclasses decide what a candidate is through hooks:
+
+    - `_next` pops the best candidate as (heap entry, size, fees, sigops), or
+      None if the entry popped is stale
+    - `_include` adds a candidate's transactions to the block
+    - `_defer` sets aside a candidate which doesn't fit, and `_requeue` offers
+      those again for the next block
+    """
+    # Label of the assembler's metrics
+    name = None
+
+    def __init__(self, mempool, policy=None):
+        self.mempool = mempool
+        self.policy = policy or AssemblyPolicy()
+        self.in_block = set()
+        self.heap = []
+
+    def create_block(self, height, version, previousblockhash) -> Block:
+        """
+        Fill a new block from the heap, best candidate first
+        """
+        with metrics.timer("create_block", assembler=self.name):
+            return self._fill_block(height, version, previousblockhash)
+
+    def _fill_block(self, height, version, previousblockhash) -> Block:
+        policy = self.policy
+        block = Block(
+            height, version, OrderedDict(), previousblockhash,
+            weight=policy.coinbase_weight, sigopscost=policy.coinbase_sigops,
+        )
+        consecutive_failed = 0
+        # Counted locally and recorded once per block
+        candidates = skipped_weight = skipped_sigops = 0
+
+        while self.heap:
+            # Smallest tx size dictated by standard node policy
+            if block.weight > policy.max_weight - policy.min_tx_weight:
+                logger.debug(f"cannot fit any more standard transactions into block")
+                break
+
+            candidate = self._next()
+            if candidate is None:
+                continue
+            entry, size, fees, sigops = candidate
+            candidates += 1
+
+            # Everything left scores lower, as in Core's blockMinFeeRate check
+            if fees < policy.min_fee_rate * size:
+                logger.debug(f"candidate fee rate below {policy.min_fee_rate} sat/vB, block complete")
+                heapq.heappush(self.heap, entry)
+                break
+
+            # Check we can fit the weight of the candidate.
+            # Below appears to be how Bitcoin Core does it; checking vsize * SCALE_FACTOR
+            # # TODO: switch this to ancestorweight
+            _weight = size * WITNESS_SCALE_FACTOR
+            _fits = block.weight + _weight < policy.max_weight
+            if not _fits:
+                logger.debug(f"cannot fit candidate of weight {_weight} into block with {policy.max_weight - block.weight} weight units remaining")
+                skipped_weight += 1
+            # Check we can fit the total SigOps of the candidate
+            elif not block.sigopscost + sigops < policy.max_sigops:
+                logger.debug(f"cannot fit candidate with {sigops} sigops in block with {policy.max_sigops - block.sigopscost} sigops remaining")
+                skipped_sigops += 1
+                _fits = False
+
+            if not _fits:
+                self._defer(entry)
+                consecutive_failed += 1
+                if consecutive_failed > policy.max_consecutive_failures and block.weight > policy.max_weight - policy.full_enough_weight_delta:
+                    logger.debug(f"giving up after {consecutive_failed} failures with block nearly full")
+                    break
+                continue
+
+            self._include(block, entry)
+            consecutive_failed = 0
+
+        # Candidates which didn't fit are offered again for the next block
+        self._requeue()
+
+        metrics.inc("assembly_candidates", candidates)
+        metrics.inc("assembly_skipped", skipped_weight, reason="weight")
+        metrics.inc("assembly_skipped", skipped_sigops, reason="sigops")
+        return block
+
+    def _next(self):
+        raise NotImplementedError
+
+    def _include(self, block: Block, entry):
+        raise NotImplementedError
+
+    def _defer(self, entry):
+        raise NotImplementedError
+
+    def _requeue(self):
+        raise NotImplementedError
+
+    def project_blocks(self, height, version, previousblockhash, count: int, first_offset: int = 2):
+        """
+        Yields up to `count` successive blocks, carrying the heap and modified entries
+        over from one block to the next. Stops early if the mempool is exhausted,
+        though the first block is yielded even if empty.
+        `previousblockhash` is the parent of the first block, None if unknown. The
+        others build on projected blocks, which have no hash, so theirs is None.
+        """
+        for i in range(count):
+            block = self.create_block(height + i, version, previousblockhash)
+            if not block.tx and i:
+                logger.info(f"mempool exhausted after {i} projected blocks")
+                return
+            block.tip_offset = f"+ {first_offset + i}"
+            previousblockhash = None
+            yield block
+
+
+class BlockAssembler(Assembler):
+    """
+    Assembles blocks by ancestor score, in the style of Bitcoin Core's `addPackageTxs`.
 
-        # Check we can fit the weight of the tx chain.
-        # Below appears to be how Bitcoin Core does it; checking vsize * SCALE_FACTOR
-        # # TODO: switch this to ancestorweight
-        _chain_weight = mempool[txid].ancestorsize * WITNESS_SCALE_FACTOR
-        if not block.weight + _chain_weight < MAX_BLOCK_WEIGHT:
-            logger.debug(f"cannot fit tx chain for {txid} of weight {_chain_weight} into block with {MAX_BLOCK_WEIGHT - block.weight} weight units remaining")
-            tries += 1
-            continue
+    Candidates are kept in a max-heap keyed on ancestor fee rate. When a package is
+    added to the block, the in-mempool descendants of every added transaction get a
+    "modified entry" with the included ancestors' fee, size and sigops subtracted,
+    and are re-pushed onto the heap with their new score. Stale heap entries are
+    skipped lazily when popped.
+    """
+    name = "ancestor"
+
+    def __init__(self, mempool: Mempool, policy=None):
+        super().__init__(mempool, policy)
+        # txid -> [ancestorsize, ancestorfees, ancestorsigops] excluding in-block ancestors
+        self.modified = {}
+        # Packages which didn't fit in the block being filled
+        self.failed = set()
+        self.heap = [
+            (-tx.ancestorfees / tx.ancestorsize, txid) for txid, tx in mempool.items()
+        ]
+        heapq.heapify(self.heap)
+
+    def _package(self, txid: str):
+        """
+        Returns (size, fees, sigops) of the package of `txid` not yet in a block
+        """
+        if txid in self.modified:
+            return self.modified[txid]
+        tx = self.mempool[txid]
+        return tx.ancestorsize, tx.ancestorfees, tx.ancestorsigops
+
+    def _ancestors(self, txid: str) -> list:
+        """
+        Returns `txid` and its ancestors not yet in a block, sorted parents first
+        """
+        package = graph.ancestors(self.mempool, txid, exclude=self.in_block)
+        package.add(txid)
+        return graph.parents_first(self.mempool, package)
+
+    def _add_to_block(self, block: Block, txid: str):
+        block._add_by_txid(txid, self.mempool)
+        self.in_block.add(txid)
+        self.modified.pop(txid, None)
+
+    def _update_packages_for_added(self, added: list):
+        """
+        Subtract each added transaction from the modified entries of its descendants
+        and re-score them.
+        """
+        updated = set()
+        for txid in added:
+            tx = self.mempool[txid]
+            fee = tx.modifiedfee
+            # Not stopping at in-block children, their own children still count `tx`
+            for descendant_txid in graph.descendants(self.mempool, txid):
+                if descendant_txid in self.in_block:
+                    continue
+                entry = self.modified.get(descendant_txid)
+                if entry is None:
+                    entry = self.modified[descendant_txid] = list(self._package(descendant_txid))
+                entry[0] -= tx.vsize
+                entry[1] -= fee
+                entry[2] -= tx.sigopscost
+                updated.add(descendant_txid)
+
+        for txid in updated:
+            size, fees, _ = self.modified[txid]
+            heapq.heappush(self.heap, (-fees / size, txid))
+
+    def skip(self, txids):
+        """
+        Treat `txids`, e.g. a blocktemplate's transactions, as already mined without
+        removing them from the mempool
+        """
+        added = [txid for txid in txids if txid in self.mempool and txid not in self.in_block]
+        self.in_block.update(added)
+        for txid in added:
+            self.modified.pop(txid, None)
+        self._update_packages_for_added(added)
+
+    def _next(self):
+        neg_score, txid = entry = heapq.heappop(self.heap)
+        if txid in self.in_block or txid in self.failed:
+            return None
+        size, fees, sigops = self._package(txid)
+        if -neg_score != fees / size:
+            # Superseded by a re-scored entry
+            return None
+        return entry, size, fees, sigops
+
+    def _include(self, block: Block, entry):
+        # Add the chain to the block, parents first
+        txid = entry[1]
+        package = self._ancestors(txid)
+        for _txid in package:
+            self._add_to_block(block, _txid)
+        logger.debug(f"added chain for tx {txid} to block {block.height}")
+        self._update_packages_for_added(package)
+
+    def _defer(self, entry):
+        self.failed.add(entry[1])
+
+    def _requeue(self):
+        for txid in self.failed:
+            size, fees, _ = self._package(txid)
+            heapq.heappush(self.heap, (-fees / size, txid))
+        self.failed.clear()
+
+
+class ClusterAssembler(Assembler):
+    """
+    Assembles blocks by merging the precomputed chunks of each cluster, see `cluster`.
 
-        # Check we can fit the total SigOps of the tx chain
-        _sigops_cost = mempool[txid].ancestorsigops
-        if not block.sigopscost + _sigops_cost < MAX_BLOCK_SIGOPS_COST:
-            logger.debug(f"cannot fit tx chain for {txid} with {_sigops_cost} sigops in block with {MAX_BLOCK_SIGOPS_COST - block.sigopscost} sigops remaining")
-            tries += 1
-            continue
+    A max-heap holds the next chunk of every cluster, keyed on its fee rate. Chunks
+    of a cluster come in non-increasing fee rate order, so the heap always offers
+    the best chunk in the mempool and nothing is re-scored when one is included.
+    As in Core's cluster mempool, if a chunk doesn't fit, the rest of its cluster
+    waits for the next block.
+    """
+    name = "cluster"
+
+    def __init__(self, mempool: Mempool, policy=None, workers=None):
+        super().__init__(mempool, policy)
+        self._keys = itertools.count()
+        # key -> chunks and position of the next chunk, one key per cluster
+        self.chunks = {}
+        self.position = {}
+        # Chunks which didn't fit in the block being filled
+        self.deferred = []
+        for chunks in mempool.clusters.linearize(mempool, workers).values():
+            self._push_cluster(chunks)
+        heapq.heapify(self.heap)
+
+    def _push_cluster(self, chunks: list):
+        key = next(self._keys)
+        self.chunks[key] = chunks
+        self.position[key] = 0
+        self.heap.append((-chunks[0].fee / chunks[0].size, key, 0))
+
+    def skip(self, txids):
+        """
+        Treat `txids`, e.g. a blocktemplate's transactions, as already mined without
+        removing them from the mempool. The clusters they leave are linearized again.
+        """
+        added = {txid for txid in txids if txid in self.mempool and txid not in self.in_block}
+        self.in_block.update(added)
+        clusters = self.mempool.clusters
+        touched = set()
+        for cluster_id in {clusters.cluster_of[txid] for txid in added}:
+            touched.update(clusters.members[cluster_id])
+
+        # Drop the clusters' chunks, their heap entries become stale. Each key's
+        # chunks lie within one cluster, so checking one txid is enough.
+        for key, chunks in list(self.chunks.items()):
+            if chunks[0].txids[0] in touched:
+                del self.chunks[key]
+                del self.position[key]
+        for txids in cluster.components(self.mempool, touched - self.in_block):
+            linearization = cluster.linearize(cluster.cluster_entries(self.mempool, txids))
+            self._push_cluster(cluster.to_chunks(self.mempool, linearization))
+        heapq.heapify(self.heap)
+
+    def _next(self):
+        entry = heapq.heappop(self.heap)
+        _, key, position = entry
+        if self.position.get(key) != position:
+            # Cluster re-linearized by `skip`
+            return None
+        chunk = self.chunks[key][position]
+        return entry, chunk.size, chunk.fee, chunk.sigops
+
+    def _include(self, block: Block, entry):
+        _, key, position = entry
+        chunks = self.chunks[key]
+        for txid in chunks[position].txids:
+            block._add_by_txid(txid, self.mempool)
+        self.in_block.update(chunks[position].txids)
+
+        position += 1
+        self.position[key] = position
+        if position < len(chunks):
+            heapq.heappush(self.heap, (-chunks[position].fee / chunks[position].size, key, position))
+
+    def _defer(self, entry):
+        self.deferred.append(entry)
+
+    def _requeue(self):
+        for entry in self.deferred:
+            heapq.heappush(self.heap, entry)
+        self.deferred.clear()
+
+
+ASSEMBLERS = {
+    "ancestor": BlockAssembler,
+    "cluster": ClusterAssembler,
+}
+
+
+def create_block(mempool, height, version, previousblockhash, policy=None) -> Block:
+    """
+    Create a new block by ancestor score, updating descendants' scores as packages
+    are included
+    """
+    return BlockAssembler(mempool, policy).create_block(height, version, previousblockhash)
 
-        # Add the chain to the block
-        block.add_transaction(txid, mempool)
 
-    return block
+def project_blocks(mempool, height, version, previousblockhash, count: int, assembler: str = "ancestor", policy=None) -> list:
+    """
+    Create `count` successive blocks starting at `height` in one incremental pass,
+    with one of `ASSEMBLERS`
+    """
+    assembler = ASSEMBLERS[assembler](mempool, policy)
+    return list(assembler.project_blocks(height, version, previousblockhash, count))
 
 
 def print_block_stats(block: Block, mempool_fee, mempool_weight, mempool_vsize, mempool_tx_count, mempool_sigops_count):
@@ -98,35 +410,24 @@ def print_block_stats(block: Block, mempool_fee, mempool_weight, mempool_vsize,
         ["vsize",        f"{mempool_vsize:,}",        f"{block.size:,}",          f"{MAX_BLOCK_SIZE:,}"],
         ["sigops",       f"{mempool_sigops_count:,}", f"{block.sigopscost:,}", f"{MAX_BLOCK_SIGOPS_COST:,}"]
     ]
-    table_headers = ["", "mempool", "tip + 2", "limit"]
+    table_headers = ["", "mempool", f"tip {block.tip_offset}", "limit"]
     print(f"\n{tabulate(table, headers=table_headers, tablefmt='github', colalign=('left', 'right', 'right', 'right'))}\n")
 
 
-def check_block(block: Block):
-    # Allocate for coinbase transaction as we don't have one included
-    weight = COINBASE_WEIGHT
-    sigops = COINBASE_SIGOPS
-    fee = 0
-    invalid = False
-
-    # Check each transaction in the block
-    for transaction in block.tx.values():
-        # Sum the vsize and fee
-        weight += transaction.weight
-        fee += transaction.fees["base"]
-        sigops += transaction.sigopscost
-        # If it has ancestors, check each ancestor is present
-        for txid in transaction.depends:
-            assert txid in block.tx
-
-    if weight > MAX_BLOCK_WEIGHT:
-        logger.error(f"weight: {weight:,} > {MAX_BLOCK_WEIGHT:,}")
-        invalid = True
-    if sigops > MAX_BLOCK_SIGOPS_COST:
-        logger.error(f"sigops: {sigops:,} > {MAX_BLOCK_SIGOPS_COST:,}")
-        invalid = True
-
-    if invalid:
+def check_block(block: Block, included=frozenset(), policy=None) -> bool:
+    """
+    Checks block limits, totals and that each transaction's parents come before it
+    in the block or are in `included`, the transactions of earlier projected
+    blocks. `policy` is the `AssemblyPolicy` the block was assembled with, whose
+    limits and coinbase reservation it is checked against. See
+    `validation.validate_block`.
+    """
+    policy = policy or AssemblyPolicy()
+    findings = validation.validate_block(
+        block, included, policy.coinbase_weight, policy.coinbase_sigops, policy.max_weight, policy.max_sigops
+    )
+    if findings:
+        validation.log_findings(findings, f"block {block.height}")
         logger.error("Block invalid!")
         return False
 
@@ -135,6 +436,13 @@ def check_block(block: Block):
 
 
 def get_blocktemplate(mempool: Mempool, height, version, previousblockhash) -> Block:
+    return get_blocktemplates(mempool, height, version, previousblockhash, 1)[0]
+
+
+def get_blocktemplates(mempool: Mempool, height, version, previousblockhash, count: int, assembler: str = "ancestor", policy=None) -> list:
+    """
+    Project `count` blocks from `height` onwards, printing stats for the first
+    """
     m_fee = mempool.total_fee
     m_weight = mempool.total_weight
     m_vsize = mempool.total_vsize
@@ -146,15 +454,17 @@ def get_blocktemplate(mempool: Mempool, height, version, previousblockhash) -> B
     logger.debug(f"{m_sigops:,} total sigops in mempool for blocktemplate")
 
     tic = perf_counter()
-    block = create_block(mempool, height, version, previousblockhash)
-    block.tip_offset = "+ 2"
+    blocks = project_blocks(mempool, height, version, previousblockhash, count, assembler, policy)
     toc = perf_counter()
-    logger.info(f"Block assembly took {toc - tic:.5f} seconds")
+    logger.info(f"Assembly of {len(blocks)} blocks took {toc - tic:.5f} seconds")
 
     # Print block stats
-    print_block_stats(block, m_fee, m_weight, m_vsize, m_tx, m_sigops)
+    print_block_stats(blocks[0], m_fee, m_weight, m_vsize, m_tx, m_sigops)
 
-    # Check the block is valid
-    check_block(block)
+    # Check the blocks are valid
+    included = set()
+    for block in blocks:
+        check_block(block, included, policy)
+        included.update(block.tx)
 
-    return block
+    return blocks
@@ -1,9 +1,16 @@
+import asyncio
 import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 
-from authproxy import AuthServiceProxy
-from block import Block
-from mempool import Mempool
+import metrics
+from aioproxy import AsyncAuthServiceProxy
+from authproxy import AuthServiceProxy, JSONRPCException
+from block import BLOCK_STATS, Block
+from blockcache import BlockCache
+from jsonstream import iter_result_items
+from mempool import Mempool, MempoolTransaction
 from private import rpc_user, rpc_password
 
 
@@ -11,43 +18,219 @@ logger = logging.getLogger(__name__)
 logging.getLogger("BitcoinRPC").setLevel(logging.INFO)
 
 
-rpc = AuthServiceProxy("http://%s:%s@127.0.0.1:8332" % (rpc_user, rpc_password))
+RPC_URL = "http://%s:%s@127.0.0.1:8332" % (rpc_user, rpc_password)
+# Keep-alive connections shared by concurrent fetches
+RPC_POOL_SIZE = 4
+rpc = AuthServiceProxy(RPC_URL, pool_size=RPC_POOL_SIZE)
+# Confirmed block metadata, replace with a persistent `BlockCache` to keep it across runs
+block_cache = BlockCache()
 
 
-def fetch_synced() -> Tuple[dict, Block, Block, Mempool]:
+def batch_call(proxy: AuthServiceProxy, calls: list) -> list:
+    """
+    Sends `calls`, a list of (method, args) pairs, as a single JSON-RPC batch and
+    returns the results in the same order.
+    """
+    requests = [getattr(proxy, method).get_request(*args) for method, args in calls]
+    return _batch_results(requests, proxy.batch(requests))
+
+
+async def batch_call_async(proxy: AsyncAuthServiceProxy, calls: list) -> list:
+    requests = [getattr(proxy, method).get_request(*args) for method, args in calls]
+    return _batch_results(requests, await proxy.batch(requests))
+
+
+def _batch_results(requests: list, responses: list) -> list:
+    responses = {response["id"]: response for response in responses}
+    results = []
+    for request in requests:
+        response = responses[request["id"]]
+        if response["error"] is not None:
+            raise JSONRPCException(response["error"])
+        results.append(response["result"])
+    return results
+
+
+def fetch_mempool(stream: bool = True, proxy: AuthServiceProxy = None) -> Mempool:
+    """
+    Fetches a verbose mempool dump. With `stream` the HTTP body is parsed as it
+    arrives and entries are built one at a time, rather than decoding the whole
+    response into a dict first.
+    """
+    proxy = proxy or rpc
+    if not stream:
+        return Mempool.from_json(proxy.getrawmempool(True))
+    response = proxy.getrawmempool.stream(True)
+    try:
+        return Mempool.from_stream(iter_result_items(response))
+    finally:
+        # Returns the connection, even if parsing stopped early
+        response.close()
+
+
+def fetch_blocktemplate(proxy: AuthServiceProxy = None) -> Block:
+    proxy = proxy or rpc
+    return Block.from_blocktemplate(proxy.getblocktemplate({"rules": ["segwit"]}))
+
+
+def _block_calls(block_hash: str) -> list:
+    return [("getblockheader", [block_hash]), ("getblockstats", [block_hash, BLOCK_STATS])]
+
+
+def fetch_block(block_hash: str, tip_offset: str = "", proxy: AuthServiceProxy = None, cache: BlockCache = None) -> Block:
+    """
+    Fetches a confirmed block's metadata and fees in one batch, unless cached
+    """
+    proxy = proxy or rpc
+    cache = block_cache if cache is None else cache
+    block = cache.get(block_hash, tip_offset)
+    if block is None:
+        header, stats = batch_call(proxy, _block_calls(block_hash))
+        block = Block.from_header_stats(header, stats, tip_offset)
+        cache.put(block)
+    return block
+
+
+async def fetch_block_async(block_hash: str, proxy: AsyncAuthServiceProxy, tip_offset: str = "", cache: BlockCache = None) -> Block:
+    cache = block_cache if cache is None else cache
+    block = cache.get(block_hash, tip_offset)
+    if block is None:
+        header, stats = await batch_call_async(proxy, _block_calls(block_hash))
+        block = Block.from_header_stats(header, stats, tip_offset)
+        cache.put(block)
+    return block
+
+
+def fetch_tip_blocks(tip_hash: str, proxy: AuthServiceProxy = None) -> Tuple[Block, Block]:
+    """
+    Fetches the tip and 'tip - 1' blocks with their fees
+    """
+    tip = fetch_block(tip_hash, u"\u2193", proxy)
+    previous = fetch_block(tip.previousblockhash, "- 1", proxy)
+    return previous, tip
+
+
+async def fetch_tip_blocks_async(tip_hash: str, proxy: AsyncAuthServiceProxy) -> Tuple[Block, Block]:
+    tip = await fetch_block_async(tip_hash, proxy, u"\u2193")
+    previous = await fetch_block_async(tip.previousblockhash, proxy, "- 1")
+    return previous, tip
+
+
+@metrics.timed("sync")
+def sync_mempool(mempool: Mempool, use_sequence: bool = True, batch_size: int = 1000) -> Mempool:
+    """
+    Brings `mempool` up to date in place by diffing a `getrawmempool false` txid
+    listing against it, fetching only new entries via batched `getmempoolentry`
+    and removing departed ones. An empty mempool gets a full fetch instead.
+    With `use_sequence`, nothing is fetched if `mempool_sequence` is unchanged.
+    """
+    if use_sequence:
+        listing = rpc.getrawmempool(False, True)
+        if mempool and listing["mempool_sequence"] == mempool.sequence:
+            logger.info(f"mempool unchanged at sequence {mempool.sequence}")
+            return mempool
+
+    if not mempool:
+        mempool.update(fetch_mempool())
+        # Taken before the dump, so the next sync still diffs anything that raced it
+        mempool.sequence = listing["mempool_sequence"] if use_sequence else None
+        logger.info(f"got mempool dump with {len(mempool)} transactions")
+        return mempool
+
+    if use_sequence:
+        txids = set(listing["txids"])
+    else:
+        txids = set(rpc.getrawmempool(False))
+
+    departed = [txid for txid in mempool if txid not in txids]
+    mempool.remove_transactions(departed)
+
+    new = [txid for txid in txids if txid not in mempool]
+    entries = {}
+    for i in range(0, len(new), batch_size):
+        chunk = new[i:i + batch_size]
+        requests = [rpc.getmempoolentry.get_request(txid) for txid in chunk]
+        by_id = {request["id"]: txid for request, txid in zip(requests, chunk)}
+        for response in rpc.batch(requests):
+            txid = by_id[response["id"]]
+            if response["error"] is not None:
+                logger.debug(f"{txid} left the mempool before it was fetched")
+                continue
+            entries[sys.intern(txid)] = MempoolTransaction.from_json(response["result"])
+    mempool.add_transactions(entries)
+
+    if use_sequence:
+        mempool.sequence = listing["mempool_sequence"]
+    logger.info(f"synced mempool: {len(new)} new, {len(departed)} departed, {len(mempool)} total")
+    return mempool
+
+
+@metrics.timed("fetch")
+def fetch_synced(stream: bool = True) -> Tuple[dict, Block, Block, Mempool]:
     """
     Fetches various data from Bitcoin Core RPC.
-    Will check that tip_height before and after the fetches match, if they don't a block
+    The small metadata calls are batched, and the blocktemplate, mempool dump and
+    tip blocks download concurrently on separate pooled connections.
+    Will check that the tip before and after the fetches match, if they don't a block
      was found between calls and try again.
     """
-    tip_height, _height_check = 0, 1
-    previous, tip, blocktemplate, mempool = None, None, None, None
-    mempool_ok = False
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        while True:
+            tip_height, tip_hash = batch_call(rpc, [("getblockcount", []), ("getbestblockhash", [])])
+
+            template_future = executor.submit(fetch_blocktemplate)
+            mempool_future = executor.submit(fetch_mempool, stream)
+            blocks_future = executor.submit(fetch_tip_blocks, tip_hash)
+            blocktemplate = template_future.result()
+            mempool = mempool_future.result()
+            previous, tip = blocks_future.result()
 
-    while not tip_height == _height_check and not mempool_ok:
-        tip_height = rpc.getblockcount()
-        tip_hash = rpc.getbestblockhash()
+            # Check if a block was found between RPCs
+            if rpc.getbestblockhash() == tip_hash:
+                break
+            logger.warning(f"block found between getblocktemplate and getrawmempool")
 
-        # First get blocktemplate as it's a subset of mempool
-        blocktemplate = Block.from_blocktemplate(rpc.getblocktemplate({"rules": ["segwit"]}))
-        blocktemplate.height = tip_height + 1
-        blocktemplate.tip_offset = "+ 1"
-        logger.info(f"got blocktemplate with {len(blocktemplate.tx)} transactions")
+    blocktemplate.height = tip_height + 1
+    blocktemplate.tip_offset = "+ 1"
+    logger.info(f"got blocktemplate with {len(blocktemplate.tx)} transactions")
+    logger.info(f"got mempool dump with {len(mempool)} transactions")
 
-        # Get a raw dump of the mempool
-        mempool = Mempool.from_json(rpc.getrawmempool(True))
-        logger.info(f"got mempool dump with {len(mempool)} transactions")
+    return previous, tip, blocktemplate, mempool
+
+
+async def fetch_synced_async(proxy: AsyncAuthServiceProxy = None) -> Tuple[dict, Block, Block, Mempool]:
+    """
+    asyncio variant of `fetch_synced`: the blocktemplate, mempool dump and tip blocks
+    are in flight together on one event loop.
+    """
+    own_proxy = proxy is None
+    if own_proxy:
+        proxy = AsyncAuthServiceProxy(RPC_URL, pool_size=RPC_POOL_SIZE)
+
+    try:
+        while True:
+            tip_height, tip_hash = await batch_call_async(
+                proxy, [("getblockcount", []), ("getbestblockhash", [])]
+            )
+            template, rawmempool, (previous, tip) = await asyncio.gather(
+                proxy.getblocktemplate({"rules": ["segwit"]}),
+                proxy.getrawmempool(True),
+                fetch_tip_blocks_async(tip_hash, proxy),
+            )
 
-        # Check if a block was found between RPCs
-        _height_check = rpc.getblockcount()
-        if not tip_height == _height_check:
+            # Check if a block was found between RPCs
+            if await proxy.getbestblockhash() == tip_hash:
+                break
             logger.warning(f"block found between getblocktemplate and getrawmempool")
-            continue
+    finally:
+        if own_proxy:
+            await proxy.close()
 
-        # Now populate block data for the tip and 'tip - 1'
-        tip = Block.from_getblock(rpc.getblock(tip_hash), tip_offset=u"\u2193")
-        tip.get_fee(rpc)
-        previous = Block.from_getblock(rpc.getblock(rpc.getblockstats(tip_height-1)["blockhash"]), tip_offset="- 1")
-        previous.get_fee(rpc)
+    blocktemplate = Block.from_blocktemplate(template)
+    blocktemplate.height = tip_height + 1
+    blocktemplate.tip_offset = "+ 1"
+    logger.info(f"got blocktemplate with {len(blocktemplate.tx)} transactions")
+    mempool = Mempool.from_json(rawmempool)
+    logger.info(f"got mempool dump with {len(mempool)} transactions")
 
     return previous, tip, blocktemplate, mempool
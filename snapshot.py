@@ -0,0 +1,92 @@
+"""
+Compact binary mempool snapshots.
+
+Layout, all little-endian:
+
+- header: magic, format version, transaction count, edge count, mempool sequence
+- txids: 32 raw bytes per transaction, in index order
+- records: one fixed-width `RECORD` per transaction, fees in integer sats
+- edges: (parent index, child index) pairs of uint32
+
+Files are read through a copy-on-write mmap, so loading maps the file rather than
+parsing it, and record fields can be viewed in place as NumPy arrays.
+"""
+import mmap
+import struct
+
+MAGIC = b"MEMPOOL\x00"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIIIq")
+TXID_SIZE = 32
+EDGE = struct.Struct("<II")
+
+# (field, struct code) in record order
+FIELDS = [
+    ("vsize", "I"),
+    ("weight", "I"),
+    ("fee", "q"),
+    ("modifiedfee", "q"),
+    ("sigopscost", "I"),
+    ("time", "q"),
+    ("height", "I"),
+    ("descendantcount", "I"),
+    ("descendantsize", "I"),
+    ("descendantfees", "q"),
+    ("ancestorcount", "I"),
+    ("ancestorsize", "I"),
+    ("ancestorfees", "q"),
+    ("ancestorsigops", "I"),
+]
+RECORD = struct.Struct("<" + "".join(code for _, code in FIELDS))
+
+
+def write(path, txids: list, records, edges, sequence=None):
+    """
+    Write a snapshot. `records` yields tuples in `FIELDS` order and `edges` yields
+    (parent index, child index) pairs.
+    """
+    edges = list(edges)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(txids), len(edges), -1 if sequence is None else sequence))
+        f.write(b"".join(bytes.fromhex(txid) for txid in txids))
+        f.write(b"".join(RECORD.pack(*record) for record in records))
+        f.write(b"".join(EDGE.pack(*edge) for edge in edges))
+
+
+class Snapshot(object):
+    """
+    A memory-mapped snapshot. `txid_bytes`, `records` and `edges` are memoryviews
+    over the mapping.
+    """
+
+    def __init__(self, buffer):
+        magic, version, self.count, self.edge_count, sequence = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError("not a mempool snapshot")
+        if version != VERSION:
+            raise ValueError(f"unsupported mempool snapshot version {version}")
+        self.sequence = None if sequence < 0 else sequence
+        self.buffer = memoryview(buffer)
+
+        offset = HEADER.size
+        self.txid_bytes = self.buffer[offset:offset + self.count * TXID_SIZE]
+        offset += self.count * TXID_SIZE
+        self.records = self.buffer[offset:offset + self.count * RECORD.size]
+        offset += self.count * RECORD.size
+        self.edges = self.buffer[offset:offset + self.edge_count * EDGE.size]
+
+    @classmethod
+    def read(cls, path):
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+
+    def txids(self) -> list:
+        raw = self.txid_bytes
+        return [raw[i:i + TXID_SIZE].hex() for i in range(0, len(raw), TXID_SIZE)]
+
+    def iter_records(self):
+        return RECORD.iter_unpack(self.records)
+
+    def iter_edges(self):
+        return EDGE.iter_unpack(self.edges)
@@ -0,0 +1,141 @@
+"""
+What-if sweep of block assembly policies over one mempool.
+
+The mempool is written once as a binary snapshot (see `snapshot`) into shared
+memory. Each worker process maps it as a read-only `ColumnarMempool`, so the
+transactions are never pickled, and assembles one block per `AssemblyPolicy`.
+"""
+import argparse
+import decimal
+import itertools
+import json
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import attr
+from tabulate import tabulate
+
+import columnar
+from block import Block
+from columnar import ColumnarMempool
+from mempool import Mempool
+from miner import AssemblyPolicy
+
+
+logger = logging.getLogger(__name__)
+
+# Set in each worker by `_attach`
+_shared = None
+_mempool = None
+
+
+def grid(**values) -> list:
+    """
+    Every combination of the given `AssemblyPolicy` field values, e.g.
+    `grid(min_fee_rate=[0, 1, 2], coinbase_weight=[4000, 8000])`
+    """
+    names = list(values)
+    return [AssemblyPolicy(**dict(zip(names, combination))) for combination in itertools.product(*values.values())]
+
+
+def _attach(name: str):
+    global _shared, _mempool
+    # Pool workers share the parent's resource tracker, which unlinks the
+    # segment only if the parent doesn't
+    _shared = shared_memory.SharedMemory(name=name)
+    _mempool = ColumnarMempool.from_buffer(_shared.buf)
+
+
+def _assemble(policy: AssemblyPolicy, height: int, version: int, previousblockhash: str) -> dict:
+    block = columnar.create_block(_mempool, height, version, previousblockhash, policy)
+    row = attr.asdict(policy)
+    row.update(
+        fee=block.fee,
+        reward=block.reward,
+        weight=block.weight,
+        sigops=block.sigopscost,
+        tx=len(block.tx),
+    )
+    return row
+
+
+def sweep(mempool, policies: list, height: int, version: int = 0x20000000, previousblockhash: str = 64 * "0", workers=None) -> list:
+    """
+    Assemble a block at `height` from `mempool` under each of `policies` in a
+    process pool. Returns one row per policy, in order, with the policy fields
+    and the block's fee, reward, weight, sigops and transaction count.
+    """
+    if isinstance(mempool, Mempool):
+        mempool = ColumnarMempool.from_mempool(mempool)
+    data = mempool.to_bytes()
+
+    shared = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        shared.buf[:len(data)] = data
+        del data
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(shared.name,)) as executor:
+            futures = [
+                executor.submit(_assemble, policy, height, version, previousblockhash)
+                for policy in policies
+            ]
+            return [future.result() for future in futures]
+    finally:
+        shared.close()
+        shared.unlink()
+
+
+def print_sweep(rows: list, baseline: int = 0):
+    """
+    Print sweep results, with each variant's fee relative to `rows[baseline]`
+    """
+    fields = [field.name for field in attr.fields(AssemblyPolicy)]
+    # Only show policy fields which vary
+    varied = [field for field in fields if len({row[field] for row in rows}) > 1]
+    base_fee = rows[baseline]["fee"]
+    table = [
+        [row[field] for field in varied] + [
+            f"{row['fee']:,}",
+            f"{row['fee'] - base_fee:+,}",
+            f"{row['reward']:,}",
+            f"{row['weight']:,}",
+            f"{row['sigops']:,}",
+            f"{row['tx']:,}",
+        ]
+        for row in rows
+    ]
+    headers = varied + ["fee", "vs baseline", "reward", "weight", "sigops", "tx"]
+    print(f"\n{tabulate(table, headers=headers, tablefmt='github')}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare block assembly policies on one mempool")
+    parser.add_argument("mempool", help="mempool snapshot (.bin) or `getrawmempool True` output (.json)")
+    parser.add_argument("--template", help="`getblocktemplate` output to remove from the mempool first, as for tip + 2")
+    parser.add_argument("--height", type=int, default=0, help="height of the assembled block, for the subsidy")
+    parser.add_argument("-j", "--workers", type=int, help="worker processes (default: CPU count)")
+    for field in attr.fields(AssemblyPolicy):
+        parser.add_argument(
+            "--" + field.name.replace("_", "-"), type=field.type, nargs="+", default=[field.default],
+            help=f"values to sweep (default: {field.default})",
+        )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.mempool.endswith(".bin"):
+        mempool = ColumnarMempool.load(args.mempool)
+    else:
+        with open(args.mempool) as f:
+            mempool = ColumnarMempool.from_json(json.load(f, parse_float=decimal.Decimal))
+    if args.template:
+        with open(args.template) as f:
+            mempool.remove_block(Block.from_blocktemplate(json.load(f, parse_float=decimal.Decimal)))
+
+    policies = grid(**{field.name: getattr(args, field.name) for field in attr.fields(AssemblyPolicy)})
+    print_sweep(sweep(mempool, policies, args.height, workers=args.workers))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+import analyse
+
+
+def test_reorg_chances_match_estimate_reorg():
+    ratios = [0.5, 0.98, 1.0, 1.02, 1.5, 3.0]
+    chances = analyse.reorg_chances(ratios)
+    for i, ratio in enumerate(ratios):
+        for j, hash_power in enumerate(analyse.HASH_POWERS):
+            assert abs(chances[i, j] - analyse.estimate_reorg(ratio, hash_power)) < 2e-7
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rpc
+from jsonstream import iter_result_items
+
+
+def idle(pool) -> list:
+    return list(pool._idle.queue)
+
+
+def test_consumed_stream_returns_connection(fake_node):
+    fake_node.txs = {"a": (200, 1000, ()), "b": (150, 3000, ("a",))}
+    pool = rpc.rpc._pool
+    response = rpc.rpc.getrawmempool.stream(True)
+    assert len(idle(pool)) == 1
+    assert [txid for txid, _ in iter_result_items(response)] == ["a", "b"]
+
+    # Back on top of the pool, still open, and used by the next call
+    connection = idle(pool)[-1]
+    assert len(idle(pool)) == 2 and connection is not None
+    assert pool.checkout() is connection
+    pool.checkin(connection)
+    assert rpc.rpc.getrawmempool() == ["a", "b"]
+
+
+def test_closed_stream_returns_fresh_connection(fake_node):
+    fake_node.txs = {"a": (200, 1000, ())}
+    pool = rpc.rpc._pool
+    response = rpc.rpc.getrawmempool.stream(True)
+    response.read(10)
+    response.close()
+    # Unread data was left on the socket, so a new connection takes its place
+    assert idle(pool) == [None, None]
+    response.close()
+    assert len(idle(pool)) == 2
+
+    assert rpc.fetch_mempool().keys() == {"a"}
+    assert len(idle(pool)) == 2
+
+
+def test_concurrent_callers_never_share_a_connection(fake_node):
+    fake_node.txs = {f"{i:064x}": (100 + i, 1000 + i, ()) for i in range(20)}
+    pool = rpc.rpc._pool
+    lock = threading.Lock()
+    in_use = set()
+    shared = []
+    checkout, checkin = pool.checkout, pool.checkin
+
+    def tracked_checkout():
+        connection = checkout()
+        with lock:
+            if id(connection) in in_use:
+                shared.append(connection)
+            in_use.add(id(connection))
+        return connection
+
+    def tracked_checkin(connection):
+        with lock:
+            in_use.discard(id(connection))
+        checkin(connection)
+
+    pool.checkout, pool.checkin = tracked_checkout, tracked_checkin
+
+    def fetch(txid):
+        return rpc.rpc.getmempoolentry(txid)["vsize"]
+
+    txids = sorted(fake_node.txs) * 5
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        vsizes = list(executor.map(fetch, txids))
+    assert vsizes == [fake_node.txs[txid][0] for txid in txids]
+    assert not shared
+    assert len(idle(pool)) == 2
@@ -0,0 +1,106 @@
+import random
+
+from cluster import ClusterIndex
+from conftest import core_entries
+from mempool import MempoolTransaction
+
+
+def partition(index: ClusterIndex) -> set:
+    return {frozenset(members) for members in index.members.values()}
+
+
+def chunks_by_cluster(index: ClusterIndex, mempool) -> dict:
+    chunks = index.linearize(mempool)
+    return {
+        frozenset(index.members[cluster_id]): [(chunk.txids, chunk.fee, chunk.size) for chunk in chunks[cluster_id]]
+        for cluster_id in index.members
+    }
+
+
+def add(mempool, txs: dict, new: dict):
+    """
+    Adds `new` to a mempool of `txs`, both txid -> (vsize, fee in sats, parent txids)
+    """
+    entries = core_entries({**txs, **new})
+    mempool.add_transactions({txid: MempoolTransaction.from_json(entries[txid]) for txid in new})
+
+
+def test_bridging_child_merges_clusters(make_mempool):
+    txs = {"a": (100, 1000, ()), "b": (100, 1000, ()), "x": (100, 1000, ())}
+    mempool = make_mempool(txs)
+    assert len(mempool.clusters) == 3
+
+    add(mempool, txs, {"c": (100, 1000, ("a", "b"))})
+    assert partition(mempool.clusters) == {frozenset("abc"), frozenset("x")}
+    assert partition(mempool.clusters) == partition(ClusterIndex.from_mempool(mempool))
+
+
+def test_removal_splits_cluster(make_mempool):
+    mempool = make_mempool({
+        "a": (100, 1000, ()),
+        "b": (100, 1000, ("a",)),
+        "c": (100, 1000, ("b",)),
+        "d": (100, 1000, ("c",)),
+    })
+    assert partition(mempool.clusters) == {frozenset("abcd")}
+
+    mempool.remove_transaction("b")
+    # Only marked until the next `split`
+    assert partition(mempool.clusters) == {frozenset("acd")}
+    assert mempool.clusters.dirty
+    mempool.clusters.split(mempool)
+    assert partition(mempool.clusters) == {frozenset("a"), frozenset("cd")}
+    assert not mempool.clusters.dirty
+    assert partition(mempool.clusters) == partition(ClusterIndex.from_mempool(mempool))
+
+
+def test_cpfp_pair_is_one_chunk(make_mempool):
+    mempool = make_mempool({
+        "parent": (1000, 1000, ()),
+        "child": (200, 50000, ("parent",)),
+        "other": (200, 4000, ()),
+    })
+    chunks = chunks_by_cluster(mempool.clusters, mempool)
+    assert chunks[frozenset(["parent", "child"])] == [(("parent", "child"), 51000, 1200)]
+
+
+def random_txs(rng: random.Random, count: int, prefix: str = "") -> dict:
+    txs = {}
+    for i in range(count):
+        txid = f"{prefix}{i:04}"
+        parents = tuple(rng.sample(sorted(txs), min(len(txs), rng.choice([0, 0, 1, 1, 2]))))
+        txs[txid] = (rng.randint(100, 1000), rng.randint(100, 100000), parents)
+    return txs
+
+
+def test_chunks_ordered_after_edits(make_mempool):
+    rng = random.Random(1)
+    txs = random_txs(rng, 200)
+    mempool = make_mempool(txs)
+    index = mempool.clusters
+    index.linearize(mempool)
+
+    for txid in rng.sample(sorted(mempool), 40):
+        mempool.remove_transaction(txid)
+    remaining = {txid: (vsize, fee, tuple(_txid for _txid in parents if _txid in mempool))
+                 for txid, (vsize, fee, parents) in txs.items() if txid in mempool}
+    # New transactions spend both survivors and each other, bridging clusters
+    new = {}
+    for i in range(60):
+        txid = f"n{i:04}"
+        parents = tuple(rng.sample(sorted(mempool) + sorted(new), rng.choice([1, 2, 3])))
+        new[txid] = (rng.randint(100, 1000), rng.randint(100, 100000), parents)
+    add(mempool, remaining, new)
+
+    chunks = chunks_by_cluster(index, mempool)
+    assert chunks == chunks_by_cluster(ClusterIndex.from_mempool(mempool), mempool)
+
+    for members, linearization in chunks.items():
+        assert {txid for txids, _, _ in linearization for txid in txids} == members
+        fee_rates = [fee / size for _, fee, size in linearization]
+        assert fee_rates == sorted(fee_rates, reverse=True)
+        seen = set()
+        for txids, _, _ in linearization:
+            for txid in txids:
+                assert set(mempool[txid].depends) <= seen
+                seen.add(txid)
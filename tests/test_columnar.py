@@ -0,0 +1,45 @@
+import json
+
+import numpy as np
+
+import columnar
+import generate
+from mempool import Mempool
+
+
+def test_from_json_reads_fees_object():
+    entries = dict(generate.Generator(seed=1).generate(500))
+    assert not {"fee", "modifiedfee", "ancestorfees", "descendantfees"} & set(next(iter(entries.values())))
+    loaded = columnar.ColumnarMempool.from_json(entries)
+    converted = columnar.ColumnarMempool.from_mempool(Mempool.from_json(entries))
+    for field in columnar.ColumnarMempool.int_fields:
+        assert np.array_equal(getattr(loaded, field), getattr(converted, field)), field
+
+
+def test_generated_fixture_loads(tmp_path):
+    mempool_path, template_path = tmp_path / "mempool.json", tmp_path / "template.json"
+    generate.generate_fixture(300, mempool_path, template_path, seed=2)
+    with open(mempool_path) as f:
+        entries = json.load(f)
+    loaded = columnar.ColumnarMempool.from_json(entries)
+    assert len(loaded) == len(entries) == 300
+    assert loaded.ancestorfees.sum() > 0
+    with open(template_path) as f:
+        template = json.load(f)
+    assert {tx["txid"] for tx in template["transactions"]} <= set(entries)
+
+
+def test_seeded_fixture_round_trips(tmp_path):
+    paths = []
+    for name in ("first", "second"):
+        paths.append((tmp_path / f"mempool-{name}.json", tmp_path / f"template-{name}.json"))
+        generate.generate_fixture(500, *paths[-1], seed=7)
+    first, second = ([json.loads(path.read_text()) for path in pair] for pair in paths)
+    assert list(first[0]) == list(second[0])
+    assert first == second
+
+    entries, template = first
+    mempool = columnar.ColumnarMempool.from_json(entries)
+    block = columnar.ColumnarAssembler(mempool).create_block(template["height"], template["version"], template["previousblockhash"])
+    assert [tx["txid"] for tx in template["transactions"]] == list(block.tx)
+    assert template["coinbasevalue"] == block.subsidy + block.fee
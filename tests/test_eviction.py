@@ -0,0 +1,82 @@
+import copy
+import random
+
+import eviction
+import generate
+import graph
+from mempool import Mempool
+
+
+def generated_mempool(size: int, seed: int) -> Mempool:
+    return Mempool.from_json(dict(generate.Generator(seed=seed).generate(size)))
+
+
+def brute_force_trim(mempool: Mempool, size_limit: int, incremental_relay_fee: float):
+    """
+    Evicts for real, rescoring every entry before each eviction. Ties go to the
+    lowest txid, as in `DescendantScoreIndex`.
+    """
+    evicted = packages = 0
+    max_fee_rate_removed = 0.0
+    while mempool.total_vsize > size_limit:
+        txid = min(mempool, key=lambda _txid: (eviction.descendant_score(
+            mempool[_txid].modifiedfee, mempool[_txid].vsize,
+            mempool[_txid].descendantfees, mempool[_txid].descendantsize,
+        ), _txid))
+        tx = mempool[txid]
+        max_fee_rate_removed = max(max_fee_rate_removed, tx.descendantfees / tx.descendantsize + incremental_relay_fee)
+        package = graph.descendants(mempool, txid) | {txid}
+        mempool.remove_transactions(package)
+        evicted += len(package)
+        packages += 1
+    return evicted, packages, max_fee_rate_removed
+
+
+def test_trim_matches_brute_force():
+    mempool = generated_mempool(1500, seed=3)
+    total = mempool.total_vsize
+    limits = [int(total * fraction) for fraction in (0.9, 0.6, 0.3)]
+    results = eviction.trim_to_sizes(mempool, limits, incremental_relay_fee=1.0)
+    assert len(mempool) == 1500
+
+    for result in results:
+        evicted, packages, max_fee_rate_removed = brute_force_trim(generated_mempool(1500, seed=3), result.size_limit, 1.0)
+        assert (result.evicted, result.packages) == (evicted, packages)
+        assert abs(result.max_fee_rate_removed - max_fee_rate_removed) < 1e-9
+
+
+def assert_scores_current(mempool: Mempool):
+    assert mempool.descendant_scores.scores == eviction.DescendantScoreIndex.from_mempool(mempool).scores
+    lowest = mempool.descendant_scores.lowest()
+    assert lowest[0] == min(mempool.descendant_scores.scores.values())
+
+
+def test_descendant_scores_maintained():
+    mempool = generated_mempool(1000, seed=4)
+    mempool.descendant_scores
+    rng = random.Random(4)
+    for _ in range(5):
+        # Closed under descendants, as evictions and replacements are
+        removed = set(rng.sample(sorted(mempool), 30))
+        removed |= graph.descendants_of_set(mempool, removed)
+        entries = {txid: copy.deepcopy(mempool[txid]) for txid in removed}
+        mempool.remove_transactions(removed)
+        assert_scores_current(mempool)
+        mempool.add_transactions(entries)
+        assert_scores_current(mempool)
+
+    # Parents only, so their surviving children are rescored
+    parents = [txid for txid in sorted(mempool) if mempool[txid].spentby][:20]
+    mempool.remove_transactions(parents)
+    assert_scores_current(mempool)
+
+
+def test_print_trim_shows_fractional_limits(capsys):
+    eviction.print_trim([
+        eviction.TrimResult(300_000_000, 0, 0, 0, 0, 1.0, 1.0),
+        eviction.TrimResult(1_500_000, 0, 0, 0, 0, 1.0, 1.0),
+    ])
+    out = capsys.readouterr().out
+    assert " 300.0 |" in out
+    assert " 1.5 |" in out
+    assert " 1.00 |" in out
@@ -0,0 +1,61 @@
+import sys
+
+import graph
+from mempool import Mempool, MempoolTransaction
+
+
+# "top" is spent by "left" and "right", both spent by "bottom"
+DIAMOND = {
+    "top": (100, 1000, ()),
+    "left": (100, 1000, ("top",)),
+    "right": (100, 1000, ("top",)),
+    "bottom": (100, 1000, ("left", "right")),
+    "other": (100, 1000, ()),
+}
+
+
+def test_diamond(make_mempool):
+    mempool = make_mempool(DIAMOND)
+    assert graph.ancestors(mempool, "bottom") == {"top", "left", "right"}
+    assert graph.descendants(mempool, "top") == {"left", "right", "bottom"}
+    assert graph.ancestors(mempool, "top") == set()
+    assert graph.descendants(mempool, "bottom") == set()
+    # The walk stops at excluded transactions
+    assert graph.ancestors(mempool, "bottom", exclude={"left"}) == {"top", "right"}
+    assert graph.descendants(mempool, "top", exclude={"left", "right"}) == set()
+    assert graph.ancestors_of_set(mempool, ["left", "right"]) == {"top"}
+    assert graph.descendants_of_set(mempool, ["left", "other"]) == {"bottom"}
+
+    ordered = graph.parents_first(mempool, mempool)
+    assert sorted(ordered) == sorted(mempool)
+    position = {txid: i for i, txid in enumerate(ordered)}
+    for txid, tx in mempool.items():
+        assert all(position[parent_txid] < position[txid] for parent_txid in tx.depends)
+
+
+def chain(length: int) -> Mempool:
+    """
+    Each transaction spends the one before, aggregates left out
+    """
+    txids = [f"{i:064x}" for i in range(length)]
+    mempool = Mempool()
+    for i, txid in enumerate(txids):
+        mempool[txid] = MempoolTransaction(
+            fee=1000, modifiedfee=1000, vsize=100, weight=400, sigopscost=4, time=0, height=0,
+            descendantcount=0, descendantsize=0, descendantfees=0,
+            ancestorcount=0, ancestorsize=0, ancestorsigops=0, ancestorfees=0,
+            depends=(txids[i - 1],) if i else (),
+            spentby=(txids[i + 1],) if i + 1 < length else (),
+        )
+    return mempool
+
+
+def test_deep_chain():
+    # Deeper than a recursive walk could go
+    length = 4 * sys.getrecursionlimit()
+    mempool = chain(length)
+    txids = list(mempool)
+    assert graph.ancestors(mempool, txids[-1]) == set(txids[:-1])
+    assert graph.descendants(mempool, txids[0]) == set(txids[1:])
+    assert graph.descendants(mempool, txids[10], exclude={txids[20]}) == set(txids[11:20])
+    assert graph.parents_first(mempool, reversed(txids)) == txids
@@ -0,0 +1,16 @@
+def test_without_matches_removal(make_mempool):
+    txs = {
+        "a": (1000, 100, ()),
+        "b": (200, 50000, ("a",)),
+        "c": (200, 1000, ("b",)),
+        "d": (200, 600, ()),
+    }
+    mempool = make_mempool(txs)
+    histogram = mempool.histogram.without(mempool, ["a", "b"])
+    assert mempool.histogram.count_above(0) == 4
+
+    removed = make_mempool(txs)
+    removed.histogram
+    removed.remove_transactions(["a", "b"])
+    assert histogram.entries == removed.histogram.entries
+    assert histogram.vsize == removed.histogram.vsize
@@ -0,0 +1,75 @@
+import decimal
+import io
+import json
+
+import pytest
+
+from authproxy import JSONRPCException
+from conftest import core_entries
+from jsonstream import iter_result_items
+
+
+def response(result, error=None) -> bytes:
+    # Non-ASCII as UTF-8, which small chunks split mid-character
+    return json.dumps({"result": result, "error": error, "id": 1}, ensure_ascii=False).encode()
+
+
+def streamed(body: bytes, chunk_size: int) -> list:
+    return list(iter_result_items(io.BytesIO(body), chunk_size))
+
+
+def expected(body: bytes) -> list:
+    return list(json.loads(body, parse_float=decimal.Decimal)["result"].items())
+
+
+MEMPOOL = core_entries({
+    "a" * 64: (200, 1000, ()),
+    "b" * 64: (150, 123456789, ("a" * 64,)),
+    "c" * 64: (300, 600, ()),
+})
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 16])
+def test_mempool_across_chunk_boundaries(chunk_size):
+    body = response(MEMPOOL)
+    items = streamed(body, chunk_size)
+    assert items == expected(body)
+    # Nested `fees` objects keep their Decimal amounts
+    assert items[1][1]["fees"]["base"] == decimal.Decimal("1.23456789")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5])
+def test_scalars_and_escapes_across_chunk_boundaries(chunk_size):
+    body = response({
+        "int": 1234567890,
+        "float": 0.00012345,
+        "negative": -42e-3,
+        "bool": True,
+        "null": None,
+        "escaped \"key\"": "tab\tquote\"backslash\\",
+        "unicode é€": "\U0001f600 \\u00e9",
+        "nested": {"fees": {"base": 0.0001, "modified": 0.0002}, "list": [1, 22, 333]},
+    })
+    assert streamed(body, chunk_size) == expected(body)
+
+
+@pytest.mark.parametrize("body", [
+    b'{"result": {}, "error": null, "id": 1}',
+    b'{"result":{},"error":null,"id":1}',
+    b' {\n "result" : { } ,\n "error" : null , "id" : 1 }\n',
+])
+def test_empty_mempool(body):
+    for chunk_size in (1, 4, 1 << 16):
+        assert streamed(body, chunk_size) == []
+
+
+def test_error_response():
+    body = response(None, {"code": -28, "message": "Loading block index..."})
+    with pytest.raises(JSONRPCException):
+        streamed(body, 4)
+
+
+def test_error_before_result():
+    body = b'{"error": {"code": -1, "message": "failed"}, "result": null, "id": 1}'
+    with pytest.raises(JSONRPCException):
+        streamed(body, 3)
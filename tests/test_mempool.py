@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+import generate
+import graph
+import miner
+import validation
+from mempool import Mempool
+
+
+def indexed_mempool(size: int, seed: int) -> Mempool:
+    mempool = Mempool.from_json(dict(generate.Generator(seed=seed).generate(size)))
+    # Built now, so both removals have to keep them current
+    mempool.histogram
+    mempool.clusters
+    mempool.descendant_scores
+    return mempool
+
+
+def block_txids(mempool: Mempool) -> list:
+    return list(miner.BlockAssembler(mempool).create_block(650_001, 0x20000000, "00" * 32).tx)
+
+
+def evicted_txids(mempool: Mempool) -> list:
+    # Closed under descendants, leaving their ancestors behind. Children first, so
+    # that each single removal leaves no descendants behind, as a block's parents
+    # first leaves no ancestors.
+    txids = set(random.Random(22).sample(sorted(mempool), 100))
+    return graph.parents_first(mempool, txids | graph.descendants_of_set(mempool, txids))[::-1]
+
+
+@pytest.mark.parametrize("removed", [block_txids, evicted_txids])
+def test_bulk_removal_matches_one_at_a_time(removed):
+    bulk, single = indexed_mempool(6000, seed=21), indexed_mempool(6000, seed=21)
+    txids = removed(bulk)
+    assert 0 < len(txids) < len(bulk)
+    affected = graph.descendants_of_set(bulk, txids) - set(txids)
+
+    stats = bulk.remove_transactions(txids)
+    for txid in txids:
+        single.remove_transaction(txid)
+
+    assert (stats.removed, stats.touched) == (len(txids), len(affected))
+    assert bulk == single
+    assert validation.validate_mempool(bulk) == []
+    assert bulk.histogram.entries == single.histogram.entries
+    assert (bulk.histogram.count, bulk.histogram.vsize, bulk.histogram.fees) == (
+        single.histogram.count, single.histogram.vsize, single.histogram.fees,
+    )
+    assert bulk.descendant_scores.scores == single.descendant_scores.scores
+    bulk.clusters.split(bulk)
+    single.clusters.split(single)
+    assert sorted(map(sorted, bulk.clusters.members.values())) == sorted(map(sorted, single.clusters.members.values()))
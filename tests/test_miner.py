@@ -0,0 +1,38 @@
+import miner
+
+
+# A pays little, its child B pays for it, B's child C pays more than D alone
+CHAIN = {
+    "a": (1000, 100, ()),
+    "b": (200, 50000, ("a",)),
+    "c": (200, 1000, ("b",)),
+    "d": (200, 600, ()),
+}
+
+
+def test_grandchild_modified_entry(make_mempool):
+    mempool = make_mempool(CHAIN)
+    assembler = miner.BlockAssembler(mempool)
+    assembler.skip(["a", "b"])
+    # Both included ancestors are subtracted, not only the parent
+    assert assembler.modified["c"] == [200, 1000, 4]
+
+
+def test_grandchild_rescored(make_mempool):
+    mempool = make_mempool(CHAIN)
+    block = miner.BlockAssembler(mempool).create_block(650001, 0x20000000, "00" * 32)
+    assert list(block.tx) == ["a", "b", "c", "d"]
+
+
+def test_empty_mempool(make_mempool):
+    block = miner.get_blocktemplate(make_mempool({}), 650001, 0x20000000, "00" * 32)
+    assert not block.tx
+
+
+def test_projected_parents(make_mempool):
+    # Room for one 1000 vB transaction per block, after the coinbase
+    policy = miner.AssemblyPolicy(max_weight=miner.COINBASE_WEIGHT + 4001)
+    mempool = make_mempool({txid: (1000, 10000, ()) for txid in "abc"})
+    blocks = miner.project_blocks(mempool, 650001, 0x20000000, "ab" * 32, 3, policy=policy)
+    assert [len(block.tx) for block in blocks] == [1, 1, 1]
+    assert [block.previousblockhash for block in blocks] == ["ab" * 32, None, None]
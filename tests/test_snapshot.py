@@ -0,0 +1,61 @@
+import attr
+import numpy as np
+
+import generate
+from columnar import ColumnarMempool
+from mempool import Mempool
+
+
+def generated_mempool(size: int, seed: int) -> Mempool:
+    return Mempool.from_json(dict(generate.Generator(seed=seed).generate(size)))
+
+
+def links(mempool: Mempool) -> dict:
+    return {txid: (set(tx.depends), set(tx.spentby)) for txid, tx in mempool.items()}
+
+
+def columnar_links(mempool: ColumnarMempool) -> dict:
+    return {
+        txid: (
+            {mempool.txids[j] for j in mempool.parents[mempool.parents_indptr[i]:mempool.parents_indptr[i + 1]]},
+            {mempool.txids[j] for j in mempool.children[mempool.children_indptr[i]:mempool.children_indptr[i + 1]]},
+        )
+        for i, txid in enumerate(mempool.txids)
+    }
+
+
+def test_mempool_round_trip(tmp_path):
+    mempool = generated_mempool(500, seed=11)
+    mempool.sequence = 1234
+    path = tmp_path / "mempool.bin"
+    mempool.save(path)
+
+    loaded = Mempool.load(path)
+    assert list(loaded) == list(mempool)
+    assert loaded.sequence == 1234
+    assert links(loaded) == links(mempool)
+    for txid, tx in mempool.items():
+        assert attr.evolve(loaded[txid], depends=tx.depends, spentby=tx.spentby) == tx
+
+
+def test_unknown_sequence_round_trips(tmp_path):
+    path = tmp_path / "mempool.bin"
+    generated_mempool(10, seed=12).save(path)
+    assert Mempool.load(path).sequence is None
+
+
+def test_columnar_loads_mempool_snapshot(tmp_path):
+    mempool = generated_mempool(500, seed=13)
+    path = tmp_path / "mempool.bin"
+    mempool.save(path)
+
+    loaded = ColumnarMempool.load(path)
+    converted = ColumnarMempool.from_mempool(mempool)
+    assert loaded.txids == converted.txids
+    for field in ColumnarMempool.int_fields:
+        assert np.array_equal(getattr(loaded, field), getattr(converted, field)), field
+    assert columnar_links(loaded) == links(mempool)
+
+    # And back again
+    loaded.save(tmp_path / "columnar.bin")
+    assert links(Mempool.load(tmp_path / "columnar.bin")) == links(mempool)
@@ -0,0 +1,98 @@
+import rpc
+import validation
+from mempool import Mempool
+
+
+def test_full_fetch_then_incremental(fake_node):
+    fake_node.txs = {"a": (200, 1000, ()), "b": (150, 3000, ("a",)), "c": (300, 600, ())}
+    mempool = rpc.sync_mempool(Mempool())
+    assert set(mempool) == {"a", "b", "c"}
+    assert mempool["a"].descendantcount == 2
+
+    # "c" is mined, "d" spends "b"
+    del fake_node.txs["c"]
+    fake_node.txs["d"] = (100, 500, ("b",))
+    fake_node.sequence += 1
+    rpc.sync_mempool(mempool)
+    assert set(mempool) == {"a", "b", "d"}
+    assert mempool["a"].descendantcount == 3
+    assert mempool["a"].descendantfees == 4500
+    assert mempool["d"].ancestorcount == 3
+    assert validation.validate_mempool(mempool) == []
+
+
+def test_unchanged_sequence_fetches_nothing(fake_node):
+    fake_node.txs = {"a": (200, 1000, ())}
+    mempool = rpc.sync_mempool(Mempool())
+    fake_node.txs["b"] = (150, 3000, ())
+    rpc.sync_mempool(mempool)
+    assert set(mempool) == {"a"}
+
+
+def test_child_arriving_after_listing(fake_node):
+    fake_node.txs = {"a": (200, 1000, ())}
+    mempool = rpc.sync_mempool(Mempool())
+
+    # "b" and its child "c" arrive, but "c" only after the listing, though the
+    # entry for "b" fetched afterwards already counts it
+    fake_node.txs["b"] = (150, 3000, ("a",))
+    fake_node.txs["c"] = (100, 500, ("b",))
+    fake_node.listed = {"a", "b"}
+    fake_node.sequence += 1
+    rpc.sync_mempool(mempool)
+    assert mempool["b"].spentby == ()
+    assert mempool["b"].descendantcount == 1
+    assert mempool["a"].descendantcount == 2
+    assert validation.validate_mempool(mempool) == []
+
+    fake_node.listed = None
+    fake_node.sequence += 1
+    rpc.sync_mempool(mempool)
+    assert mempool["b"].descendantcount == 2
+    assert mempool["b"].descendantsize == 250
+    assert mempool["a"].descendantcount == 3
+    assert mempool["a"].descendantfees == 4500
+    assert validation.validate_mempool(mempool) == []
+
+
+def test_parent_arriving_after_child(fake_node):
+    fake_node.txs = {"a": (200, 1000, ())}
+    mempool = rpc.sync_mempool(Mempool())
+
+    # "c" and its child "d" are listed, their parent "b" only on the next sync
+    fake_node.txs.update({"b": (150, 3000, ("a",)), "c": (100, 500, ("b",)), "d": (100, 700, ("c",))})
+    fake_node.listed = {"a", "c", "d"}
+    fake_node.sequence += 1
+    rpc.sync_mempool(mempool)
+    assert mempool["a"].descendantcount == 1
+    assert mempool["c"].ancestorcount == 1
+
+    fake_node.listed = None
+    fake_node.sequence += 1
+    rpc.sync_mempool(mempool)
+    # "b" bridges "a" to "c" and "d"
+    assert mempool["a"].descendantcount == 4
+    assert mempool["a"].descendantsize == 550
+    assert mempool["a"].descendantfees == 5200
+    assert mempool["d"].ancestorcount == 4
+    assert mempool["d"].ancestorfees == 5200
+    assert validation.validate_mempool(mempool) == []
+
+
+def test_second_path_counted_once(fake_node):
+    fake_node.txs = {"a": (200, 1000, ()), "b": (150, 3000, ("a",))}
+    mempool = rpc.sync_mempool(Mempool())
+
+    fake_node.txs.update({"c": (100, 500, ("a",)), "d": (100, 700, ("b", "c"))})
+    fake_node.listed = {"a", "b", "d"}
+    fake_node.sequence += 1
+    rpc.sync_mempool(mempool)
+    assert mempool["a"].descendantcount == 3
+
+    fake_node.listed = None
+    fake_node.sequence += 1
+    rpc.sync_mempool(mempool)
+    # "d" was already a descendant of "a" through "b"
+    assert mempool["a"].descendantcount == 4
+    assert mempool["d"].ancestorcount == 4
+    assert validation.validate_mempool(mempool) == []
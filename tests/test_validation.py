@@ -0,0 +1,41 @@
+import miner
+import validation
+
+
+TXS = {
+    "a": (1000, 100, ()),
+    "b": (200, 50000, ("a",)),
+    "c": (200, 1000, ("b",)),
+}
+
+
+def test_validate_mempool(make_mempool):
+    mempool = make_mempool(TXS)
+    assert validation.validate_mempool(mempool) == []
+    mempool["c"].ancestorcount = 2
+    findings = validation.validate_mempool(mempool)
+    assert [(finding.check, finding.txid) for finding in findings] == [("aggregate", "c")]
+
+
+def test_validate_block_with_policy(make_mempool):
+    policy = miner.AssemblyPolicy(coinbase_weight=8000, coinbase_sigops=800)
+    block = miner.BlockAssembler(make_mempool(TXS), policy).create_block(650001, 0x20000000, "00" * 32)
+    assert validation.validate_block(block, coinbase_weight=8000, coinbase_sigops=800) == []
+    assert miner.check_block(block, policy=policy)
+    # Checked against Core's reservation, the totals don't add up
+    assert {finding.check for finding in validation.validate_block(block)} == {"aggregate"}
+
+
+def test_check_block_against_policy_limits(make_mempool):
+    mempool = make_mempool(TXS)
+    policy = miner.AssemblyPolicy(max_weight=9000, max_sigops=410)
+    # Everything fits within consensus limits, but not the reduced ones
+    block = miner.BlockAssembler(mempool).create_block(650001, 0x20000000, "00" * 32)
+    assert miner.check_block(block)
+    assert not miner.check_block(block, policy=policy)
+    findings = validation.validate_block(block, max_weight=9000, max_sigops=410)
+    assert [finding.message for finding in findings] == ["weight: 9,600 > 9,000", "sigops: 412 > 410"]
+
+    block = miner.BlockAssembler(mempool, policy).create_block(650001, 0x20000000, "00" * 32)
+    assert list(block.tx) == ["a", "b"]
+    assert miner.check_block(block, policy=policy)
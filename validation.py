@@ -0,0 +1,180 @@
+"""
+Consistency checks for mempools and blocks.
+
+Checks collect `Finding`s instead of asserting, so a caller can log, count or act
+on every problem at once. `validate_mempool` makes one pass over the entries for
+the link checks and recomputes every ancestor aggregate with NumPy from the
+(descendant, ancestor) pairs of the whole mempool, which keeps it cheap enough to
+run on each refresh.
+"""
+import itertools
+import logging
+import operator
+from collections import Counter
+
+import attr
+import numpy as np
+
+import graph
+import metrics
+from block import Block, COINBASE_WEIGHT, COINBASE_SIGOPS
+from consensus import MAX_BLOCK_WEIGHT, MAX_BLOCK_SIGOPS_COST
+
+
+logger = logging.getLogger(__name__)
+
+# Aggregates recomputed by `validate_mempool`, with the field each one sums over
+# the entry and its ancestors or descendants. None counts entries.
+AGGREGATES = [
+    ("ancestorcount", None, "ancestors"),
+    ("ancestorsize", "vsize", "ancestors"),
+    ("ancestorfees", "modifiedfee", "ancestors"),
+    ("ancestorsigops", "sigopscost", "ancestors"),
+    ("descendantcount", None, "descendants"),
+    ("descendantsize", "vsize", "descendants"),
+    ("descendantfees", "modifiedfee", "descendants"),
+]
+SOURCES = ["vsize", "modifiedfee", "sigopscost"]
+
+
+@attr.s(frozen=True)
+class Finding(object):
+    """
+    One problem found by a check. `check` is one of "missing", "asymmetric",
+    "aggregate", "order" or "limit"; `txid` is None for block-wide findings.
+    """
+    check = attr.ib(type=str)
+    txid = attr.ib()
+    message = attr.ib(type=str)
+
+
+def _ancestor_pairs(n: int, edges) -> tuple:
+    """
+    (descendant, ancestor) index arrays covering every ancestor of every index,
+    each pair once, from (child, parent) `edges`
+    """
+    if not edges.size:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    indptr, parents = graph.csr(n, edges)
+    return graph.reachable_pairs(n, indptr, parents, np.arange(n))
+
+
+@metrics.timed("validate", target="mempool")
+def validate_mempool(mempool) -> list:
+    """
+    Check every `depends` and `spentby` link resolves and has its counterpart, and
+    that each entry's ancestor and descendant aggregates match its ancestors and
+    descendants
+    """
+    findings = []
+    index = {txid: i for i, txid in enumerate(mempool)}
+    edges = []
+    for i, (txid, tx) in enumerate(mempool.items()):
+        for parent_txid in tx.depends:
+            j = index.get(parent_txid)
+            if j is None:
+                findings.append(Finding("missing", txid, f"parent {parent_txid} not in mempool"))
+                continue
+            if txid not in mempool[parent_txid].spentby:
+                findings.append(Finding("asymmetric", txid, f"parent {parent_txid} doesn't list it in spentby"))
+            edges.append((i, j))
+        for child_txid in tx.spentby:
+            child = mempool.get(child_txid)
+            if child is None:
+                findings.append(Finding("missing", txid, f"child {child_txid} not in mempool"))
+            elif txid not in child.depends:
+                findings.append(Finding("asymmetric", txid, f"child {child_txid} doesn't list it in depends"))
+
+    n = len(mempool)
+    fields = [field for field, _, _ in AGGREGATES]
+    values = np.fromiter(
+        itertools.chain.from_iterable(map(operator.attrgetter(*fields, *SOURCES), mempool.values())),
+        dtype=np.int64, count=n * (len(fields) + len(SOURCES)),
+    ).reshape(n, len(fields) + len(SOURCES))
+    recorded = values[:, :len(fields)]
+    own = {source: values[:, len(fields) + k] for k, source in enumerate(SOURCES)}
+
+    expected = np.empty_like(recorded)
+    descendant, ancestor = _ancestor_pairs(n, np.array(edges, dtype=np.int64).reshape(-1, 2))
+    # Sum over each entry's ancestors by descendant index, and vice versa
+    pairs = {"ancestors": (descendant, ancestor), "descendants": (ancestor, descendant)}
+    for k, (field, source, direction) in enumerate(AGGREGATES):
+        entry, other = pairs[direction]
+        if source is None:
+            expected[:, k] = 1 + np.bincount(entry, minlength=n)
+        else:
+            # Float sums of integers are exact below 2 ** 53
+            expected[:, k] = own[source] + np.rint(np.bincount(entry, weights=own[source][other], minlength=n)).astype(np.int64)
+
+    txids = list(mempool)
+    for i in np.flatnonzero((recorded != expected).any(axis=1)):
+        wrong = ", ".join(
+            f"{field} {recorded[i, k]} != {expected[i, k]}"
+            for k, field in enumerate(fields) if recorded[i, k] != expected[i, k]
+        )
+        findings.append(Finding("aggregate", txids[i], f"{wrong} recomputed"))
+
+    metrics.inc("validation_findings", len(findings), target="mempool")
+    return findings
+
+
+def _sigops(block: Block) -> int:
+    if isinstance(block.tx, dict):
+        return sum(tx.sigopscost for tx in block.tx.values())
+    return sum(tx["sigops"] for tx in block.tx)
+
+
+@metrics.timed("validate", target="block")
+def validate_block(
+    block: Block, included=frozenset(),
+    coinbase_weight: int = COINBASE_WEIGHT,
+    coinbase_sigops: int = COINBASE_SIGOPS,
+    max_weight: int = MAX_BLOCK_WEIGHT,
+    max_sigops: int = MAX_BLOCK_SIGOPS_COST,
+) -> list:
+    """
+    Check a template or assembled block: every parent is earlier in the block or
+    in `included`, the transactions of earlier projected blocks, the block's
+    recorded totals match its transactions and it is within the weight and
+    sigops limits, consensus ones by default. The coinbase is accounted for with
+    the reservation the block was assembled with, Core's by default.
+    """
+    findings = []
+    entries = block.entries()
+    position = {txid: i for i, txid in enumerate(entries)}
+    weight = coinbase_weight
+    sigops = coinbase_sigops + _sigops(block)
+    fee = 0
+
+    for i, (txid, (tx_fee, tx_weight, depends)) in enumerate(entries.items()):
+        weight += tx_weight
+        fee += tx_fee
+        for parent_txid in depends:
+            j = position.get(parent_txid)
+            if j is None:
+                if parent_txid not in included:
+                    findings.append(Finding("missing", txid, f"parent {parent_txid} neither in block nor included earlier"))
+            elif j > i:
+                findings.append(Finding("order", txid, f"parent {parent_txid} comes after it in the block"))
+
+    for name, recorded, recomputed in (("weight", block.weight, weight), ("sigops", block.sigopscost, sigops), ("fee", block.fee, fee)):
+        if recorded != recomputed:
+            findings.append(Finding("aggregate", None, f"block {name} {recorded:,} != {recomputed:,} recomputed"))
+    if weight > max_weight:
+        findings.append(Finding("limit", None, f"weight: {weight:,} > {max_weight:,}"))
+    if sigops > max_sigops:
+        findings.append(Finding("limit", None, f"sigops: {sigops:,} > {max_sigops:,}"))
+
+    metrics.inc("validation_findings", len(findings), target="block")
+    return findings
+
+
+def log_findings(findings: list, what: str, limit: int = 10):
+    """
+    Log the first `limit` findings and a count of each kind
+    """
+    for finding in findings[:limit]:
+        logger.error(f"{what}: {finding.check}{'' if finding.txid is None else ' ' + finding.txid}: {finding.message}")
+    if len(findings) > limit:
+        counts = Counter(finding.check for finding in findings)
+        logger.error(f"{what}: {len(findings)} findings in all, " + ", ".join(f"{count} {check}" for check, count in sorted(counts.items())))